@@ -0,0 +1,130 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Benchmark parsing of large kube_node_created responses.
+
+Compares CostGetter.parse_create_response with the previous pure Python
+implementation on a synthetic response.
+
+    python benchmarks/cost_parse_benchmark.py --nodes 300 --days 3
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import random
+import timeit
+
+from kiosk_client.cost import CostGetter
+
+
+def parse_create_response_loop(response, benchmarking_start_time):
+    """The previous implementation of CostGetter.parse_create_response"""
+    node_info = {}
+    for time_series in response['data']['result']:
+        node_name = time_series['metric']['node']
+        node_info[node_name] = {}
+        first_event = time_series['values'][0]
+        last_event = time_series['values'][-1]
+
+        if first_event[-1] == last_event[-1]:
+            created_at = int(last_event[-1])
+            created_at = max(created_at, benchmarking_start_time)
+            node_info[node_name]['lifetime'] = last_event[0] - created_at
+            continue
+
+        lifetime = 0
+        curr_label = None
+        for i in range(len(time_series['values']) - 1, 0, -1):
+            ts, created_at = time_series['values'][i]
+            created_at = int(created_at)
+            if created_at != curr_label:
+                curr_label = created_at
+                created_at = max(created_at, benchmarking_start_time)
+                lifetime += ts - created_at
+
+        node_info[node_name]['lifetime'] = lifetime
+    return node_info
+
+
+def make_response(num_nodes, start, end, step, max_events):
+    """Create a kube_node_created response of autoscaled nodes"""
+    result = []
+    timestamps = list(range(start, end + 1, step))
+    for i in range(num_nodes):
+        num_events = random.randint(1, max_events)
+        breaks = sorted(random.sample(range(1, len(timestamps)),
+                                      num_events - 1))
+        values = []
+        created_at = start - random.randint(0, 3600)
+        for j, ts in enumerate(timestamps):
+            if breaks and j == breaks[0]:
+                breaks.pop(0)
+                created_at = ts
+            values.append([ts, str(created_at)])
+        result.append({'metric': {'node': 'node-%s' % i}, 'values': values})
+    return {'status': 'success',
+            'data': {'resultType': 'matrix', 'result': result}}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=300)
+    parser.add_argument('--days', type=float, default=3)
+    parser.add_argument('--step', type=int, default=15)
+    parser.add_argument('--max-events', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    end = CostGetter.get_time()
+    start = end - int(args.days * 24 * 60 * 60)
+    response = make_response(args.nodes, start, end, args.step,
+                             args.max_events)
+    num_points = sum(len(r['values']) for r in response['data']['result'])
+    print('Parsing %s nodes with %s points.' % (args.nodes, num_points))
+
+    cg = CostGetter(benchmarking_start_time=start,
+                    benchmarking_end_time=end)
+
+    expected = parse_create_response_loop(response, start)
+    parsed = cg.parse_create_response(response)
+    for node, info in expected.items():
+        assert info['lifetime'] == parsed[node]['lifetime'], node
+
+    loop_time = min(timeit.repeat(
+        lambda: parse_create_response_loop(response, start),
+        number=1, repeat=args.repeat))
+    numpy_time = min(timeit.repeat(
+        lambda: cg.parse_create_response(response),
+        number=1, repeat=args.repeat))
+
+    print('loop:  %.3fs' % loop_time)
+    print('numpy: %.3fs' % numpy_time)
+    print('speedup: %.1fx' % (loop_time / numpy_time))
+
+
+if __name__ == '__main__':
+    main()
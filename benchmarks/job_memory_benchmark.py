@@ -0,0 +1,99 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Benchmark the memory used by each Job of a large run.
+
+Creates many summarized jobs, as kept by the BenchmarkingJobManager
+for the whole run, and reports the bytes allocated per job.
+
+    python benchmarks/job_memory_benchmark.py --jobs 1000000
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import gc
+import tempfile
+import tracemalloc
+
+from kiosk_client.job import Job
+
+
+def make_job(i, output_dir, pool):
+    """Create a job and fill in typical summary data"""
+    job = Job(host='http://localhost:8080',
+              filepath='image.png',
+              model_name='model',
+              model_version=0,
+              job_type='segmentation',
+              update_interval=10,
+              expire_time=3600,
+              output_dir=output_dir,
+              pool=pool)
+
+    # values as they are returned by the Redis API
+    job.job_id = 'predict:{:032x}:image.png'.format(i)
+    job.status = 'done'
+    job.created_at = '2021-01-01T00:00:00.000000'
+    job.finished_at = '2021-01-01T00:00:30.000000'
+    job.output_url = 'https://storage.googleapis.com/bucket/output/' \
+                     '{:032x}.zip'.format(i)
+    job.prediction_time = '12.{}'.format(i % 1000)
+    job.postprocess_time = '1.{}'.format(i % 1000)
+    job.upload_time = '0.{}'.format(i % 1000)
+    job.download_time = '0.{}'.format(i % 1000)
+    job.total_time = '30.{}'.format(i % 1000)
+    job.total_jobs = '1'
+    job.predict_retries = '0'
+    job.cleanup_time = '0.{}'.format(i % 1000)
+    job.children_upload_time = 'None'
+    job.reason = 'None'
+    job.is_expired = True
+    return job
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=1000000)
+    args = parser.parse_args()
+
+    output_dir = tempfile.mkdtemp()
+    pool = object()  # shared by all jobs
+
+    gc.collect()
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    jobs = [make_job(i, output_dir, pool) for i in range(args.jobs)]
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total = end - start
+    print('Created %s jobs using %.1f MB.' % (len(jobs), total / 2 ** 20))
+    print('%.0f bytes per job.' % (total / len(jobs)))
+
+
+if __name__ == '__main__':
+    main()
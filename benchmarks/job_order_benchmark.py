@@ -0,0 +1,99 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Simulate the makespan of a batch submitted in each job order.
+
+Jobs take time proportional to the size of their file, a few files are
+much larger than the rest, and the cluster runs a fixed number of jobs
+at once. Each job starts on the first free worker, in submission order.
+
+    python benchmarks/job_order_benchmark.py --files 500 --workers 16
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import heapq
+import random
+
+from kiosk_client.scheduling import CostEstimator
+
+
+def makespan(durations, num_workers):
+    """The time the last job finishes, starting each job when a worker
+    is free."""
+    workers = [0.0] * num_workers
+    for duration in durations:
+        heapq.heappush(workers, heapq.heappop(workers) + duration)
+    return max(workers)
+
+
+def order(sizes, name, estimator):
+    """Order the sizes the same way as SubmissionQueue."""
+    if name == 'discovery':
+        return list(sizes)
+    estimates = sorted(sizes, key=lambda s: estimator.estimate((s, 0, 1)))
+    if name == 'largest-first':
+        return estimates[::-1]
+    if name == 'shortest-first':
+        return estimates
+    interleaved = []
+    while estimates:
+        interleaved.append(estimates.pop())
+        if estimates:
+            interleaved.append(estimates.pop(0))
+    return interleaved
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--large', type=float, default=0.02,
+                        help='Fraction of files that are large archives.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    sizes = [random.lognormvariate(0, 0.5) for _ in range(args.files)]
+    for _ in range(int(args.files * args.large)):
+        # large files are found last, as in a separate directory
+        sizes.append(random.uniform(20, 60))
+    seconds = [10 + 5 * s for s in sizes]
+    duration = dict(zip(sizes, seconds))
+
+    estimator = CostEstimator()
+    for name in ('discovery', 'largest-first', 'shortest-first',
+                 'interleave'):
+        ordered = order(sizes, name, estimator)
+        print('%-15s %8.1fs' % (name, makespan(
+            [duration[s] for s in ordered], args.workers)))
+    print('%-15s %8.1fs' % ('lower bound', max(
+        sum(seconds) / args.workers, max(seconds))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Benchmark the startup time of the client.
+
+Each command is run in a new interpreter, as each cycle of the
+entrypoint starts a new process.
+
+    python benchmarks/startup_benchmark.py --repeat 10
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import os
+import subprocess
+import sys
+import timeit
+
+
+COMMANDS = (
+    ('python', ['-c', 'pass']),
+    ('import kiosk_client', ['-c', 'import kiosk_client']),
+    ('import kiosk_client.manager', ['-c', 'import kiosk_client.manager']),
+    ('kiosk_client --help', ['-m', 'kiosk_client', '--help']),
+)
+
+
+def time_command(args, repeat):
+    """Get the median seconds to run the interpreter with the args."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.path.dirname(
+        os.path.dirname(os.path.abspath(__file__)))
+    times = []
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        subprocess.check_call([sys.executable] + args, env=env,
+                              stdout=subprocess.DEVNULL)
+        times.append(timeit.default_timer() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for name, command in COMMANDS:
+        print('%-30s %6.0f ms' % (name, time_command(command, args.repeat)
+                                  * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -27,10 +27,30 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from kiosk_client import cost
-from kiosk_client import job
-from kiosk_client import manager
-from kiosk_client import utils
+import importlib
+import sys
+import types
+
+# submodules are imported when they are first used, to start up quickly
+_SUBMODULES = ('cost', 'job', 'manager', 'utils')
+
+
+class _LazyModule(types.ModuleType):
+    """Imports submodules when they are first used as attributes.
+
+    A module-level __getattr__ requires Python 3.7, but the class of a
+    module can be replaced since Python 3.5.
+    """
+
+    def __getattr__(self, name):
+        if name in _SUBMODULES:
+            return importlib.import_module('{}.{}'.format(self.__name__, name))
+        raise AttributeError('module {!r} has no attribute {!r}'.format(
+            self.__name__, name))
+
+
+sys.modules[__name__].__class__ = _LazyModule
+
 
 del absolute_import
 del division
@@ -34,9 +34,7 @@ import logging.handlers
 import os
 import sys
 
-from twisted.internet import reactor
-
-from kiosk_client import manager
+from kiosk_client import logs
 from kiosk_client import settings
 
 
@@ -73,7 +71,15 @@ def get_arg_parser():
                         help='Type of job (name of Redis work queue).')
 
     parser.add_argument('-t', '--host', type=str, required=True,
-                        help='IP or FQDN of the DeepCell Kiosk API.')
+                        help='IP or FQDN of the DeepCell Kiosk API. '
+                             'Use a comma-separated list to spread jobs '
+                             'across several hosts.')
+
+    parser.add_argument('--load-balancing', type=str,
+                        default=settings.LOAD_BALANCING,
+                        choices=['round-robin', 'least-outstanding', 'ewma'],
+                        help='How the host of each job is chosen if there '
+                             'are several hosts.')
 
     parser.add_argument('-m', '--model', type=str,
                         default=settings.MODEL,
@@ -132,6 +138,58 @@ def get_arg_parser():
                         help='Time between each job creation '
                              '(0.5s is a typical file upload time).')
 
+    parser.add_argument('--max-active-jobs', type=int,
+                        default=settings.MAX_ACTIVE_JOBS,
+                        help='Maximum number of unfinished jobs in '
+                             '`benchmark` mode. Unlimited if 0.')
+
+    parser.add_argument('--preflight-connections', type=int,
+                        default=settings.PREFLIGHT_CONNECTIONS,
+                        help='Number of connections to the host opened '
+                             'before the first job is created. Each only '
+                             'serves the first request that uses it, as '
+                             'jobs close their connections. Disabled if 0.')
+
+    parser.add_argument('--preflight-probes', type=int,
+                        default=settings.PREFLIGHT_PROBES,
+                        help='Number of requests used to measure the '
+                             'latency of the host before the first job is '
+                             'created. Disabled if 0.')
+
+    parser.add_argument('--hedge-percentile', type=float,
+                        default=settings.HEDGE_PERCENTILE,
+                        help='Start a duplicate of each job that has been '
+                             'in its status for longer than this percentile '
+                             'of the durations of the status. Whichever '
+                             'finishes first is kept. Disabled if 0.')
+
+    parser.add_argument('--hedge-min-samples', type=int,
+                        default=settings.HEDGE_MIN_SAMPLES,
+                        help='Number of durations of a status needed before '
+                             'jobs in that status are duplicated.')
+
+    parser.add_argument('--max-hedges', type=int,
+                        default=settings.MAX_HEDGES,
+                        help='Maximum number of duplicate jobs. '
+                             'Unlimited if 0.')
+
+    parser.add_argument('--job-timeout', type=float,
+                        default=settings.JOB_TIMEOUT,
+                        help='Seconds each job may run before it is timed '
+                             'out and expired. Disabled if 0.')
+
+    parser.add_argument('--time-budget', type=float,
+                        default=settings.TIME_BUDGET,
+                        help='Seconds the run may take before it stops '
+                             'submitting new jobs and drains unfinished '
+                             'jobs. Disabled if 0.')
+
+    parser.add_argument('--drain-timeout', type=float,
+                        default=settings.DRAIN_TIMEOUT,
+                        help='Seconds unfinished jobs may run once the '
+                             'time budget is used, before they are timed '
+                             'out.')
+
     parser.add_argument('--update-interval', type=float,
                         default=settings.UPDATE_INTERVAL,
                         help='Seconds between each job status refresh.')
@@ -140,6 +198,11 @@ def get_arg_parser():
                         default=settings.MANAGER_REFRESH_RATE,
                         help='Seconds between each manager status check.')
 
+    parser.add_argument('--cost-update-interval', type=float,
+                        default=settings.COST_UPDATE_INTERVAL,
+                        help='Seconds between each running cost update if '
+                             'using `--calculate-cost`. Disabled if 0.')
+
     parser.add_argument('-x', '--expire-time', type=float,
                         default=settings.EXPIRE_TIME,
                         help='Finished jobs expire after this many seconds.')
@@ -149,6 +212,18 @@ def get_arg_parser():
                         choices=('DEBUG', 'INFO', 'WARN', 'ERROR', 'CRITICAL'),
                         help='Only log the given level and above.')
 
+    parser.add_argument('--log-json', action='store_true',
+                        default=settings.LOG_JSON,
+                        help='Write each log record as a line of JSON.')
+
+    parser.add_argument('--log-request-sample-rate', type=float,
+                        default=settings.LOG_REQUEST_SAMPLE_RATE,
+                        help='Fraction of HTTP request logs to keep.')
+
+    parser.add_argument('--log-status-sample-rate', type=float,
+                        default=settings.LOG_STATUS_SAMPLE_RATE,
+                        help='Fraction of job status poll logs to keep.')
+
     # optional arguments
     parser.add_argument('--upload-prefix', type=str,
                         default=settings.UPLOAD_PREFIX,
@@ -157,21 +232,130 @@ def get_arg_parser():
     parser.add_argument('--output-dir', default=settings.OUTPUT_DIR,
                         help='Directory to save the job output.')
 
+    parser.add_argument('--output-format', default=settings.OUTPUT_FORMAT,
+                        choices=['json', 'npz'],
+                        help='Format of the output file. "npz" saves job '
+                             'data as compressed columns.')
+
+    parser.add_argument('--job-store', type=str,
+                        default=settings.JOB_STORE,
+                        help='Path of a JSON lines file of finished jobs. '
+                             'Finished jobs are dropped from memory.')
+
+    parser.add_argument('--upload-index', type=str,
+                        default=settings.UPLOAD_INDEX,
+                        help='Path of a persistent index of uploaded files. '
+                             'Files with the same content as a previously '
+                             'uploaded file are not uploaded again.')
+
+    parser.add_argument('--upload-index-max-entries', type=int,
+                        default=settings.UPLOAD_INDEX_MAX_ENTRIES,
+                        help='Maximum number of files in the upload index.')
+
+    parser.add_argument('--upload-index-max-age', type=float,
+                        default=settings.UPLOAD_INDEX_MAX_AGE,
+                        help='Files are uploaded again after this many '
+                             'seconds.')
+
+    parser.add_argument('--hash-workers', type=int,
+                        default=settings.HASH_WORKERS,
+                        help='Number of threads used to hash files.')
+
+    parser.add_argument('--result-cache', type=str,
+                        default=settings.RESULT_CACHE_DIR,
+                        help='Directory of a local cache of job results. '
+                             'Files already processed with the same job '
+                             'parameters are not processed again.')
+
+    parser.add_argument('--result-cache-max-bytes', type=int,
+                        default=settings.RESULT_CACHE_MAX_BYTES,
+                        help='Maximum size of the result cache in bytes.')
+
+    parser.add_argument('--result-cache-max-age', type=float,
+                        default=settings.RESULT_CACHE_MAX_AGE,
+                        help='Cached results expire after this many seconds.')
+
+    parser.add_argument('--bundle-size', type=int,
+                        default=settings.BUNDLE_SIZE,
+                        help='Bundle images smaller than this many bytes '
+                             'into zip archives of up to this many bytes, '
+                             'so many small images are processed in a '
+                             'single job. Disabled if 0.')
+
+    parser.add_argument('--bundle-count', type=int,
+                        default=settings.BUNDLE_COUNT,
+                        help='Maximum number of images in each bundle.')
+
+    parser.add_argument('--shard-size', type=int,
+                        default=settings.SHARD_SIZE,
+                        help='Split zip archives larger than this many '
+                             'bytes into NUM_SHARDS jobs which are '
+                             'processed in parallel. Disabled if 0.')
+
+    parser.add_argument('--num-shards', type=int,
+                        default=settings.NUM_SHARDS,
+                        help='Number of jobs to split each large zip '
+                             'archive into.')
+
+    parser.add_argument('--shard-by', type=str,
+                        default=settings.SHARD_BY, choices=['bytes', 'count'],
+                        help='Balance shards by the size or the number of '
+                             'their members.')
+
+    parser.add_argument('--tile-size', type=int,
+                        default=settings.TILE_SIZE,
+                        help='Split images wider or taller than this many '
+                             'pixels into overlapping tiles which are '
+                             'processed in parallel and stitched back '
+                             'together. Disabled if 0.')
+
+    parser.add_argument('--tile-overlap', type=int,
+                        default=settings.TILE_OVERLAP,
+                        help='Number of pixels shared by adjacent tiles.')
+
+    parser.add_argument('--job-order', type=str,
+                        default=settings.JOB_ORDER,
+                        choices=['discovery', 'largest-first',
+                                 'shortest-first', 'interleave'],
+                        help='Order the files of a batch by the estimated '
+                             'time of their jobs.')
+
+    parser.add_argument('--probe-dimensions', action='store_true',
+                        default=settings.PROBE_DIMENSIONS,
+                        help='Count the pixels of each image to estimate '
+                             'the time of its job.')
+
+    parser.add_argument('--upload-chunk-size', type=int,
+                        default=settings.UPLOAD_CHUNK_SIZE,
+                        help='Number of bytes sent at a time when uploading '
+                             'files.')
+
+    parser.add_argument('--chunked-upload', action='store_true',
+                        default=settings.CHUNKED_UPLOAD,
+                        help='Upload files using chunked transfer encoding.')
+
     return parser
 
 
-def initialize_logger(log_level):
-    logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)
-
+def initialize_logger(log_level, queued=True, json_format=False,
+                      sample_rates=None):
     log_level = getattr(logging, log_level)
 
-    formatter = logging.Formatter(fmt=settings.LOG_FORMAT)
+    logger = logging.getLogger()
+    logger.setLevel(log_level)  # skip records no handler would write
+
+    if json_format:
+        formatter = logs.JSONFormatter()
+    else:
+        formatter = logging.Formatter(fmt=settings.LOG_FORMAT)
 
     console = logging.StreamHandler(stream=sys.stdout)
     console.setFormatter(formatter)
     console.setLevel(log_level)
-    logger.addHandler(console)
+
+    log_dir = os.path.dirname(settings.LOG_FILE)
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
 
     fh = logging.handlers.RotatingFileHandler(
         filename=settings.LOG_FILE,
@@ -179,7 +363,17 @@ def initialize_logger(log_level):
         backupCount=1)
     fh.setFormatter(formatter)
     fh.setLevel(log_level)
-    logger.addHandler(fh)
+
+    if queued:
+        handler, _ = logs.queue_handlers([console, fh], level=log_level,
+                                         sample_rates=sample_rates)
+        logger.addHandler(handler)
+    else:
+        sampler = logs.install_sampler(sample_rates) if sample_rates else None
+        for handler in (console, fh):
+            if sampler is not None:
+                handler.addFilter(sampler)
+            logger.addHandler(handler)
 
     logging.getLogger('PIL').setLevel(logging.INFO)
 
@@ -188,7 +382,13 @@ if __name__ == '__main__':
     args = get_arg_parser().parse_args()
 
     if settings.LOG_ENABLED:
-        initialize_logger(log_level=args.log_level)
+        initialize_logger(log_level=args.log_level,
+                          queued=settings.LOG_QUEUE,
+                          json_format=args.log_json,
+                          sample_rates={
+                              'request': args.log_request_sample_rate,
+                              'status': args.log_status_sample_rate,
+                          })
 
     if args.scale:  # optional, but if provided should be a float
         try:
@@ -199,11 +399,22 @@ if __name__ == '__main__':
 
     mgr_kwargs = {
         'host': args.host,
+        'load_balancing': args.load_balancing,
         'model': args.model,
         'job_type': args.job_type,
         'update_interval': args.update_interval,
         'start_delay': args.start_delay,
+        'max_active_jobs': args.max_active_jobs,
+        'preflight_connections': args.preflight_connections,
+        'preflight_probes': args.preflight_probes,
         'refresh_rate': args.refresh_rate,
+        'hedge_percentile': args.hedge_percentile,
+        'hedge_min_samples': args.hedge_min_samples,
+        'max_hedges': args.max_hedges,
+        'job_timeout': args.job_timeout,
+        'time_budget': args.time_budget,
+        'drain_timeout': args.drain_timeout,
+        'cost_update_interval': args.cost_update_interval,
         'postprocess': args.post,
         'preprocess': args.pre,
         'upload_prefix': args.upload_prefix,
@@ -215,17 +426,59 @@ if __name__ == '__main__':
         'calculate_cost': args.calculate_cost,
         'download_results': not args.no_download_results,
         'output_dir': args.output_dir,
+        'upload_index': args.upload_index,
+        'upload_index_max_entries': args.upload_index_max_entries,
+        'upload_index_max_age': args.upload_index_max_age,
+        'hash_workers': args.hash_workers,
+        'result_cache': args.result_cache,
+        'result_cache_max_bytes': args.result_cache_max_bytes,
+        'result_cache_max_age': args.result_cache_max_age,
+        'bundle_size': args.bundle_size,
+        'bundle_count': args.bundle_count,
+        'shard_size': args.shard_size,
+        'num_shards': args.num_shards,
+        'shard_by': args.shard_by,
+        'tile_size': args.tile_size,
+        'tile_overlap': args.tile_overlap,
+        'job_order': args.job_order,
+        'probe_dimensions': args.probe_dimensions,
+        'upload_chunk_size': args.upload_chunk_size,
+        'chunked_upload': args.chunked_upload,
+        'output_format': args.output_format,
+        'job_store': args.job_store,
     }
 
     if not os.path.exists(args.file) and not args.benchmark and args.upload:
         raise FileNotFoundError('%s could not be found.' % args.file)
 
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    # imported once the arguments are valid, as they are slow to import
+    from twisted.internet import reactor  # pylint: disable=C0415
+    from kiosk_client import manager  # pylint: disable=C0415
+
     if args.benchmark:
         mgr = manager.BenchmarkingJobManager(**mgr_kwargs)
-        mgr.run(filepath=args.file, count=args.count, upload=args.upload)
+        d = mgr.run(filepath=args.file, count=args.count, upload=args.upload)
 
     else:
         mgr = manager.BatchProcessingJobManager(**mgr_kwargs)
-        mgr.run(filepath=args.file)
+        d = mgr.run(filepath=args.file)
+
+    failures = []
+
+    def _stop_on_failure(failure):
+        failures.append(failure)
+        logging.getLogger('kiosk_client').error(
+            'Run failed with %s: %s', failure.type.__name__,
+            failure.getErrorMessage())
+        if reactor.running:  # pylint: disable=E1101
+            reactor.stop()  # pylint: disable=E1101
+
+    d.addErrback(_stop_on_failure)
+
+    if not failures:  # the run may fail before the reactor starts
+        reactor.run()  # pylint: disable=E1101
 
-    reactor.run()  # pylint: disable=E1101
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,348 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Analyze and compare the JSON output of past runs.
+
+    python -m kiosk_client.analyze run1.json run2.json
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import os
+import re
+
+import numpy as np
+
+from kiosk_client import columnar
+from kiosk_client.columnar import TIMING_FIELDS
+
+
+PERCENTILES = (50, 90, 95, 99)
+
+_SKIP = re.compile(r'[\s,]*')
+
+
+def _read_until(f, buf, pattern, chunk_size):
+    """Read from f until the pattern is found in the buffer."""
+    while True:
+        match = pattern.search(buf)
+        if match is not None:
+            return buf, match
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return buf, None
+        buf += chunk
+
+
+def read_summary(path, chunk_size=2 ** 20):
+    """Read the summary data of a run without loading its job data.
+
+    Args:
+        path (str): The JSON output file of the run.
+        chunk_size (int): Number of characters read at a time.
+
+    Returns:
+        dict: The summary data, without "job_data".
+    """
+    with open(path, 'r') as f:
+        buf, match = _read_until(f, '', re.compile(r'"job_data"\s*:'),
+                                 chunk_size)
+        if match is None:  # no job data, load everything
+            summary = json.loads(buf)
+            summary.pop('job_data', None)
+            return summary
+
+    header = buf[:match.start()].rstrip().rstrip(',')
+    return json.loads(header + '}')
+
+
+def iter_jobs(path, chunk_size=2 ** 20):
+    """Iterate over the job data of a run without loading the whole file.
+
+    Args:
+        path (str): The JSON output file of the run.
+        chunk_size (int): Number of characters read at a time.
+
+    Returns:
+        generator: The data of each job, from Job.json().
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r') as f:
+        buf, match = _read_until(f, '', re.compile(r'"job_data"\s*:\s*\['),
+                                 chunk_size)
+        if match is None:
+            return
+
+        pos = match.end()
+        while True:
+            pos = _SKIP.match(buf, pos).end()
+            if pos >= len(buf) or buf[pos] != ']':
+                try:
+                    job, end = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    job = None  # the job is not completely in the buffer
+
+                if job is not None:
+                    yield job
+                    pos = end
+                    continue
+            else:
+                return  # end of the job data
+
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise ValueError('Unexpected end of file %s.' % path)
+            buf = buf[pos:] + chunk
+            pos = 0
+
+
+def get_stats(values, percentiles=PERCENTILES):
+    """Get the count, mean, min, max and percentiles of the values."""
+    values = np.asarray(values, dtype=np.float64)
+    stats = collections.OrderedDict([('count', int(values.size))])
+    if not values.size:
+        return stats
+
+    stats['mean'] = float(np.mean(values))
+    stats['min'] = float(np.min(values))
+    for p, v in zip(percentiles, np.percentile(values, percentiles)):
+        stats['p{}'.format(p)] = float(v)
+    stats['max'] = float(np.max(values))
+    return stats
+
+
+def get_throughput(finished_at, bin_size=60):
+    """Get the number of jobs finished in each time bin.
+
+    Args:
+        finished_at (numpy.array): The epoch seconds each job finished.
+        bin_size (float): Seconds in each bin.
+
+    Returns:
+        dict: The number of jobs finished in each bin, and the mean and
+            peak jobs finished per minute.
+    """
+    finished_at = np.asarray(finished_at, dtype=np.float64)
+    if not finished_at.size:
+        return {'bin_size': bin_size, 'start': None, 'bins': []}
+
+    start = float(np.min(finished_at))
+    bins = ((finished_at - start) // bin_size).astype(np.int64)
+    counts = np.bincount(bins)
+    per_minute = counts * (60 / bin_size)
+    return {
+        'bin_size': bin_size,
+        'start': start,
+        'bins': counts.tolist(),
+        'mean_per_minute': float(np.mean(per_minute)),
+        'peak_per_minute': float(np.max(per_minute)),
+    }
+
+
+def get_statuses(columns):
+    """Count the jobs of each status."""
+    categories = columns['status_categories']
+    counts = np.bincount(columns['status'] + 1,
+                         minlength=len(categories) + 1)
+    statuses = {str(c): int(n) for c, n in zip(categories, counts[1:]) if n}
+    if counts[0]:
+        statuses['None'] = int(counts[0])
+    return statuses
+
+
+def get_hosts(columns, bin_size=60):
+    """Count the jobs and throughput of each host."""
+    if 'host' not in columns:  # saved before jobs recorded their host
+        return {}
+
+    finished_at = columns['finished_at']
+    hosts = {}
+    for code, host in enumerate(columns['host_categories']):
+        is_host = columns['host'] == code
+        hosts[str(host)] = {
+            'num_jobs': int(np.count_nonzero(is_host)),
+            'throughput': get_throughput(
+                finished_at[is_host & ~np.isnan(finished_at)], bin_size),
+        }
+    return hosts
+
+
+def load(path):
+    """Load the summary data and job data columns of a run.
+
+    Args:
+        path (str): The JSON or columnar (``.npz``) output file of the run.
+
+    Returns:
+        tuple: The summary data and a dict of each column.
+    """
+    if path.endswith('.npz'):
+        return columnar.load_columns(path)
+
+    builder = columnar.ColumnBuilder()
+    for job in iter_jobs(path):
+        builder.add(job)
+    return read_summary(path), builder.columns()
+
+
+def analyze(path, bin_size=60, percentiles=PERCENTILES):
+    """Compute statistics of a single run.
+
+    List-valued timing fields, such as those of jobs with multiple
+    child jobs, contribute each of their values.
+
+    Args:
+        path (str): The JSON or columnar (``.npz``) output file of the run.
+        bin_size (float): Seconds in each throughput bin.
+        percentiles (tuple): The percentiles of each timing field.
+
+    Returns:
+        dict: The summary data, status counts, failure rate, percentiles
+            of each timing field and throughput over time of the run,
+            and the throughput of each host.
+    """
+    summary, columns = load(path)
+    num_jobs = columnar.num_jobs(columns)
+    statuses = get_statuses(columns)
+
+    timing = {}
+    for field in TIMING_FIELDS:
+        values = columns[field][~np.isnan(columns[field])]
+        if values.size:
+            timing[field] = get_stats(values, percentiles)
+
+    finished_at = columns['finished_at']
+    return {
+        'path': path,
+        'num_jobs': num_jobs,
+        'time_elapsed': summary.get('time_elapsed'),
+        'total_cost': summary.get('total_node_and_networking_costs'),
+        'statuses': statuses,
+        'failure_rate': (statuses.get('failed', 0) / num_jobs
+                         if num_jobs else 0),
+        'timing': timing,
+        'throughput': get_throughput(
+            finished_at[~np.isnan(finished_at)], bin_size),
+        'hosts': get_hosts(columns, bin_size),
+    }
+
+
+def _format(value):
+    if isinstance(value, float):
+        return '{:.4g}'.format(value)
+    return '-' if value is None else str(value)
+
+
+def compare(results):
+    """Format the statistics of each run as a table, side by side.
+
+    Args:
+        results (list): The output of analyze() for each run.
+
+    Returns:
+        str: A table with a row per statistic and a column per run.
+    """
+    rows = [('', [r['path'] for r in results])]
+
+    def _add_row(name, getter):
+        rows.append((name, [getter(r) for r in results]))
+
+    _add_row('jobs', lambda r: r['num_jobs'])
+    _add_row('failure rate', lambda r: r['failure_rate'])
+    _add_row('time elapsed', lambda r: r['time_elapsed'])
+    _add_row('total cost', lambda r: r['total_cost'])
+    _add_row('mean jobs/min', lambda r: r['throughput'].get('mean_per_minute'))
+    _add_row('peak jobs/min', lambda r: r['throughput'].get('peak_per_minute'))
+
+    hosts = sorted(set(h for r in results for h in r['hosts']))
+    if len(hosts) > 1:
+        for host in hosts:
+            _add_row('jobs/min ' + host,
+                     lambda r, h=host: r['hosts'].get(h, {})
+                     .get('throughput', {}).get('mean_per_minute'))
+
+    statuses = sorted(set(s for r in results for s in r['statuses']))
+    for status in statuses:
+        _add_row('status ' + status,
+                 lambda r, s=status: r['statuses'].get(s, 0))
+
+    for field in TIMING_FIELDS:
+        stats = [s for r in results for s in r['timing'].get(field, {})]
+        for stat in collections.OrderedDict.fromkeys(stats):
+            if stat == 'count':
+                continue
+            _add_row('{} {}'.format(field, stat),
+                     lambda r, f=field, s=stat: r['timing'].get(f, {}).get(s))
+
+    cells = [[name] + [_format(v) for v in values] for name, values in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(cells[0]))]
+    return '\n'.join('  '.join(c.ljust(w) for c, w in zip(row, widths))
+                     .rstrip() for row in cells)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Analyze and compare the JSON output of past runs.')
+    parser.add_argument('results', nargs='+',
+                        help='JSON or columnar (.npz) output files of '
+                             'past runs.')
+    parser.add_argument('--bin-size', type=float, default=60,
+                        help='Seconds in each throughput bin.')
+    parser.add_argument('--percentiles', type=float, nargs='+',
+                        default=PERCENTILES,
+                        help='Percentiles of each timing field.')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the full statistics as JSON.')
+    parser.add_argument('--to-npz', action='store_true',
+                        help='Also convert each JSON output file to a '
+                             'columnar .npz file, which is faster to load.')
+    args = parser.parse_args()
+
+    if args.to_npz:
+        for path in args.results:
+            if path.endswith('.npz'):
+                continue
+            dest = '{}.npz'.format(os.path.splitext(path)[0])
+            count = columnar.save_columns(dest, iter_jobs(path),
+                                          read_summary(path))
+            print('Wrote {} jobs to {}.'.format(count, dest))
+
+    percentiles = tuple(int(p) if float(p).is_integer() else p
+                        for p in args.percentiles)
+    results = [analyze(path, args.bin_size, percentiles)
+               for path in args.results]
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        print(compare(results))
+
+
+if __name__ == '__main__':
+    main()
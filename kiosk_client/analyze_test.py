@@ -0,0 +1,173 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for the results analyzer"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import datetime
+import json
+import os
+import sys
+
+import pytest
+
+from kiosk_client import analyze
+from kiosk_client import columnar
+
+
+def _write_results(path, num_jobs, failed=0, hosts=None):
+    start = datetime.datetime(2021, 1, 1)
+    jobs = []
+    for i in range(num_jobs):
+        finished_at = start + datetime.timedelta(seconds=30 * i)
+        jobs.append({
+            'input_file': 'image%s.png' % i,
+            'status': 'failed' if i < failed else 'done',
+            'total_time': float(i),
+            'prediction_time': [float(i), float(i)],
+            'upload_time': None,
+            'finished_at': finished_at.isoformat(),
+        })
+        if hosts:
+            jobs[-1]['host'] = hosts[i % len(hosts)]
+    data = {
+        'total_node_and_networking_costs': '7.5',
+        'time_elapsed': 30.0 * num_jobs,
+        'job_data': jobs,
+    }
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=4)
+    return data
+
+
+class TestAnalyze(object):
+
+    def test_read_results(self, tmpdir):
+        path = os.path.join(str(tmpdir), 'results.json')
+        data = _write_results(path, 20)
+
+        # small chunks split the jobs across reads
+        jobs = list(analyze.iter_jobs(path, chunk_size=64))
+        assert jobs == data['job_data']
+
+        summary = analyze.read_summary(path, chunk_size=16)
+        assert summary == {'total_node_and_networking_costs': '7.5',
+                           'time_elapsed': 600.0}
+
+        # no job data
+        with open(path, 'w') as f:
+            json.dump({'time_elapsed': 1}, f)
+        assert list(analyze.iter_jobs(path)) == []
+        assert analyze.read_summary(path) == {'time_elapsed': 1}
+
+        # truncated file
+        with open(path, 'w') as f:
+            f.write('{"job_data": [{"status": "done"}, {"sta')
+        with pytest.raises(ValueError):
+            list(analyze.iter_jobs(path))
+
+    def test_get_stats(self):
+        stats = analyze.get_stats(range(101))
+        assert stats['count'] == 101
+        assert stats['mean'] == 50
+        assert stats['p50'] == 50
+        assert stats['p99'] == 99
+        assert stats['max'] == 100
+        assert analyze.get_stats([]) == {'count': 0}
+
+    def test_get_throughput(self):
+        throughput = analyze.get_throughput([0, 10, 70, 200], bin_size=60)
+        assert throughput['bins'] == [2, 1, 0, 1]
+        assert throughput['peak_per_minute'] == 2
+        assert throughput['mean_per_minute'] == 1
+        assert analyze.get_throughput([])['bins'] == []
+
+    def test_analyze_and_compare(self, tmpdir):
+        path1 = os.path.join(str(tmpdir), 'run1.json')
+        path2 = os.path.join(str(tmpdir), 'run2.json')
+        _write_results(path1, 10, failed=1)
+        _write_results(path2, 4)
+
+        result = analyze.analyze(path1)
+        assert result['num_jobs'] == 10
+        assert result['statuses'] == {'done': 9, 'failed': 1}
+        assert result['failure_rate'] == 0.1
+        assert result['total_cost'] == '7.5'
+        # list-valued fields contribute each value
+        assert result['timing']['prediction_time']['count'] == 20
+        assert result['timing']['total_time']['max'] == 9
+        assert 'upload_time' not in result['timing']
+        assert result['throughput']['bins'] == [2] * 5
+
+        # columnar output has the same statistics
+        npz_path = os.path.join(str(tmpdir), 'run1.npz')
+        columnar.save_columns(npz_path, analyze.iter_jobs(path1),
+                              analyze.read_summary(path1))
+        npz_result = analyze.analyze(npz_path)
+        assert npz_result['path'] == npz_path
+        assert dict(npz_result, path=path1) == result
+
+        table = analyze.compare([result, analyze.analyze(path2)])
+        lines = table.splitlines()
+        assert path1 in lines[0] and path2 in lines[0]
+        assert any(line.startswith('failure rate') for line in lines)
+        assert any(line.startswith('total_time p99') for line in lines)
+
+    def test_get_hosts(self, tmpdir):
+        path1 = os.path.join(str(tmpdir), 'run1.json')
+        path2 = os.path.join(str(tmpdir), 'run2.json')
+        _write_results(path1, 6, hosts=['http://a', 'http://b', 'http://b'])
+        _write_results(path2, 4)
+
+        result = analyze.analyze(path1)
+        assert sorted(result['hosts']) == ['http://a', 'http://b']
+        assert result['hosts']['http://a']['num_jobs'] == 2
+        assert result['hosts']['http://b']['num_jobs'] == 4
+        assert result['hosts']['http://b']['throughput']['bins'] == [2, 1, 1]
+
+        # older output files without a host
+        _, columns = analyze.load(path2)
+        del columns['host']
+        assert analyze.get_hosts(columns) == {}
+
+        table = analyze.compare([result, analyze.analyze(path2)])
+        assert any(line.startswith('jobs/min http://b')
+                   for line in table.splitlines())
+
+    def test_main(self, tmpdir, capsys, monkeypatch):
+        path = os.path.join(str(tmpdir), 'run.json')
+        _write_results(path, 4)
+        monkeypatch.setattr(sys, 'argv', ['analyze', path, '--json',
+                                          '--percentiles', '50', '99.9'])
+        analyze.main()
+        results = json.loads(capsys.readouterr().out)
+        assert results[0]['num_jobs'] == 4
+        assert 'p99.9' in results[0]['timing']['total_time']
+
+        monkeypatch.setattr(sys, 'argv', ['analyze', path, '--to-npz'])
+        analyze.main()
+        assert os.path.isfile(os.path.join(str(tmpdir), 'run.npz'))
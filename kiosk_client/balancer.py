@@ -0,0 +1,161 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Spread jobs across several DeepCell Kiosk hosts"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import logging
+
+
+POLICIES = ('round-robin', 'least-outstanding', 'ewma')
+
+
+class Backend(object):
+    """A single host and the state used to route jobs to it.
+
+    Args:
+        host (str): the URL of the host.
+        pool (twisted.web.client.HTTPConnectionPool): the connection pool
+            used by all jobs of the host.
+        alpha (float): weight of each new latency in the moving average.
+    """
+
+    def __init__(self, host, pool=None, alpha=0.3):
+        self.host = host
+        self.pool = pool
+        self.alpha = float(alpha)
+
+        self.outstanding = 0  # started jobs that are not finished
+        self.started = 0  # including restarts
+        self.requests = 0
+        self.latency = None  # moving average of the request latency
+        self.statuses = collections.Counter()  # final status of each job
+
+    def observe(self, latency):
+        """Add the latency of a response to the moving average."""
+        self.requests += 1
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.alpha * (latency - self.latency)
+
+    def acquire(self):
+        """Count a job that was started on this host."""
+        self.outstanding += 1
+        self.started += 1
+
+    def release(self, job):
+        """Count a job that is no longer running on this host."""
+        self.outstanding -= 1
+        if job.is_expired:  # not restarted
+            self.statuses[job.status] += 1
+
+    def json(self, time_elapsed):
+        completed = sum(self.statuses.values())
+        return {
+            'host': self.host,
+            'completed': completed,
+            'started': self.started,
+            'outstanding': self.outstanding,
+            'statuses': dict(self.statuses),
+            'requests': self.requests,
+            'latency': self.latency,
+            'jobs_per_minute': (completed / (time_elapsed / 60)
+                                if time_elapsed > 0 else None),
+        }
+
+
+class LoadBalancer(object):
+    """Choose the host of each new job.
+
+    Policies:
+        round-robin: each host in turn.
+        least-outstanding: the host with the fewest unfinished jobs.
+        ewma: the host with the lowest moving average request latency,
+            weighted by its number of unfinished jobs. Hosts without a
+            measured latency are chosen first.
+
+    Args:
+        hosts (list): the URL of each host.
+        policy (str): the name of the routing policy.
+        pool_factory (function): creates the connection pool of each host.
+        alpha (float): weight of each new latency in the moving average.
+    """
+
+    def __init__(self, hosts, policy='round-robin', pool_factory=None,
+                 alpha=0.3):
+        self.logger = logging.getLogger(str(self.__class__.__name__))
+        if not hosts:
+            raise ValueError('At least one host is required.')
+        if policy not in POLICIES:
+            raise ValueError('policy must be one of %s, got %s.' %
+                             (', '.join(POLICIES), policy))
+
+        self.policy = policy
+        self.backends = []
+        for host in hosts:
+            pool = pool_factory() if pool_factory is not None else None
+            self.backends.append(Backend(host, pool, alpha=alpha))
+        self._next = 0  # round-robin position, also used to break ties
+
+    def __len__(self):
+        return len(self.backends)
+
+    def __iter__(self):
+        return iter(self.backends)
+
+    def get(self, host, default=None):
+        """Get the backend of the host."""
+        for backend in self.backends:
+            if backend.host == host:
+                return backend
+        return default
+
+    def _rotated(self):
+        i = self._next % len(self.backends)
+        self._next = i + 1
+        return self.backends[i:] + self.backends[:i]
+
+    def choose(self):
+        """Choose the backend of a new job."""
+        backends = self._rotated()
+        if self.policy == 'least-outstanding':
+            return min(backends, key=lambda b: b.outstanding)
+
+        if self.policy == 'ewma':
+            unmeasured = [b for b in backends if b.latency is None]
+            if unmeasured:
+                return min(unmeasured, key=lambda b: b.outstanding)
+            return min(backends,
+                       key=lambda b: b.latency * (b.outstanding + 1))
+
+        return backends[0]
+
+    def json(self, time_elapsed):
+        """Summarize the jobs and throughput of each host."""
+        return [b.json(time_elapsed) for b in self.backends]
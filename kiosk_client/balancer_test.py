@@ -0,0 +1,117 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for spreading jobs across several hosts"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import pytest
+
+from kiosk_client import balancer
+
+
+class Bunch(object):
+    def __init__(self, **kwds):
+        self.__dict__.update(kwds)
+
+
+class TestBackend(object):
+
+    def test_observe(self):
+        backend = balancer.Backend('http://a', alpha=0.5)
+        assert backend.latency is None
+        backend.observe(2)
+        assert backend.latency == 2
+        backend.observe(1)
+        assert backend.latency == 1.5
+        assert backend.requests == 2
+
+    def test_acquire_and_release(self):
+        backend = balancer.Backend('http://a')
+        job = Bunch(is_expired=False, status='failed')
+        backend.acquire()
+        backend.release(job)  # restarted, not counted
+        backend.acquire()
+        job.is_expired = True
+        job.status = 'done'
+        backend.release(job)
+
+        data = backend.json(time_elapsed=30)
+        assert data['started'] == 2
+        assert data['outstanding'] == 0
+        assert data['completed'] == 1
+        assert data['statuses'] == {'done': 1}
+        assert data['jobs_per_minute'] == 2
+        assert backend.json(time_elapsed=0)['jobs_per_minute'] is None
+
+
+class TestLoadBalancer(object):
+
+    def test_init(self):
+        with pytest.raises(ValueError):
+            balancer.LoadBalancer([])
+        with pytest.raises(ValueError):
+            balancer.LoadBalancer(['http://a'], policy='random')
+
+        pools = []
+        lb = balancer.LoadBalancer(['http://a', 'http://b'],
+                                   pool_factory=lambda: pools.append(1) or
+                                   len(pools))
+        assert len(lb) == 2
+        assert [b.pool for b in lb] == [1, 2]
+        assert lb.get('http://b') is lb.backends[1]
+        assert lb.get('http://c') is None
+
+    def test_round_robin(self):
+        lb = balancer.LoadBalancer(['http://a', 'http://b', 'http://c'])
+        lb.backends[0].outstanding = 10  # ignored
+        hosts = [lb.choose().host for _ in range(4)]
+        assert hosts == ['http://a', 'http://b', 'http://c', 'http://a']
+
+    def test_least_outstanding(self):
+        lb = balancer.LoadBalancer(['http://a', 'http://b', 'http://c'],
+                                   policy='least-outstanding')
+        lb.backends[0].outstanding = 2
+        lb.backends[1].outstanding = 1
+        lb.backends[2].outstanding = 1
+        # ties are broken in turn
+        hosts = [lb.choose().host for _ in range(3)]
+        assert hosts == ['http://b', 'http://b', 'http://c']
+
+    def test_ewma(self):
+        lb = balancer.LoadBalancer(['http://a', 'http://b'], policy='ewma')
+        a, b = lb.backends
+
+        # hosts without a latency are tried first
+        a.observe(1.0)
+        assert lb.choose() is b
+
+        b.observe(2.0)
+        assert lb.choose() is a
+
+        # the latency is weighted by the number of outstanding jobs
+        a.outstanding = 2
+        assert lb.choose() is b
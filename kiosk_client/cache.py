@@ -0,0 +1,414 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Persistent local indices to avoid repeating work across runs"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+
+class JSONIndex(object):
+    """A dictionary persisted to a JSON file on disk.
+
+    Args:
+        path (str): The JSON file in which the index is stored.
+    """
+
+    def __init__(self, path):
+        self.logger = logging.getLogger(str(self.__class__.__name__))
+        self.path = str(path)
+        self.entries = self._load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                entries = json.load(f)
+            if not isinstance(entries, dict):
+                raise ValueError('Expected a JSON object.')
+            return entries
+        except ValueError as err:
+            self.logger.warning('Ignoring invalid index file %s: %s',
+                                self.path, err)
+            return {}
+
+    def save(self):
+        """Atomically write the index to disk."""
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmppath = '{}.tmp'.format(self.path)
+        with open(tmppath, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmppath, self.path)
+        self.logger.debug('Saved %s entries to %s.', len(self), self.path)
+
+
+class UploadIndex(JSONIndex):
+    """Maps the content hash and destination of a file to its
+    already-uploaded name.
+
+    Files found in the index do not need to be uploaded again. The same
+    file uploaded to another bucket or prefix is uploaded again.
+    The bytes and upload time saved by each hit are tracked for reporting.
+    Uploaded files may be deleted from the bucket, so entries older than
+    max_age are expired, and the least recently used entries are evicted
+    while there are more than max_entries.
+
+    Args:
+        path (str): The JSON file in which the index is stored.
+        max_entries (int): Maximum number of entries. Unlimited if 0.
+        max_age (float): Seconds until an entry expires. Never if 0.
+    """
+
+    def __init__(self, path, max_entries=100000, max_age=86400):
+        super(UploadIndex, self).__init__(path)
+        self.max_entries = int(max_entries)
+        self.max_age = float(max_age)
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.time_saved = 0
+
+    @classmethod
+    def get_key(cls, digest, **destination):
+        """Get the index key of a file hash and where it is uploaded.
+
+        Args:
+            digest (str): The content hash of the file.
+            destination (dict): Where the file is uploaded, such as the
+                bucket and prefix.
+
+        Returns:
+            str: The hex digest of the file hash and its destination.
+        """
+        data = json.dumps([digest, sorted(destination.items())])
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def _is_expired(self, entry, now=None):
+        now = time.time() if now is None else now
+        return self.max_age > 0 and now - entry['created_at'] > self.max_age
+
+    def remove(self, key):
+        """Remove the entry from the index, so the file is uploaded again."""
+        self.entries.pop(key, None)
+
+    def evict(self):
+        """Remove all expired entries and the least recently used entries
+        until there are at most max_entries.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        now = time.time()
+        expired = [k for k, e in self.entries.items()
+                   if self._is_expired(e, now)]
+        for key in expired:
+            self.remove(key)
+
+        evicted = len(expired)
+        if self.max_entries > 0 and len(self) > self.max_entries:
+            lru = sorted(self.entries,
+                         key=lambda k: self.entries[k]['last_used'])
+            for key in lru[:len(self) - self.max_entries]:
+                self.remove(key)
+                evicted += 1
+
+        if evicted:
+            self.logger.debug('Evicted %s entries from the upload index.',
+                              evicted)
+        return evicted
+
+    def get(self, key):
+        """Return the uploaded name of the file with the given key.
+
+        Args:
+            key (str): The index key of the file, from get_key().
+
+        Returns:
+            str: The uploaded name, or None if the file was never uploaded
+            or its entry expired.
+        """
+        entry = self.entries.get(key)
+        if entry is not None and self._is_expired(entry):
+            self.remove(key)
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.bytes_saved += int(entry.get('size', 0))
+        self.time_saved += float(entry.get('upload_time', 0))
+        entry['last_used'] = time.time()
+        return entry['uploaded_name']
+
+    def add(self, key, uploaded_name, size=0, upload_time=0):
+        """Record that the file with the given key has been uploaded.
+
+        Args:
+            key (str): The index key of the file, from get_key().
+            uploaded_name (str): The name of the uploaded file.
+            size (int): Size of the file in bytes.
+            upload_time (float): Seconds taken to upload the file.
+        """
+        now = time.time()
+        self.entries[key] = {
+            'uploaded_name': uploaded_name,
+            'size': int(size),
+            'upload_time': float(upload_time),
+            'created_at': now,
+            'last_used': now,
+        }
+        self.evict()
+
+    def summary(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'bytes_saved': self.bytes_saved,
+            'time_saved': self.time_saved,
+        }
+
+
+class ResultCache(JSONIndex):
+    """Maps an input file and the job's parameters to the job's results.
+
+    Downloaded output files are copied into the cache directory.
+    Entries older than max_age are expired, and the least recently used
+    entries are evicted while the cached files are larger than max_bytes.
+
+    Args:
+        cache_dir (str): Directory of the index and the cached output files.
+        max_bytes (int): Maximum total size of the cached output files.
+        max_age (float): Seconds until a cached result expires.
+    """
+
+    def __init__(self, cache_dir, max_bytes=10 * 2 ** 30, max_age=604800):
+        self.cache_dir = str(cache_dir)
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        super(ResultCache, self).__init__(
+            os.path.join(self.cache_dir, 'index.json'))
+        self.max_bytes = int(max_bytes)
+        self.max_age = float(max_age)
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def get_key(cls, digest, **params):
+        """Get the cache key of an input file hash and job parameters.
+
+        Args:
+            digest (str): The content hash of the input file.
+            params (dict): The parameters of the job, such as the model.
+
+        Returns:
+            str: The hex digest of the input hash and the parameters.
+        """
+        data = json.dumps([digest, sorted(params.items())])
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    @property
+    def size(self):
+        return sum(int(e.get('size', 0)) for e in self.entries.values())
+
+    def _is_expired(self, entry, now=None):
+        now = time.time() if now is None else now
+        return self.max_age > 0 and now - entry['created_at'] > self.max_age
+
+    def remove(self, key):
+        """Remove the entry and its cached output file from the cache."""
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        output_file = entry.get('output_file')
+        if output_file and os.path.isfile(output_file):
+            os.remove(output_file)
+
+    def evict(self):
+        """Remove all expired entries and the least recently used entries
+        until the cached files fit in max_bytes.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        now = time.time()
+        expired = [k for k, e in self.entries.items()
+                   if self._is_expired(e, now)]
+        for key in expired:
+            self.remove(key)
+
+        evicted = len(expired)
+        size = self.size
+        lru = sorted(self.entries, key=lambda k: self.entries[k]['last_used'])
+        for key in lru:
+            if size <= self.max_bytes:
+                break
+            size -= int(self.entries[key].get('size', 0))
+            self.remove(key)
+            evicted += 1
+
+        if evicted:
+            self.logger.debug('Evicted %s entries from the result cache.',
+                              evicted)
+        return evicted
+
+    def get(self, key):
+        """Get the cached results for the given key.
+
+        Args:
+            key (str): The cache key, from get_key().
+
+        Returns:
+            dict: The cached entry, or None if the results are not cached.
+        """
+        entry = self.entries.get(key)
+        if entry is not None and self._is_expired(entry):
+            self.remove(key)
+            entry = None
+
+        output_file = None if entry is None else entry.get('output_file')
+        if output_file and not os.path.isfile(output_file):
+            self.logger.warning('Cached file %s is missing.', output_file)
+            self.remove(key)
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        entry['last_used'] = time.time()
+        return dict(entry)
+
+    def add(self, key, output_url, output_file=None, **summary):
+        """Add the results of a finished job to the cache.
+
+        Args:
+            key (str): The cache key, from get_key().
+            output_url (str): The URL of the job's output file.
+            output_file (str): The local path of the downloaded output file.
+                It is copied into the cache directory.
+            summary (dict): Any other data to save with the results.
+        """
+        self.remove(key)
+
+        cached_file, size = None, 0
+        if output_file and os.path.isfile(output_file):
+            _, ext = os.path.splitext(output_file)
+            cached_file = os.path.join(self.cache_dir, key + ext)
+            try:
+                os.link(output_file, cached_file)
+            except (AttributeError, OSError):
+                shutil.copyfile(output_file, cached_file)
+            size = os.path.getsize(cached_file)
+
+        now = time.time()
+        self.entries[key] = {
+            'output_url': output_url,
+            'output_file': cached_file,
+            'size': size,
+            'created_at': now,
+            'last_used': now,
+            'summary': summary,
+        }
+        self.evict()
+
+    def summary(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self),
+            'size': self.size,
+        }
+
+
+class QueryCache(ResultCache):
+    """Caches the responses of Grafana API queries of closed time windows.
+
+    Data in a closed window does not change, so cached responses never
+    expire. The least recently used responses are evicted while the
+    cached responses are larger than max_bytes.
+
+    Args:
+        cache_dir (str): Directory of the index and the cached responses.
+        max_bytes (int): Maximum total size of the cached responses.
+    """
+
+    def __init__(self, cache_dir, max_bytes=2 ** 30):
+        super(QueryCache, self).__init__(
+            cache_dir, max_bytes=max_bytes, max_age=0)
+
+    def get_response(self, key):
+        """Get the cached response for the given key.
+
+        Args:
+            key (str): The cache key, from get_key().
+
+        Returns:
+            dict: The cached response, or None if it is not cached.
+        """
+        entry = self.get(key)
+        if entry is None:
+            return None
+        try:
+            with open(entry['output_file'], 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError) as err:
+            self.logger.warning('Ignoring invalid cached response %s: %s',
+                                entry['output_file'], err)
+            self.remove(key)
+            return None
+
+    def add_response(self, key, response):
+        """Add the response of a query to the cache.
+
+        Args:
+            key (str): The cache key, from get_key().
+            response (dict): The JSON response of the query.
+        """
+        tmppath = os.path.join(self.cache_dir, '{}.tmp.json'.format(key))
+        with open(tmppath, 'w') as f:
+            json.dump(response, f)
+        try:
+            self.add(key, None, tmppath)
+        finally:
+            os.remove(tmppath)
@@ -0,0 +1,209 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for persistent indices"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+
+from kiosk_client import cache
+
+
+class TestJSONIndex(object):
+
+    def test_save_and_load(self, tmpdir):
+        path = os.path.join(str(tmpdir), 'subdir', 'index.json')
+        index = cache.JSONIndex(path)
+        assert len(index) == 0
+
+        index.entries['key'] = {'value': 1}
+        index.save()
+        assert os.path.isfile(path)
+
+        index = cache.JSONIndex(path)
+        assert 'key' in index
+        assert index.entries['key']['value'] == 1
+
+    def test_invalid_file(self, tmpdir):
+        path = os.path.join(str(tmpdir), 'index.json')
+        with open(path, 'w') as f:
+            f.write('not json')
+        assert len(cache.JSONIndex(path)) == 0
+
+        with open(path, 'w') as f:
+            json.dump([1, 2, 3], f)
+        assert len(cache.JSONIndex(path)) == 0
+
+
+class TestUploadIndex(object):
+
+    def test_get_key(self):
+        key = cache.UploadIndex.get_key('abc', bucket='b', prefix='uploads')
+        assert key == cache.UploadIndex.get_key('abc', prefix='uploads',
+                                                bucket='b')
+        assert key != cache.UploadIndex.get_key('abc', bucket='c',
+                                                prefix='uploads')
+        assert key != cache.UploadIndex.get_key('abc', bucket='b',
+                                                prefix='other')
+
+    def test_get_and_add(self, tmpdir):
+        path = os.path.join(str(tmpdir), 'index.json')
+        index = cache.UploadIndex(path)
+
+        assert index.get('abc') is None
+        index.add('abc', 'uploads/abc.png', size=100, upload_time=2.5)
+        assert index.get('abc') == 'uploads/abc.png'
+        assert index.get('abc') == 'uploads/abc.png'
+
+        summary = index.summary()
+        assert summary['hits'] == 2
+        assert summary['misses'] == 1
+        assert summary['bytes_saved'] == 200
+        assert summary['time_saved'] == 5
+
+        # the index is persisted between runs
+        index.save()
+        index = cache.UploadIndex(path)
+        assert index.get('abc') == 'uploads/abc.png'
+        assert index.summary()['hits'] == 1
+
+        # removed entries are uploaded again
+        index.remove('abc')
+        assert index.get('abc') is None
+
+    def test_evict(self, tmpdir):
+        path = os.path.join(str(tmpdir), 'index.json')
+        index = cache.UploadIndex(path, max_entries=2, max_age=60)
+        for key in ('a', 'b', 'c'):
+            index.add(key, key + '.png')
+            index.entries[key]['last_used'] -= ord('d') - ord(key)
+        # the least recently used entry is evicted
+        assert sorted(index.entries) == ['b', 'c']
+
+        # expired entries are not used
+        index.entries['b']['created_at'] -= 61
+        assert index.get('b') is None
+        assert 'b' not in index
+        assert index.get('c') == 'c.png'
+
+
+class TestResultCache(object):
+
+    def test_get_key(self):
+        key = cache.ResultCache.get_key('abc', model='m:0', scale=1)
+        assert key == cache.ResultCache.get_key('abc', scale=1, model='m:0')
+        assert key != cache.ResultCache.get_key('abc', model='m:1', scale=1)
+        assert key != cache.ResultCache.get_key('def', model='m:0', scale=1)
+
+    def test_get_and_add(self, tmpdir):
+        cache_dir = os.path.join(str(tmpdir), 'cache')
+        output_file = os.path.join(str(tmpdir), 'output.zip')
+        with open(output_file, 'w') as f:
+            f.write('results')
+
+        rc = cache.ResultCache(cache_dir)
+        assert rc.get('key') is None
+
+        rc.add('key', 'example.com/output.zip', output_file,
+               created_at='now')
+        entry = rc.get('key')
+        assert entry['output_url'] == 'example.com/output.zip'
+        assert entry['summary']['created_at'] == 'now'
+        assert os.path.isfile(entry['output_file'])
+        assert entry['output_file'].startswith(cache_dir)
+        assert rc.size == len('results')
+        assert rc.summary()['hits'] == 1
+        assert rc.summary()['misses'] == 1
+
+        # cache is persisted
+        rc.save()
+        rc = cache.ResultCache(cache_dir)
+        assert rc.get('key') is not None
+
+        # missing files are a cache miss
+        os.remove(entry['output_file'])
+        assert rc.get('key') is None
+        assert 'key' not in rc
+
+        # results without a local file can still be cached
+        rc.add('key', 'example.com/output.zip')
+        assert rc.get('key')['output_file'] is None
+
+    def test_evict(self, tmpdir):
+        cache_dir = os.path.join(str(tmpdir), 'cache')
+        output_file = os.path.join(str(tmpdir), 'output.zip')
+        with open(output_file, 'w') as f:
+            f.write('0123456789')
+
+        rc = cache.ResultCache(cache_dir, max_bytes=25)
+        rc.add('a', 'url', output_file)
+        rc.add('b', 'url', output_file)
+        rc.entries['a']['last_used'] -= 10
+        rc.entries['b']['last_used'] -= 5
+        rc.get('a')  # a is now the most recently used
+        rc.add('c', 'url', output_file)
+        assert set(rc.entries) == {'a', 'c'}
+        assert len(os.listdir(cache_dir)) == 2
+
+        # expire old entries
+        rc.max_age = 60
+        rc.entries['a']['created_at'] -= 120
+        assert rc.evict() == 1
+        assert rc.get('a') is None
+        assert rc.get('c') is not None
+
+
+class TestQueryCache(object):
+
+    def test_get_and_add_response(self, tmpdir):
+        cache_dir = os.path.join(str(tmpdir), 'cache')
+        qc = cache.QueryCache(cache_dir)
+        key = qc.get_key('kube_node_created', start=0, end=100, step=15)
+        assert qc.get_response(key) is None
+
+        response = {'status': 'success', 'data': {'result': [1, 2, 3]}}
+        qc.add_response(key, response)
+        assert qc.get_response(key) == response
+        assert os.listdir(cache_dir) == [key + '.json']
+
+        # cached responses never expire
+        qc.entries[key]['created_at'] -= 10 ** 9
+        assert qc.evict() == 0
+
+        # invalid responses are a cache miss
+        with open(qc.entries[key]['output_file'], 'w') as f:
+            f.write('not json')
+        assert qc.get_response(key) is None
+        assert key not in qc
+
+    def test_evict(self, tmpdir):
+        qc = cache.QueryCache(str(tmpdir), max_bytes=100)
+        for i in range(5):
+            qc.add_response(str(i), {'data': '0' * 30})
+        assert qc.size <= 100
+        assert set(qc.entries) == {'3', '4'}
@@ -0,0 +1,233 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Compact columnar storage of job data.
+
+Job data is saved as typed numpy arrays in a single ``.npz`` file:
+
+* Numeric fields are float64 columns, with NaN for missing values.
+  Fields with a list of values for some jobs, such as the timings of
+  child jobs, are stored as the flattened values and an ``<field>_offsets``
+  column, where the values of job ``i`` are
+  ``values[offsets[i]:offsets[i + 1]]``.
+* Dates are float64 columns of epoch seconds.
+* String fields are dictionary-encoded as int32 codes, with -1 for missing
+  values, and a ``<field>_categories`` column of unique values.
+* The summary data of the run is a JSON string in the ``summary`` column.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import array
+import json
+
+import dateutil.parser
+import numpy as np
+
+
+# per-job timing fields of Job.json()
+TIMING_FIELDS = (
+    'total_time',
+    'prediction_time',
+    'postprocess_time',
+    'upload_time',
+    'download_time',
+    'cleanup_time',
+    'children_upload_time',
+    'client_upload_time',
+    'predict_retries',
+)
+
+FLOAT_FIELDS = TIMING_FIELDS + ('total_jobs', 'client_upload_rate')
+
+DATE_FIELDS = ('created_at', 'finished_at')
+
+STRING_FIELDS = (
+    'input_file',
+    'host',
+    'status',
+    'model',
+    'preprocess',
+    'postprocess',
+    'reason',
+)
+
+SUMMARY_KEY = 'summary'
+
+
+def to_floats(value):
+    """Get all numbers of a value, which may be a number, a list,
+    or a comma-separated string.
+
+    Returns:
+        list: The numeric values, ignoring any non-numeric values.
+    """
+    if isinstance(value, str):
+        value = value.split(',')
+    elif not isinstance(value, (list, tuple)):
+        value = [value]
+
+    floats = []
+    for v in value:
+        try:
+            floats.append(float(v))
+        except (TypeError, ValueError):
+            pass
+    return floats
+
+
+def to_timestamp(value):
+    """Get the epoch seconds of an ISO formatted date, or None."""
+    if not isinstance(value, str):
+        return None
+    try:
+        return dateutil.parser.isoparse(value).timestamp()
+    except ValueError:
+        return None
+
+
+class ColumnBuilder(object):
+    """Appends the data of each job to typed columns.
+
+    Only a few bytes are kept per job, so the job data of very large runs
+    may be added one job at a time.
+    """
+
+    def __init__(self):
+        self.num_jobs = 0
+        self._floats = {f: array.array('d') for f in FLOAT_FIELDS}
+        self._offsets = {f: array.array('q', [0]) for f in FLOAT_FIELDS}
+        self._ragged = set()
+        self._dates = {f: array.array('d') for f in DATE_FIELDS}
+        self._codes = {f: array.array('i') for f in STRING_FIELDS}
+        self._categories = {f: {} for f in STRING_FIELDS}
+
+    def add(self, job):
+        """Add the data of a job, as returned by Job.json()."""
+        self.num_jobs += 1
+        for field in FLOAT_FIELDS:
+            value = job.get(field)
+            values = to_floats(value)
+            if isinstance(value, (list, tuple)) or len(values) > 1:
+                self._ragged.add(field)
+            elif not values:
+                values = [np.nan]
+            self._floats[field].extend(values)
+            self._offsets[field].append(len(self._floats[field]))
+
+        for field in DATE_FIELDS:
+            timestamp = to_timestamp(job.get(field))
+            self._dates[field].append(
+                np.nan if timestamp is None else timestamp)
+
+        for field in STRING_FIELDS:
+            value = job.get(field)
+            if value is None:
+                code = -1
+            else:
+                categories = self._categories[field]
+                code = categories.setdefault(str(value), len(categories))
+            self._codes[field].append(code)
+
+    def columns(self):
+        """Get the columns of all added jobs.
+
+        The columns share memory with the builder, so no more jobs may be
+        added afterwards.
+
+        Returns:
+            dict: numpy arrays of each column.
+        """
+        columns = {}
+        for field in FLOAT_FIELDS:
+            columns[field] = np.frombuffer(self._floats[field],
+                                           dtype=np.float64)
+            if field in self._ragged:
+                columns[field + '_offsets'] = np.frombuffer(
+                    self._offsets[field], dtype=np.int64)
+
+        for field in DATE_FIELDS:
+            columns[field] = np.frombuffer(self._dates[field],
+                                           dtype=np.float64)
+
+        for field in STRING_FIELDS:
+            columns[field] = np.frombuffer(self._codes[field], dtype=np.int32)
+            columns[field + '_categories'] = np.array(
+                list(self._categories[field]), dtype=np.str_)
+        return columns
+
+
+def save_columns(path, jobs, summary=None):
+    """Save the job data and summary of a run as compressed columns.
+
+    Args:
+        path (str): The ``.npz`` file to write.
+        jobs (iterable): The data of each job, from Job.json().
+        summary (dict): The summary data of the run, without "job_data".
+
+    Returns:
+        int: The number of jobs saved.
+    """
+    builder = ColumnBuilder()
+    for job in jobs:
+        builder.add(job)
+
+    columns = builder.columns()
+    columns[SUMMARY_KEY] = np.array(json.dumps(summary or {}))
+    np.savez_compressed(path, **columns)
+    return builder.num_jobs
+
+
+def load_columns(path):
+    """Load the columns and summary saved by save_columns().
+
+    Args:
+        path (str): The ``.npz`` file.
+
+    Returns:
+        tuple: The summary data of the run and a dict of each column.
+    """
+    with np.load(path, allow_pickle=False) as data:
+        columns = {k: data[k] for k in data.files}
+    summary = json.loads(str(columns.pop(SUMMARY_KEY, '{}')))
+    return summary, columns
+
+
+def decode(columns, field):
+    """Get the string values of a dictionary-encoded column.
+
+    Returns:
+        numpy.array: The value of each job, or None if missing.
+    """
+    codes = columns[field]
+    categories = columns[field + '_categories'].astype(object)
+    values = np.append(categories, None)  # code -1 is None
+    return values[codes]
+
+
+def num_jobs(columns):
+    """Get the number of jobs in the columns."""
+    return len(columns[STRING_FIELDS[0]])
@@ -0,0 +1,115 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for columnar storage of job data"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import numpy as np
+
+from kiosk_client import columnar
+
+
+def _jobs():
+    return [
+        {'status': 'done', 'model': 'model:0', 'total_time': 1.5,
+         'prediction_time': [1.0, 2.0], 'upload_time': None,
+         'finished_at': '2021-01-01T00:00:00+00:00'},
+        {'status': 'failed', 'model': 'model:0', 'total_time': '2.5',
+         'prediction_time': '3.0,4.0,5.0', 'reason': 'Error: bad',
+         'finished_at': None},
+        {'status': 'done', 'model': 'model:1', 'total_time': 3,
+         'prediction_time': [], 'finished_at': 'not a date'},
+    ]
+
+
+class TestColumnar(object):
+
+    def test_to_floats(self):
+        assert columnar.to_floats(1) == [1.0]
+        assert columnar.to_floats('1,2') == [1.0, 2.0]
+        assert columnar.to_floats([1, None, 'x']) == [1.0]
+        assert columnar.to_floats(None) == []
+        assert columnar.to_floats('1.5') == [1.5]
+        assert columnar.to_floats('None') == []
+
+    def test_to_timestamp(self):
+        assert columnar.to_timestamp('1970-01-01T00:01:00+00:00') == 60
+        assert columnar.to_timestamp('bad') is None
+        assert columnar.to_timestamp(None) is None
+
+    def test_column_builder(self):
+        builder = columnar.ColumnBuilder()
+        for job in _jobs():
+            builder.add(job)
+        columns = builder.columns()
+
+        assert builder.num_jobs == 3
+        assert columnar.num_jobs(columns) == 3
+
+        # scalar fields have one value per job
+        assert columns['total_time'].dtype == np.float64
+        assert columns['total_time'].tolist() == [1.5, 2.5, 3.0]
+        assert 'total_time_offsets' not in columns
+        assert np.isnan(columns['upload_time']).all()
+
+        # list fields are flattened, with offsets
+        assert columns['prediction_time'].tolist() == [1, 2, 3, 4, 5]
+        assert columns['prediction_time_offsets'].tolist() == [0, 2, 5, 5]
+
+        # dates are epoch seconds
+        finished_at = columns['finished_at']
+        assert finished_at[0] == 1609459200
+        assert np.isnan(finished_at[1:]).all()
+
+        # strings are dictionary-encoded
+        assert columns['status'].dtype == np.int32
+        assert columns['status'].tolist() == [0, 1, 0]
+        assert columns['status_categories'].tolist() == ['done', 'failed']
+        assert columnar.decode(columns, 'model').tolist() == [
+            'model:0', 'model:0', 'model:1']
+        assert columnar.decode(columns, 'reason').tolist() == [
+            None, 'Error: bad', None]
+
+    def test_save_and_load_columns(self, tmpdir):
+        path = os.path.join(str(tmpdir), 'output.npz')
+        count = columnar.save_columns(path, iter(_jobs()), {'num_jobs': 3})
+        assert count == 3
+
+        summary, columns = columnar.load_columns(path)
+        assert summary == {'num_jobs': 3}
+        assert columns['prediction_time_offsets'].tolist() == [0, 2, 5, 5]
+        assert columnar.decode(columns, 'status').tolist() == [
+            'done', 'failed', 'done']
+
+        # no jobs
+        columnar.save_columns(path, [])
+        summary, columns = columnar.load_columns(path)
+        assert summary == {}
+        assert columnar.num_jobs(columns) == 0
+        assert columnar.decode(columns, 'status').tolist() == []
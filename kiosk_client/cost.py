@@ -28,57 +28,47 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import json
 import logging
+import math
 import time
 import urllib
 
-import requests
+import numpy as np
+import treq
+from twisted.internet import defer
+from twisted.internet import error as twisted_errors
+from twisted.web import _newclient as twisted_client
 
 from kiosk_client import settings
+from kiosk_client.cache import QueryCache
+from kiosk_client.pricing import Pricing
+from kiosk_client.utils import sleep
 
 
-# defining Google Cloud prices
+# Prometheus rejects range queries with more points per time series
+MAX_RESOLUTION = 11000
+
+# Seconds after which a time window is closed and its data will not change
+CLOSED_WINDOW_DELAY = 60
+
+# GPU utilization of each node, as a percentage
+GPU_DUTY_CYCLE_QUERY = 'max by (node) (container_accelerator_duty_cycle)'
+
+# Prediction requests per second handled by TensorFlow Serving
+TF_SERVING_REQUEST_QUERY = \
+    'sum(rate(:tensorflow:serving:request_count[5m]))'
+
+# default Google Cloud prices, see kiosk_client/data/pricing.json
+DEFAULT_PRICING = Pricing()
 
 # computed networking costs for 1,000,000 image run:
-NETWORKING_COSTS = 7.00
-
-# current, as of 6/17/19
-COST_TABLE = {
-    'n1-standard-1': {'ondemand': 0.0475, 'preemptible': 0.0100},
-    'n1-standard-2': {'ondemand': 0.0950, 'preemptible': 0.0200},
-    'n1-standard-4': {'ondemand': 0.1900, 'preemptible': 0.0400},
-    'n1-standard-8': {'ondemand': 0.3800, 'preemptible': 0.0800},
-    'n1-standard-16': {'ondemand': 0.7600, 'preemptible': 0.1600},
-    'n1-standard-32': {'ondemand': 1.5200, 'preemptible': 0.3200},
-    'n1-standard-64': {'ondemand': 3.0400, 'preemptible': 0.6400},
-    'n1-standard-96': {'ondemand': 4.5600, 'preemptible': 0.9600},
-    'n1-highmem-2': {'ondemand': 0.1184, 'preemptible': 0.0250},
-    'n1-highmem-4': {'ondemand': 0.2368, 'preemptible': 0.0500},
-    'n1-highmem-8': {'ondemand': 0.4736, 'preemptible': 0.1000},
-    'n1-highmem-16': {'ondemand': 0.9472, 'preemptible': 0.2000},
-    'n1-highmem-32': {'ondemand': 1.8944, 'preemptible': 0.4000},
-    'n1-highmem-64': {'ondemand': 3.7888, 'preemptible': 0.8000},
-    'n1-highmem-96': {'ondemand': 5.6832, 'preemptible': 1.2000},
-    'n1-highcpu-2': {'ondemand': 0.0709, 'preemptible': 0.0150},
-    'n1-highcpu-4': {'ondemand': 0.1418, 'preemptible': 0.0300},
-    'n1-highcpu-8': {'ondemand': 0.2836, 'preemptible': 0.0600},
-    'n1-highcpu-16': {'ondemand': 0.5672, 'preemptible': 0.1200},
-    'n1-highcpu-32': {'ondemand': 1.1344, 'preemptible': 0.2400},
-    'n1-highcpu-64': {'ondemand': 2.2688, 'preemptible': 0.4800},
-    'n1-highcpu-96': {'ondemand': 3.4020, 'preemptible': 0.7200},
-    'n1-ultramem-40': {'ondemand': 6.3039, 'preemptible': 1.3311},
-    'n1-ultramem-80': {'ondemand': 12.6078, 'preemptible': 2.6622},
-    'n1-ultramem-160': {'ondemand': 25.2156, 'preemptible': 5.3244},
-    'n1-megamem-96': {'ondemand': 10.6740, 'preemptible': 2.2600},
-}
-
-GPU_TABLE = {
-    'nvidia-tesla-t4': {'ondemand': 0.95, 'preemptible': 0.29},
-    'nvidia-tesla-p4': {'ondemand': 0.60, 'preemptible': 0.216},
-    'nvidia-tesla-v100': {'ondemand': 2.48, 'preemptible': 0.74},
-    'nvidia-tesla-p100': {'ondemand': 1.46, 'preemptible': 0.43},
-    'nvidia-tesla-k80': {'ondemand': 0.45, 'preemptible': 0.135},
-}
+NETWORKING_COSTS = DEFAULT_PRICING.networking_costs
+
+COST_TABLE = DEFAULT_PRICING.machines
+
+GPU_TABLE = DEFAULT_PRICING.gpus
 
 
 class CostGetter(object):
@@ -115,15 +105,58 @@ class CostGetter(object):
 
         # initialize other necessary variables
         self.min_step = 15
-        self.cost_table = kwargs.get('cost_table', COST_TABLE)
-        self.gpu_table = kwargs.get('gpu_table', GPU_TABLE)
-        self.networking_costs = kwargs.get('networking_costs', NETWORKING_COSTS)
+        pricing = kwargs.get('pricing', settings.PRICING_FILE)
+        if not isinstance(pricing, Pricing):
+            pricing = Pricing(pricing, settings.PRICING_REGION)
+        self.pricing = pricing
+        self.cost_table = kwargs.get('cost_table', pricing.machines)
+        self.gpu_table = kwargs.get('gpu_table', pricing.gpus)
+        self.networking_costs = kwargs.get('networking_costs',
+                                           pricing.networking_costs)
 
         self.grafana_user = settings.GRAFANA_USER
         self.grafana_password = settings.GRAFANA_PASSWORD
         self.grafana_host = settings.GRAFANA_HOST
+        self.grafana_datasource = 1  # the Prometheus datasource
         self.logger = logging.getLogger(str(self.__class__.__name__))
 
+        # HTTP settings, reuse the JobManager's connection pool if provided.
+        self.pool = kwargs.get('pool')
+        self.timeout = float(kwargs.get('timeout', settings.GRAFANA_TIMEOUT))
+        self.max_retries = int(kwargs.get('max_retries', 3))
+
+        # split long windows into chunks queried at min_step in parallel
+        self.full_resolution = kwargs.get('full_resolution',
+                                          settings.GRAFANA_FULL_RESOLUTION)
+        self.max_concurrent_queries = int(
+            kwargs.get('max_concurrent_queries', 4))
+
+        # cache responses of closed windows, if a directory is provided
+        query_cache = kwargs.get('query_cache', settings.GRAFANA_CACHE_DIR)
+        if isinstance(query_cache, str) and query_cache:
+            query_cache = QueryCache(
+                query_cache,
+                max_bytes=kwargs.get('query_cache_max_bytes',
+                                     settings.GRAFANA_CACHE_MAX_BYTES))
+        self.query_cache = query_cache if query_cache != '' else None
+
+        self.node_data = None  # lifetimes and labels of each node
+
+        # running costs, updated incrementally during the benchmark
+        self.node_epochs = {}  # node name -> {created_at: last timestamp}
+        self.node_labels = {}  # node name -> parsed kube_node_labels data
+        self.last_update = None  # end of the most recently queried window
+        self.sleep = sleep  # allow monkey-patch
+
+        self._http_errors = (
+            defer.CancelledError,  # request timed out
+            twisted_client.ResponseNeverReceived,
+            twisted_client.RequestTransmissionFailed,
+            twisted_errors.TimeoutError,
+            twisted_errors.ConnectError,
+            twisted_errors.ConnectingCancelledError,
+        )
+
     @classmethod
     def get_time(cls):
         """Get current time in epoch seconds."""
@@ -131,13 +164,46 @@ class CostGetter(object):
         # to establish the beginning or end of cost accrual.
         return int(time.time())
 
-    def get_query_data(self, query, step=None):
+    def get_step(self, start=None, end=None):
+        """Get the smallest multiple of min_step that keeps the query between
+        start and end within Prometheus' maximum resolution."""
+        start = self.benchmarking_start_time if start is None else start
+        end = self.benchmarking_end_time if end is None else end
+        end = self.get_time() if end is None else end
+        duration = max(int(end) - int(start), 0)
+        num_steps = math.ceil(duration / (MAX_RESOLUTION * self.min_step))
+        return self.min_step * max(int(num_steps), 1)
+
+    def get_windows(self):
+        """Split the benchmarking window into (start, end) chunks which can
+        each be queried at min_step."""
+        start = self.benchmarking_start_time
+        end = self.benchmarking_end_time
+        end = self.get_time() if end is None else end
+        window = MAX_RESOLUTION * self.min_step
+        windows = []
+        while True:
+            chunk_end = min(start + window, end)
+            windows.append((start, chunk_end))
+            start = chunk_end + self.min_step
+            if start > end:
+                break
+        return windows
+
+    def is_closed(self, end):
+        """Whether the data of a window ending at end will no longer change."""
+        return end is not None and int(end) + CLOSED_WINDOW_DELAY <= \
+            self.get_time()
+
+    def get_query_data(self, query, step=None, start=None, end=None):
         """Return a payload of the given query for the Grafana API"""
-        step = self.min_step if step is None else step
+        start = self.benchmarking_start_time if start is None else start
+        end = self.benchmarking_end_time if end is None else end
+        step = self.get_step(start, end) if step is None else step
         return {
             'query': query,
-            'start': self.benchmarking_start_time,
-            'end': self.benchmarking_end_time,
+            'start': start,
+            'end': end,
             'step': step,
         }
 
@@ -148,14 +214,38 @@ class CostGetter(object):
             url_encode = urllib.parse.urlencode  # pylint: disable=E1101
         else:
             url_encode = urllib.urlencode  # pylint: disable=E1101
-        return 'http://{user}:{passwd}@{host}{route}?{querystring}'.format(
-            user=self.grafana_user,
-            passwd=self.grafana_password,
+        return 'http://{host}{route}?{querystring}'.format(
             host=self.grafana_host,
-            route='/api/datasources/proxy/1/api/v1/query_range',
+            route='/api/datasources/proxy/{}/api/v1/query_range'.format(
+                self.grafana_datasource),
             querystring=url_encode(data))
 
-    def send_grafana_api_request(self, query, step=None):
+    @defer.inlineCallbacks
+    def _get(self, url):
+        """Send a GET request to the url, retrying any connection errors."""
+        retries = 0
+        while True:
+            try:
+                response = yield treq.get(
+                    url,
+                    auth=(self.grafana_user, self.grafana_password),
+                    pool=self.pool,
+                    timeout=self.timeout)
+                jsondata = yield response.json()
+            except self._http_errors as err:
+                if retries >= self.max_retries:
+                    raise
+                retries += 1
+                self.logger.warning('Encountered %s during Grafana request, '
+                                    'retrying (%s/%s): %s', type(err).__name__,
+                                    retries, self.max_retries, err)
+                yield self.sleep(0.5)
+                continue
+            defer.returnValue((response.code, jsondata))
+
+    @defer.inlineCallbacks
+    def send_grafana_api_request(self, query, step=None, start=None,
+                                 end=None):
         """Send a HTTP GET request with the data url encoded"""
         # initialize retry loop values
         status_code = None
@@ -165,7 +255,19 @@ class CostGetter(object):
         # error text found in requests that are too large. must increase step.
         retryable_errortext = 'exceeded maximum resolution'
 
-        reqdata = self.get_query_data(query, step)
+        reqdata = self.get_query_data(query, step, start, end)
+
+        # closed windows are immutable, check the cache first.
+        cache_key = None
+        if self.query_cache is not None and self.is_closed(reqdata['end']):
+            # responses of other clusters are not shared
+            cache_key = QueryCache.get_key(
+                query, host=self.grafana_host,
+                datasource=self.grafana_datasource, **reqdata)
+            jsondata = self.query_cache.get_response(cache_key)
+            if jsondata is not None:
+                self.logger.debug('Found cached response for %s.', query)
+                defer.returnValue(jsondata)
 
         status_is_400 = lambda x: x is None or x == 400
         retryable_error = lambda x: x is None or retryable_errortext in str(x)
@@ -173,16 +275,13 @@ class CostGetter(object):
         # if there are too many datapoints, a 400 error code is returned.
         # inspect the error text to confirm.
         while status_is_400(status_code) and retryable_error(errortext):
-            # don't spam the API
-            time.sleep(0.5 * int(not is_first_req))
+            if not is_first_req:
+                yield self.sleep(0.5)  # don't spam the API
 
             reqdata['step'] += self.min_step * int(not is_first_req)
             url = self.get_url(reqdata)
 
-            response = requests.get(url)
-            status_code = response.status_code
-
-            jsondata = response.json()
+            status_code, jsondata = yield self._get(url)
 
             if status_code != 200:
                 is_first_req = False  # starting to retry
@@ -190,16 +289,75 @@ class CostGetter(object):
                 self.logger.warning('%s request failed due to error: %s',
                                     query, errortext)
 
-        return jsondata
+        if cache_key is not None and status_code == 200:
+            self.query_cache.add_response(cache_key, jsondata)
+            self.query_cache.save()
+
+        defer.returnValue(jsondata)
+
+    def merge_responses(self, responses):
+        """Concatenate the values of each time series of chunked queries"""
+        results = collections.OrderedDict()
+        for response in responses:
+            if response.get('status', 'success') != 'success':
+                raise ValueError('Grafana query failed: %s' %
+                                 response.get('error'))
+            for time_series in response['data']['result']:
+                key = json.dumps(time_series['metric'], sort_keys=True)
+                if key not in results:
+                    results[key] = {
+                        'metric': time_series['metric'],
+                        'values': [],
+                    }
+                results[key]['values'].extend(time_series['values'])
+        return {
+            'status': 'success',
+            'data': {
+                'resultType': 'matrix',
+                'result': list(results.values()),
+            },
+        }
 
+    @defer.inlineCallbacks
+    def query_range(self, query):
+        """Query the whole benchmarking window.
+
+        If full_resolution is set, long windows are queried in chunks
+        at min_step concurrently and merged. Otherwise the step is
+        increased to fit the window in a single query.
+        """
+        windows = self.get_windows() if self.full_resolution else []
+        if len(windows) <= 1:
+            response = yield self.send_grafana_api_request(query)
+            defer.returnValue(response)
+
+        self.logger.debug('Querying %s in %s chunks.', query, len(windows))
+        semaphore = defer.DeferredSemaphore(self.max_concurrent_queries)
+        try:
+            responses = yield defer.gatherResults([
+                semaphore.run(self.send_grafana_api_request, query,
+                              self.min_step, start, end)
+                for start, end in windows
+            ], consumeErrors=True)
+        except defer.FirstError as err:
+            err.subFailure.raiseException()
+        defer.returnValue(self.merge_responses(responses))
+
+    @defer.inlineCallbacks
     def finish(self):
         # This is the wrapper function for all the functionality
         # that will executed immediately once benchmarking is finished.
         if not self.benchmarking_end_time:
             self.benchmarking_end_time = self.get_time()
 
-        creation_data = self.send_grafana_api_request('kube_node_created')
-        label_data = self.send_grafana_api_request('kube_node_labels')
+        # send both queries concurrently
+        try:
+            creation_data, label_data = yield defer.gatherResults([
+                self.query_range('kube_node_created'),
+                self.query_range('kube_node_labels'),
+            ], consumeErrors=True)
+        except defer.FirstError as err:
+            err.subFailure.raiseException()
 
         parsed_creation_data = self.parse_create_response(creation_data)
         parsed_label_data = self.parse_label_response(label_data)
@@ -211,44 +369,231 @@ class CostGetter(object):
                 for k in parsed_label_data[node_name]:
                     node_data[node_name][k] = parsed_label_data[node_name][k]
 
+        self.node_data = node_data
+
         (cpu_node_costs, gpu_node_costs, total_node_costs) = \
             self.compute_costs(node_data)
         total_costs = total_node_costs + self.networking_costs
-        return str(cpu_node_costs), str(gpu_node_costs), str(total_costs)
+        defer.returnValue((str(cpu_node_costs),
+                           str(gpu_node_costs),
+                           str(total_costs)))
+
+    @defer.inlineCallbacks
+    def get_utilization(self):
+        """Get the GPU utilization of the nodes found by finish().
+
+        Returns:
+            dict: The GPU-hours, idle GPU-hours, utilization-weighted GPU
+                costs and images per GPU-hour, see compute_utilization().
+        """
+        if self.node_data is None:
+            raise ValueError('finish() must be called before '
+                             'get_utilization().')
 
-    def parse_create_response(self, response):
-        node_info = {}
-        # parse node liveness data
+        try:
+            duty_cycle_data, request_data = yield defer.gatherResults([
+                self.query_range(GPU_DUTY_CYCLE_QUERY),
+                self.query_range(TF_SERVING_REQUEST_QUERY),
+            ], consumeErrors=True)
+        except defer.FirstError as err:
+            err.subFailure.raiseException()
+
+        duty_cycles = self.parse_duty_cycle_response(duty_cycle_data)
+        num_requests = self.parse_request_rate_response(request_data)
+        defer.returnValue(self.compute_utilization(
+            self.node_data, duty_cycles, num_requests))
+
+    def parse_duty_cycle_response(self, response):
+        """Get the mean GPU utilization of each node, from 0 to 1."""
+        utilization = {}
         for time_series in response['data']['result']:
-            # get node name and create dictionary entry
-            node_name = time_series['metric']['node']
-            node_info[node_name] = {}
-            # get node lifetime
-            # Was there only one creation event?
-            first_event = time_series['values'][0]
-            last_event = time_series['values'][-1]
-
-            if first_event[-1] == last_event[-1]:
-                # they're the same! easy to calculate
-                created_at = int(last_event[-1])
-                # only count costs during the benchmarking window.
-                created_at = max(created_at, self.benchmarking_start_time)
-                node_info[node_name]['lifetime'] = last_event[0] - created_at
+            node_name = time_series['metric'].get('node')
+            if node_name is None:  # cannot be matched to a node
+                self.logger.warning('Ignoring GPU duty cycle without a '
+                                    '`node` label: %s', time_series['metric'])
                 continue
+            duty_cycle = np.array([v[-1] for v in time_series['values']],
+                                  dtype=np.float64)
+            if duty_cycle.size:
+                utilization[node_name] = float(np.mean(duty_cycle)) / 100
+        return utilization
+
+    def parse_request_rate_response(self, response):
+        """Integrate the request rate to get the total number of requests."""
+        num_requests = 0.
+        for time_series in response['data']['result']:
+            values = time_series['values']
+            timestamps = np.array([v[0] for v in values], dtype=np.float64)
+            rates = np.array([v[-1] for v in values], dtype=np.float64)
+            rates[np.isnan(rates)] = 0
+            num_requests += float(np.sum(rates[:-1] * np.diff(timestamps)))
+        return num_requests
+
+    def compute_utilization(self, node_data, duty_cycles, num_requests):
+        """Split the GPU node costs into utilized and idle costs.
+
+        Each GPU node is assumed to have a single GPU.
+
+        Args:
+            node_data (dict): The lifetime and labels of each node.
+            duty_cycles (dict): The mean GPU utilization of each node.
+            num_requests (float): The number of TensorFlow Serving requests,
+                each of which is a single image.
+
+        Returns:
+            dict: The GPU-hours, idle GPU-hours, mean GPU utilization,
+                GPU node costs split into utilized and idle costs,
+                and images per GPU-hour.
+        """
+        gpu_nodes = [n for n in node_data if node_data[n].get('gpu')]
+        missing = [n for n in gpu_nodes if n not in duty_cycles]
+        if missing:
+            self.logger.warning('No GPU utilization data for %s nodes, they '
+                                'are considered idle.', len(missing))
+
+        hours = np.array([node_data[n]['lifetime'] for n in gpu_nodes],
+                         dtype=np.float64) / 60 / 60
+        hourly_costs = np.array([self.compute_hourly_cost(node_data[n])
+                                 for n in gpu_nodes], dtype=np.float64)
+        utilization = np.array([duty_cycles.get(n, 0) for n in gpu_nodes],
+                               dtype=np.float64)
+        costs = hourly_costs * hours
+
+        gpu_hours = float(np.sum(hours))
+        utilized_gpu_hours = float(np.sum(hours * utilization))
+        return {
+            'gpu_hours': gpu_hours,
+            'idle_gpu_hours': gpu_hours - utilized_gpu_hours,
+            'gpu_utilization': (utilized_gpu_hours / gpu_hours
+                                if gpu_hours else 0),
+            'gpu_node_cost': float(np.sum(costs)),
+            'utilized_gpu_cost': float(np.sum(costs * utilization)),
+            'idle_gpu_cost': float(np.sum(costs * (1 - utilization))),
+            'images': num_requests,
+            'images_per_gpu_hour': (num_requests / gpu_hours
+                                    if gpu_hours else 0),
+        }
+
+    @defer.inlineCallbacks
+    def update(self):
+        """Query only the window since the last update and update the
+        running lifetimes of all nodes.
+
+        Returns:
+            dict: The running costs, see get_running_costs().
+        """
+        end = self.get_time()
+        start = self.last_update
+        if start is None:
+            start = self.benchmarking_start_time
 
-            # there was more than one creation event :(
-            # loop over list backward to find the final event for each creation
-            lifetime = 0
-            curr_label = None
-            for i in range(len(time_series['values']) - 1, 0, -1):
-                ts, created_at = time_series['values'][i]
+        try:
+            creation_data, label_data = yield defer.gatherResults([
+                self.send_grafana_api_request('kube_node_created',
+                                              start=start, end=end),
+                self.send_grafana_api_request('kube_node_labels',
+                                              start=start, end=end),
+            ], consumeErrors=True)
+        except defer.FirstError as err:
+            err.subFailure.raiseException()
+
+        for time_series in creation_data['data']['result']:
+            values = time_series['values']
+            node_name = time_series['metric']['node']
+            epochs = self.node_epochs.setdefault(node_name, {})
+            for i in self.get_epoch_ends(values):
+                ts, created_at = values[i]
                 created_at = int(created_at)
-                if created_at != curr_label:  # a new label.
-                    curr_label = created_at
-                    created_at = max(created_at, self.benchmarking_start_time)
-                    lifetime += ts - created_at
+                epochs[created_at] = max(float(ts), epochs.get(created_at, 0))
+
+        self.node_labels.update(self.parse_label_response(label_data))
+        self.last_update = end
+        defer.returnValue(self.get_running_costs())
+
+    def get_running_costs(self):
+        """Get the costs of all nodes seen by update() so far.
+
+        Returns:
+            dict: The CPU, GPU and total node costs and the hourly burn rate.
+        """
+        start = self.benchmarking_start_time
+        node_data = {}
+        for node_name, epochs in self.node_epochs.items():
+            if node_name not in self.node_labels:
+                continue  # labels are not yet available
+            node_data[node_name] = dict(self.node_labels[node_name])
+            node_data[node_name]['lifetime'] = sum(
+                ts - max(created_at, start)
+                for created_at, ts in epochs.items())
+
+        cpu_node_costs, gpu_node_costs, total_node_costs = \
+            self.compute_costs(node_data)
+
+        hours = 0 if self.last_update is None else \
+            (self.last_update - start) / 60 / 60
+        return {
+            'cpu_node_cost': cpu_node_costs,
+            'gpu_node_cost': gpu_node_costs,
+            'node_cost': total_node_costs,
+            'cost_per_hour': total_node_costs / hours if hours > 0 else 0,
+        }
+
+    @classmethod
+    def get_epoch_ends(cls, values):
+        """Get the index of the last point of each creation event.
+
+        Args:
+            values (list): The [timestamp, created_at] pairs of a node's
+                kube_node_created time series.
+
+        Returns:
+            numpy.array: The index of each point followed by a new
+                created_at value, and the index of the last point.
+        """
+        # compare the raw values, casting each one to int is much slower.
+        labels = np.array([v[-1] for v in values], dtype=object)
+        is_last = np.ones(len(labels), dtype=bool)
+        is_last[:-1] = labels[:-1] != labels[1:]
+        return np.flatnonzero(is_last)
+
+    def get_lifetime(self, values):
+        """Get the seconds a node was alive during the benchmarking window.
+
+        Args:
+            values (list): The [timestamp, created_at] pairs of the node's
+                kube_node_created time series.
+
+        Returns:
+            float: The total lifetime of all of the node's creation events.
+        """
+        first_event = values[0]
+        last_event = values[-1]
+
+        if first_event[-1] == last_event[-1]:
+            # only one creation event, only count the benchmarking window.
+            created_at = max(int(last_event[-1]), self.benchmarking_start_time)
+            return float(last_event[0] - created_at)
+
+        # there was more than one creation event.
+        # the last point of each creation event marks the end of its
+        # lifetime. the first point is never the end of an event.
+        change_points = self.get_epoch_ends(values)
+        change_points = change_points[change_points > 0]
+        timestamps = np.array([values[i][0] for i in change_points],
+                              dtype=np.float64)
+        created_at = np.array([int(values[i][-1]) for i in change_points],
+                              dtype=np.int64)
+        created_at = np.maximum(created_at, self.benchmarking_start_time)
+        return float(np.sum(timestamps - created_at))
 
-            node_info[node_name]['lifetime'] = lifetime
+    def parse_create_response(self, response):
+        node_info = {}
+        # parse node liveness data
+        for time_series in response['data']['result']:
+            node_name = time_series['metric']['node']
+            node_info[node_name] = {
+                'lifetime': self.get_lifetime(time_series['values']),
+            }
         return node_info
 
     def parse_label_response(self, response):
@@ -263,8 +608,10 @@ class CostGetter(object):
             instance_type = metric['label_beta_kubernetes_io_instance_type']
             preemptible = 'label_cloud_google_com_gke_preemptible' in metric
             gpu = metric.get('label_cloud_google_com_gke_accelerator')
+            node_pool = metric.get('label_cloud_google_com_gke_nodepool')
 
             node_info[node_name]['instance_type'] = instance_type
+            node_info[node_name]['node_pool'] = node_pool
             node_info[node_name]['preemptible'] = preemptible
             node_info[node_name]['gpu'] = gpu
 
@@ -272,19 +619,35 @@ class CostGetter(object):
 
     def compute_costs(self, node_data):
         """Get cost for all nodes"""
-        gpu_node_costs = 0
-        cpu_node_costs = 0
-        total_node_costs = 0
-        for _, node_dict in node_data.items():
-            node_hourly_cost = self.compute_hourly_cost(node_dict)
-            node_cost = node_hourly_cost * (node_dict['lifetime'] / 60 / 60)
-            if not node_dict['gpu']:
-                cpu_node_costs = cpu_node_costs + node_cost
-            else:
-                gpu_node_costs = gpu_node_costs + node_cost
-            total_node_costs = total_node_costs + node_cost
+        nodes = list(node_data.values())
+        lifetimes = np.array([n['lifetime'] for n in nodes], dtype=np.float64)
+        hourly_costs = np.array([self.compute_hourly_cost(n) for n in nodes],
+                                dtype=np.float64)
+        is_gpu = np.array([bool(n['gpu']) for n in nodes], dtype=bool)
+
+        node_costs = hourly_costs * (lifetimes / 60 / 60)
+        cpu_node_costs = float(np.sum(node_costs[~is_gpu]))
+        gpu_node_costs = float(np.sum(node_costs[is_gpu]))
+        total_node_costs = float(np.sum(node_costs))
         return cpu_node_costs, gpu_node_costs, total_node_costs
 
+    def compute_node_pool_costs(self, node_data):
+        """Get the number of nodes, node-hours and cost of each node pool"""
+        node_pools = {}
+        for node_dict in node_data.values():
+            pool = node_pools.setdefault(node_dict.get('node_pool'), {
+                'instance_type': node_dict['instance_type'],
+                'gpu': node_dict['gpu'],
+                'nodes': 0,
+                'node_hours': 0,
+                'cost': 0,
+            })
+            hours = node_dict['lifetime'] / 60 / 60
+            pool['nodes'] += 1
+            pool['node_hours'] += hours
+            pool['cost'] += self.compute_hourly_cost(node_dict) * hours
+        return node_pools
+
     def compute_hourly_cost(self, node_data):
         """Get the hourly cost of a given node"""
         instance_type = node_data['instance_type']
@@ -300,3 +663,57 @@ class CostGetter(object):
 
         hourly_cost = instance_cost + gpu_cost
         return hourly_cost
+
+
+def recompute_costs(summary, pricing, num_done=None):
+    """Recompute the costs of a past run under alternate pricing.
+
+    Nodes whose machine type or GPU has no price are left out of the
+    costs and reported as "unpriced_nodes". The jobs per dollar of a run
+    with unpriced nodes are unknown.
+
+    Args:
+        summary (dict): The JSON output of a run, which includes the
+            lifetimes and labels of each node in "node_data".
+        pricing (Pricing): The pricing to apply.
+        num_done (int): The number of done jobs of the run. Counted from
+            the "job_data" of the summary if None.
+
+    Returns:
+        dict: The recomputed node costs, costs per node pool, jobs per
+            dollar, and the nodes without a price.
+    """
+    node_data = summary.get('node_data')
+    if not node_data:
+        raise ValueError('The summary has no node_data to recompute.')
+
+    def _is_priced(node):
+        key = 'ondemand' if not node['preemptible'] else 'preemptible'
+        if key not in pricing.machines.get(node['instance_type'], {}):
+            return False
+        return not node['gpu'] or key in pricing.gpus.get(node['gpu'], {})
+
+    priced = {k: n for k, n in node_data.items() if _is_priced(n)}
+    unpriced = {k: {'instance_type': n['instance_type'], 'gpu': n['gpu']}
+                for k, n in node_data.items() if k not in priced}
+
+    cg = CostGetter(benchmarking_start_time=0, benchmarking_end_time=0,
+                    pricing=pricing, query_cache=None)
+    cpu_cost, gpu_cost, node_cost = cg.compute_costs(priced)
+    total_cost = node_cost + cg.networking_costs
+
+    if num_done is None:
+        num_done = sum(int(j.get('status') == 'done')
+                       for j in summary.get('job_data', []))
+    jobs_per_dollar = None
+    if total_cost and not unpriced:
+        jobs_per_dollar = num_done / total_cost
+    return {
+        'pricing': pricing.json(),
+        'cpu_node_cost': cpu_cost,
+        'gpu_node_cost': gpu_cost,
+        'total_node_and_networking_costs': total_cost,
+        'node_pools': cg.compute_node_pool_costs(priced),
+        'jobs_per_dollar': jobs_per_dollar,
+        'unpriced_nodes': unpriced,
+    }
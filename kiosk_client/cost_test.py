@@ -28,24 +28,35 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import json
+import os
 import random
 import time
+import urllib
 
 import pytest
-import requests.exceptions
+import pytest_twisted
+import treq
+
+from twisted.internet import defer
+from twisted.internet import error as twisted_errors
 
 from kiosk_client import cost
+from kiosk_client import pricing
+from kiosk_client import settings
 
 
-class FakeCreationData:
+class FakeResponse(object):
+
+    def __init__(self, data, code=200):
+        self.code = code
+        self._data = data
+
+    def json(self):
+        return defer.succeed(self._data)
 
-    _status_code = 400
 
-    @property
-    def status_code(self):
-        code = self._status_code
-        if code == 400:
-            self._status_code = 200
+class FakeCreationData:
 
     @staticmethod
     def json(created_at=None, lifetime=10):
@@ -119,14 +130,6 @@ class FakeCreationData:
 
 class FakeLabelData:
 
-    _status_code = 400
-
-    @property
-    def status_code(self):
-        code = self._status_code
-        if code == 400:
-            self._status_code = 200
-
     @staticmethod
     def json(created_at=None, lifetime=10):
         if created_at is None:
@@ -218,19 +221,70 @@ class FakeLabelData:
         }
 
 
+class FakeUtilizationData:
+
+    @staticmethod
+    def json(created_at=None):
+        if created_at is None:
+            created_at = int(time.time())
+        return {
+            'data': {
+                'result': [
+                    {
+                        'metric': {'node': 'test_node_1'},
+                        'values': [
+                            [created_at, '50'],
+                            [created_at + 10, '100'],
+                        ]
+                    },
+                ],
+                'resultType': 'matrix'
+            },
+            'status': 'success'
+        }
+
+
+class FakeRequestRateData:
+
+    @staticmethod
+    def json(created_at=None):
+        if created_at is None:
+            created_at = int(time.time())
+        return {
+            'data': {
+                'result': [
+                    {
+                        'metric': {},
+                        'values': [
+                            [created_at, '2'],
+                            [created_at + 10, '2'],
+                            [created_at + 20, 'NaN'],
+                        ]
+                    },
+                ],
+                'resultType': 'matrix'
+            },
+            'status': 'success'
+        }
+
+
 class TestCostGetter(object):
 
-    def fake_requests_get(self, http_request, **_):
+    def fake_treq_get(self, http_request, **_):
         if 'kube_node_created' in http_request:
-            return FakeCreationData()
+            return defer.succeed(FakeResponse(FakeCreationData.json()))
         if 'kube_node_labels' in http_request:
-            return FakeLabelData()
+            return defer.succeed(FakeResponse(FakeLabelData.json()))
+        if 'container_accelerator_duty_cycle' in http_request:
+            return defer.succeed(FakeResponse(FakeUtilizationData.json()))
+        if 'tensorflow' in http_request:
+            return defer.succeed(FakeResponse(FakeRequestRateData.json()))
         raise ValueError('Your http_request does not contain '
                          'a recognized Grafana metric.')
 
     @pytest.fixture(autouse=True)
     def monkeypatch(self, monkeypatch):
-        monkeypatch.setattr(requests, 'get', self.fake_requests_get)
+        monkeypatch.setattr(treq, 'get', self.fake_treq_get)
 
     def test_init(self):
         # times are intentionally not being cast to ints
@@ -251,11 +305,170 @@ class TestCostGetter(object):
         new_time = cg.get_time()
         assert old_time <= new_time
 
-    def test_send_grafana_api_request(self):
+    @pytest_twisted.inlineCallbacks
+    def test_send_grafana_api_request(self, mocker):
         cg = cost.CostGetter()
-        response = cg.send_grafana_api_request('kube_node_created')
+        cg.sleep = lambda *_: defer.succeed(None)
+        response = yield cg.send_grafana_api_request('kube_node_created')
         assert isinstance(response, dict)
 
+        # too many data points, retry with a larger step
+        steps = []
+
+        def fake_get_too_many_points(url, **kwargs):
+            steps.append(url)
+            assert kwargs['auth'] == (cg.grafana_user, cg.grafana_password)
+            if len(steps) < 3:
+                error = {'error': 'exceeded maximum resolution of 11,000'}
+                return defer.succeed(FakeResponse(error, code=400))
+            return defer.succeed(FakeResponse({'data': 'ok'}))
+
+        mocker.patch('treq.get', fake_get_too_many_points)
+        response = yield cg.send_grafana_api_request('kube_node_created')
+        assert response == {'data': 'ok'}
+        assert len(steps) == 3
+        assert 'step=45' in steps[-1]
+
+        # timed out requests are retried, even while still connecting
+        failures = []
+        errors = [defer.CancelledError(),
+                  twisted_errors.ConnectingCancelledError(('grafana', 80))]
+
+        def fake_get_timeout(*_, **__):
+            if len(failures) < 2:
+                failures.append(1)
+                return defer.fail(errors[len(failures) - 1])
+            return defer.succeed(FakeResponse({'data': 'ok'}))
+
+        mocker.patch('treq.get', fake_get_timeout)
+        response = yield cg.send_grafana_api_request('kube_node_created')
+        assert response == {'data': 'ok'}
+        assert len(failures) == 2
+
+        # give up after max_retries
+        cg.max_retries = 1
+        failures = []
+        with pytest.raises(twisted_errors.ConnectingCancelledError):
+            yield cg.send_grafana_api_request('kube_node_created')
+
+    @pytest_twisted.inlineCallbacks
+    def test_query_cache(self, tmpdir, mocker):
+        end_time = int(time.time()) - cost.CLOSED_WINDOW_DELAY
+        cg = cost.CostGetter(benchmarking_start_time=end_time - 100,
+                             benchmarking_end_time=end_time,
+                             query_cache=str(tmpdir))
+        response = yield cg.send_grafana_api_request('kube_node_created')
+
+        # the window is closed, the response is served from the cache
+        mocker.patch('treq.get', lambda *_, **__: 1 / 0)
+        cached = yield cg.send_grafana_api_request('kube_node_created')
+        assert cached == response
+
+        # the cache is persisted
+        cg = cost.CostGetter(benchmarking_start_time=end_time - 100,
+                             benchmarking_end_time=end_time,
+                             query_cache=str(tmpdir))
+        cached = yield cg.send_grafana_api_request('kube_node_created')
+        assert cached == response
+
+        # responses of other Grafana hosts and datasources are not shared
+        cg.grafana_host = 'other.example.com'
+        with pytest.raises(ZeroDivisionError):
+            yield cg.send_grafana_api_request('kube_node_created')
+        cg.grafana_host = settings.GRAFANA_HOST
+        cg.grafana_datasource = 2
+        with pytest.raises(ZeroDivisionError):
+            yield cg.send_grafana_api_request('kube_node_created')
+        cg.grafana_datasource = 1
+
+        # open windows are not cached
+        cg.benchmarking_end_time = int(time.time())
+        with pytest.raises(ZeroDivisionError):
+            yield cg.send_grafana_api_request('kube_node_created')
+
+    def test_get_step(self):
+        start_time = int(time.time()) - 3600
+        cg = cost.CostGetter(benchmarking_start_time=start_time,
+                             benchmarking_end_time=start_time + 3600)
+        assert cg.get_step() == cg.min_step
+
+        # a week-long window needs a larger step
+        week = 7 * 24 * 60 * 60
+        step = cg.get_step(start_time - week, start_time)
+        assert step % cg.min_step == 0
+        assert week / step <= cost.MAX_RESOLUTION
+        assert week / (step - cg.min_step) > cost.MAX_RESOLUTION
+
+    def test_get_windows(self):
+        end_time = int(time.time())
+        cg = cost.CostGetter(benchmarking_start_time=end_time - 100,
+                             benchmarking_end_time=end_time)
+        assert cg.get_windows() == [(end_time - 100, end_time)]
+
+        window = cost.MAX_RESOLUTION * cg.min_step
+        start_time = end_time - 2 * window
+        cg = cost.CostGetter(benchmarking_start_time=start_time,
+                             benchmarking_end_time=end_time)
+        windows = cg.get_windows()
+        assert len(windows) == 2
+        assert windows[0] == (start_time, start_time + window)
+        assert windows[1][0] == windows[0][1] + cg.min_step
+        assert windows[-1][1] == end_time
+        for start, end in windows:
+            assert (end - start) / cg.min_step <= cost.MAX_RESOLUTION
+
+    @pytest_twisted.inlineCallbacks
+    def test_query_range(self, mocker):
+        window = cost.MAX_RESOLUTION * 15
+        end_time = int(time.time())
+        start_time = end_time - 3 * window
+        cg = cost.CostGetter(benchmarking_start_time=start_time,
+                             benchmarking_end_time=end_time,
+                             full_resolution=True)
+
+        requests = []
+
+        def fake_get(url, **_):
+            query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+            start, end = int(query['start'][0]), int(query['end'][0])
+            assert int(query['step'][0]) == cg.min_step
+            requests.append(start)
+            result = [{'metric': {'node': n}, 'values': [[start, n], [end, n]]}
+                      for n in ('a', 'b')]
+            return defer.succeed(FakeResponse({
+                'status': 'success',
+                'data': {'resultType': 'matrix', 'result': result},
+            }))
+
+        mocker.patch('treq.get', fake_get)
+        response = yield cg.query_range('kube_node_created')
+        assert len(requests) == 3
+        result = response['data']['result']
+        assert [r['metric']['node'] for r in result] == ['a', 'b']
+        for r in result:
+            timestamps = [v[0] for v in r['values']]
+            assert len(timestamps) == 6
+            assert timestamps == sorted(timestamps)
+            assert timestamps[0] == start_time
+            assert timestamps[-1] == end_time
+
+        # without full_resolution, a single request is sent
+        cg.full_resolution = False
+        requests = []
+        mocker.patch('treq.get', lambda *_, **__: requests.append(1) or
+                     defer.succeed(FakeResponse({'data': 'ok'})))
+        response = yield cg.query_range('kube_node_created')
+        assert response == {'data': 'ok'}
+        assert len(requests) == 1
+
+        # failed chunks raise an error
+        cg.full_resolution = True
+        mocker.patch('treq.get', lambda *_, **__: defer.succeed(
+            FakeResponse({'status': 'error', 'error': 'bad'}, code=422)))
+        with pytest.raises(ValueError):
+            yield cg.query_range('kube_node_created')
+
+    @pytest_twisted.inlineCallbacks
     def test_finish(self):
         start_time = time.time() - 100  # started 100s ago
         cg = cost.CostGetter(benchmarking_start_time=start_time)
@@ -263,7 +476,7 @@ class TestCostGetter(object):
         # benchmarking_end_time is not generated until finish() is called
         assert not cg.benchmarking_end_time
 
-        cpu_costs, gpu_costs, total_costs = cg.finish()
+        cpu_costs, gpu_costs, total_costs = yield cg.finish()
 
         # did benchmarking_end_time get auto-generated?
         assert cg.benchmarking_end_time
@@ -303,6 +516,113 @@ class TestCostGetter(object):
         for name in expected_node_names:
             assert node_info[name]['lifetime'] == lifetime - 10
 
+    @pytest_twisted.inlineCallbacks
+    def test_update(self, mocker):
+        start_time = int(time.time()) - 100
+        created_at = start_time + 10
+        cg = cost.CostGetter(benchmarking_start_time=start_time)
+
+        windows = []
+
+        def fake_get(url, **_):
+            query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+            windows.append((int(query['start'][0]), int(query['end'][0])))
+            if 'kube_node_created' in url:
+                data = FakeCreationData.json(created_at, lifetime=20)
+            else:
+                data = FakeLabelData.json(created_at, lifetime=20)
+            return defer.succeed(FakeResponse(data))
+
+        mocker.patch('treq.get', fake_get)
+        mocker.patch.object(cg, 'get_time', lambda: start_time + 60)
+        costs = yield cg.update()
+        assert windows[0] == (start_time, start_time + 60)
+        assert cg.last_update == start_time + 60
+
+        gpu_hourly = cost.COST_TABLE['n1-highmem-2']['preemptible'] + \
+            cost.GPU_TABLE['nvidia-tesla-v100']['preemptible']
+        cpu_hourly = cost.COST_TABLE['n1-highmem-2']['ondemand']
+        assert costs['gpu_node_cost'] == pytest.approx(gpu_hourly * 20 / 3600)
+        assert costs['cpu_node_cost'] == pytest.approx(cpu_hourly * 20 / 3600)
+        assert costs['cost_per_hour'] == pytest.approx(
+            costs['node_cost'] * 60)
+
+        # only the new window is queried, repeated points are not counted
+        windows = []
+        mocker.patch.object(cg, 'get_time', lambda: start_time + 90)
+        new_costs = yield cg.update()
+        assert windows[0] == (start_time + 60, start_time + 90)
+        assert new_costs['node_cost'] == costs['node_cost']
+
+    @pytest_twisted.inlineCallbacks
+    def test_get_utilization(self):
+        cg = cost.CostGetter(benchmarking_start_time=time.time() - 100)
+        with pytest.raises(ValueError):
+            yield cg.get_utilization()
+
+        yield cg.finish()
+        utilization = yield cg.get_utilization()
+        gpu_hours = cg.node_data['test_node_1']['lifetime'] / 3600
+        assert utilization['gpu_hours'] == pytest.approx(gpu_hours)
+        assert utilization['gpu_utilization'] == pytest.approx(0.75)
+        assert utilization['idle_gpu_hours'] == pytest.approx(gpu_hours / 4)
+        assert utilization['idle_gpu_cost'] == pytest.approx(
+            utilization['gpu_node_cost'] / 4)
+        assert utilization['utilized_gpu_cost'] == pytest.approx(
+            utilization['gpu_node_cost'] * 3 / 4)
+        assert utilization['images'] == 40
+        assert utilization['images_per_gpu_hour'] == pytest.approx(
+            40 / gpu_hours)
+
+    def test_parse_duty_cycle_response(self):
+        cg = cost.CostGetter()
+        response = {'data': {'result': [
+            {'metric': {'node': 'gpu1'}, 'values': [[0, '40'], [1, '60']]},
+            {'metric': {'node': 'gpu2'}, 'values': []},
+            # series without a node label cannot be matched to a node
+            {'metric': {'instance': '10.48.5.8:8080'},
+             'values': [[0, '100']]},
+        ]}}
+        assert cg.parse_duty_cycle_response(response) == {'gpu1': 0.5}
+
+    def test_compute_utilization(self):
+        cg = cost.CostGetter()
+        node_data = {
+            'gpu1': {'lifetime': 3600, 'instance_type': 'n1-highmem-2',
+                     'gpu': 'nvidia-tesla-v100', 'preemptible': False},
+            'gpu2': {'lifetime': 7200, 'instance_type': 'n1-highmem-2',
+                     'gpu': 'nvidia-tesla-v100', 'preemptible': False},
+            'cpu': {'lifetime': 3600, 'instance_type': 'n1-highmem-2',
+                    'gpu': None, 'preemptible': False},
+        }
+        # gpu2 has no utilization data, it is considered idle
+        utilization = cg.compute_utilization(node_data, {'gpu1': 0.5}, 300)
+        assert utilization['gpu_hours'] == 3
+        assert utilization['idle_gpu_hours'] == 2.5
+        assert utilization['gpu_utilization'] == pytest.approx(0.5 / 3)
+        assert utilization['images_per_gpu_hour'] == 100
+
+        # no GPU nodes
+        utilization = cg.compute_utilization({}, {}, 0)
+        assert utilization['gpu_hours'] == 0
+        assert utilization['images_per_gpu_hour'] == 0
+
+    def test_get_lifetime(self):
+        start_time = int(time.time()) - 100
+        cg = cost.CostGetter(benchmarking_start_time=start_time)
+
+        # one creation event, before the benchmark started
+        values = [[start_time + 10, str(start_time - 50)],
+                  [start_time + 40, str(start_time - 50)]]
+        assert cg.get_lifetime(values) == 40
+
+        # three creation events, the end of each event is counted
+        values = [[start_time, str(start_time)],
+                  [start_time + 10, str(start_time + 5)],
+                  [start_time + 20, str(start_time + 5)],
+                  [start_time + 30, str(start_time + 25)]]
+        assert cg.get_lifetime(values) == 15 + 5
+
     def test_parse_label_response(self):
         # test node exists after benchmarking
         start_time = int(time.time()) - 100  # a little while ago.
@@ -331,6 +651,9 @@ class TestCostGetter(object):
             assert node_info[name]['preemptible'] is pre
             assert node_info[name]['gpu'] == gpu
 
+        assert node_info['test_node_1']['node_pool'] == 'prediction-gpu'
+        assert node_info['test_node_2']['node_pool'] == 'logstash-cpu'
+
         # test node exists before benchmarking
         creation_data = FakeLabelData.json(
             created_at=start_time - 10,  # node started before benchmarking
@@ -364,6 +687,56 @@ class TestCostGetter(object):
         assert gpu_costs == 5.1968
         assert total_costs == 5.1968
 
+    def test_compute_node_pool_costs(self):
+        cg = cost.CostGetter()
+        node = {'lifetime': 1800, 'instance_type': 'n1-highmem-2',
+                'gpu': 'nvidia-tesla-v100', 'preemptible': False,
+                'node_pool': 'gpu'}
+        node_data = {'node1': dict(node), 'node2': dict(node),
+                     'node3': dict(node, gpu=None, node_pool='cpu')}
+        node_pools = cg.compute_node_pool_costs(node_data)
+        assert set(node_pools) == {'gpu', 'cpu'}
+        assert node_pools['gpu']['nodes'] == 2
+        assert node_pools['gpu']['node_hours'] == 1
+        assert node_pools['gpu']['cost'] == pytest.approx(2.5984)
+        assert node_pools['cpu']['cost'] == pytest.approx(0.0592)
+
+    def test_recompute_costs(self, tmpdir):
+        node = {'lifetime': 3600, 'instance_type': 'n1-highmem-2',
+                'gpu': 'nvidia-tesla-v100', 'preemptible': False,
+                'node_pool': 'gpu'}
+        summary = {
+            'node_data': {'node1': node},
+            'job_data': [{'status': 'done'}, {'status': 'failed'}],
+        }
+        path = os.path.join(str(tmpdir), 'pricing.json')
+        with open(path, 'w') as f:
+            json.dump({'default_region': 'r', 'regions': {'r': {
+                'machines': {'n1-highmem-2': {'ondemand': 1}},
+                'gpus': {'nvidia-tesla-v100': {'ondemand': 3}},
+                'networking_costs': 1,
+            }}}, f)
+
+        costs = cost.recompute_costs(summary, pricing.Pricing(path))
+        assert costs['gpu_node_cost'] == 4
+        assert costs['total_node_and_networking_costs'] == 5
+        assert costs['node_pools']['gpu']['cost'] == 4
+        assert costs['jobs_per_dollar'] == 1 / 5
+        assert costs['unpriced_nodes'] == {}
+
+        # nodes without a price are reported, not raised
+        summary['node_data']['node2'] = dict(node, instance_type='unknown')
+        summary['node_data']['node3'] = dict(node, preemptible=True)
+        costs = cost.recompute_costs(summary, pricing.Pricing(path),
+                                     num_done=3)
+        assert costs['gpu_node_cost'] == 4
+        assert sorted(costs['unpriced_nodes']) == ['node2', 'node3']
+        assert costs['unpriced_nodes']['node2']['instance_type'] == 'unknown'
+        assert costs['jobs_per_dollar'] is None  # the total is unknown
+
+        with pytest.raises(ValueError):
+            cost.recompute_costs({}, pricing.Pricing(path))
+
     def test_compute_hourly_cost(self):
         cg = cost.CostGetter()
         node_dict = {
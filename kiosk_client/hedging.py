@@ -0,0 +1,104 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Find straggling jobs from the live distribution of status durations"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+
+import numpy as np
+
+
+class StragglerDetector(object):
+    """Find jobs that have been in their status much longer than others.
+
+    The seconds each finished job spent in each status are recorded, and a
+    job is a straggler once it has been in its status for longer than the
+    given percentile of the recent durations of that status.
+
+    Args:
+        percentile (float): percentile of the durations of each status
+            after which a job is a straggler.
+        min_samples (int): number of durations of a status needed before
+            any job in that status is a straggler.
+        max_samples (int): number of recent durations kept for each status.
+    """
+
+    def __init__(self, percentile=95, min_samples=20, max_samples=1000):
+        if not 0 < percentile < 100:
+            raise ValueError('percentile must be between 0 and 100.')
+        self.percentile = float(percentile)
+        self.min_samples = int(min_samples)
+        self.durations = collections.defaultdict(
+            lambda: collections.deque(maxlen=int(max_samples)))
+        self._thresholds = {}  # cleared when a duration is added
+
+    def add(self, status, seconds):
+        """Record the seconds a job spent in the status."""
+        self.durations[status].append(seconds)
+        self._thresholds.pop(status, None)
+
+    def threshold(self, status):
+        """Get the seconds after which a job in the status is a straggler.
+
+        Returns:
+            float: The threshold, or None if there are too few durations.
+        """
+        if status not in self._thresholds:
+            durations = self.durations.get(status, ())
+            threshold = None
+            if len(durations) >= max(self.min_samples, 1):
+                threshold = float(np.percentile(durations, self.percentile))
+            self._thresholds[status] = threshold
+        return self._thresholds[status]
+
+    def is_straggler(self, status, seconds):
+        """Whether a job that has been in the status for this long is a
+        straggler."""
+        threshold = self.threshold(status)
+        return threshold is not None and seconds > threshold
+
+    def expected_remaining(self, status, seconds):
+        """Estimate how much longer a job that has been in the status for
+        this long will stay in it, from the jobs that stayed longer.
+
+        Returns:
+            float: The mean remaining seconds, or None if no job has
+                stayed in the status for this long.
+        """
+        durations = np.asarray(self.durations.get(status, ()))
+        longer = durations[durations > seconds]
+        if not longer.size:
+            return None
+        return float(np.mean(longer - seconds))
+
+    def json(self):
+        statuses = sorted(self.durations, key=str)
+        return {
+            'percentile': self.percentile,
+            'thresholds': {str(s): self.threshold(s) for s in statuses},
+        }
@@ -0,0 +1,78 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for finding straggling jobs"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import pytest
+
+from kiosk_client import hedging
+
+
+class TestStragglerDetector(object):
+
+    def test_threshold(self):
+        detector = hedging.StragglerDetector(percentile=90, min_samples=10)
+        for i in range(9):
+            detector.add('predict', i + 1)
+        assert detector.threshold('predict') is None  # too few durations
+        assert detector.threshold('new') is None
+        assert not detector.is_straggler('predict', 100)
+
+        detector.add('predict', 10)
+        assert detector.threshold('predict') == pytest.approx(9.1)
+        assert detector.is_straggler('predict', 10)
+        assert not detector.is_straggler('predict', 9)
+        assert not detector.is_straggler('new', 100)
+
+        # new durations change the threshold
+        for _ in range(10):
+            detector.add('predict', 1)
+        assert detector.threshold('predict') == pytest.approx(8.1)
+
+        assert detector.json() == {
+            'percentile': 90,
+            'thresholds': {'predict': detector.threshold('predict')},
+        }
+
+        with pytest.raises(ValueError):
+            hedging.StragglerDetector(percentile=100)
+
+    def test_max_samples(self):
+        detector = hedging.StragglerDetector(min_samples=1, max_samples=3)
+        for seconds in (100, 1, 1, 1):
+            detector.add('new', seconds)
+        assert list(detector.durations['new']) == [1, 1, 1]
+        assert detector.threshold('new') == 1
+
+    def test_expected_remaining(self):
+        detector = hedging.StragglerDetector()
+        for seconds in (1, 2, 10, 20):
+            detector.add('predict', seconds)
+        assert detector.expected_remaining('predict', 5) == 10
+        assert detector.expected_remaining('predict', 20) is None
+        assert detector.expected_remaining('new', 0) is None
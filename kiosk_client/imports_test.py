@@ -0,0 +1,95 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests that importing the package is fast and has no side effects"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# slow to import, and only required by some runs
+HEAVY_MODULES = ('google.cloud.storage', 'PIL', 'numpy', 'twisted', 'treq')
+
+
+def _imported_modules(statement, env=None):
+    """Run the import statement in a new interpreter.
+
+    Returns:
+        set: The heavy modules that were imported.
+    """
+    code = '\n'.join([
+        'import json, sys',
+        statement,
+        'heavy = {!r}'.format(HEAVY_MODULES),
+        'print(json.dumps([m for m in heavy if m in sys.modules]))',
+    ])
+    env = dict(os.environ, **(env or {}))
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT_DIR] + [p for p in [env.get('PYTHONPATH')] if p])
+    output = subprocess.check_output([sys.executable, '-c', code], env=env)
+    return set(json.loads(output.decode().strip().splitlines()[-1]))
+
+
+class TestImports(object):
+
+    @pytest.mark.parametrize('statement', [
+        'import kiosk_client',
+        'import kiosk_client.settings',
+        'import kiosk_client.__main__',
+    ])
+    def test_no_heavy_imports(self, statement):
+        assert not _imported_modules(statement)
+
+    def test_manager_imports(self):
+        # only imported when uploading to the bucket
+        modules = _imported_modules('import kiosk_client.manager')
+        assert 'google.cloud.storage' not in modules
+        assert 'twisted' in modules
+        # only imported once a manager is created, or files are tiled
+        assert 'numpy' not in modules
+        assert 'PIL' not in modules
+
+        # submodules are still available as attributes of the package
+        modules = _imported_modules('import kiosk_client; kiosk_client.job')
+        assert 'treq' in modules
+
+    def test_settings_has_no_side_effects(self, tmpdir):
+        log_dir = os.path.join(str(tmpdir), 'logs')
+        output_dir = os.path.join(str(tmpdir), 'output')
+        _imported_modules('import kiosk_client.settings', env={
+            'LOG_DIR': log_dir,
+            'OUTPUT_DIR': output_dir,
+        })
+        assert not os.path.exists(log_dir)
+        assert not os.path.exists(output_dir)
@@ -38,23 +38,139 @@ from twisted.internet import defer
 from twisted.internet import error as twisted_errors
 from twisted.web import _newclient as twisted_client
 
+from kiosk_client import logs
+from kiosk_client.multipart import MultipartFileProducer
 from kiosk_client.utils import sleep, strip_bucket_prefix, get_download_path
 
 
-class Job(object):
+# numerical summary data, which may be comma-separated for child jobs
+TIMING_ATTRIBUTES = (
+    'prediction_time',
+    'predict_retries',
+    'postprocess_time',
+    'upload_time',
+    'download_time',
+    'children_upload_time',
+    'cleanup_time',
+    'total_jobs',
+    'total_time',
+)
 
-    def __init__(self, host, filepath, model_name, model_version, **kwargs):
-        """Creates and tracks a DeepCell Kiosk job, recording various summary data.
+# status of jobs that are past their deadline, set by the client
+TIMEOUT_STATUS = 'timeout'
+
+
+class _SplitValue(object):
+    """Stores the raw string of a comma-separated summary value, which is
+    only split into a list when it is read."""
+
+    def __init__(self, name):
+        self.name = name
+        self.slot = '_' + name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        value = getattr(obj, self.slot)
+        if isinstance(value, str) and ',' in value:
+            return value.split(',')
+        return value
 
-        Args:
-            host (str): public IP address of the DeepCell Kiosk cluster.
-            filepath (str): The filepath of the file to be processed.
-            model_name (str): Name of servable model.
-            model_version (int): Version of servable model.
-            kwargs (dict): Optional keyword arguments.
-        """
-        self.logger = logging.getLogger(str(self.__class__.__name__))
+    def __set__(self, obj, value):
+        setattr(obj, self.slot, value)
 
+
+class Job(object):
+    """Creates and tracks a DeepCell Kiosk job, recording various summary data.
+
+    Runs may keep millions of jobs in memory, so attributes are stored in
+    slots and constants are shared by all jobs.
+
+    Args:
+        host (str): public IP address of the DeepCell Kiosk cluster.
+        filepath (str): The filepath of the file to be processed.
+        model_name (str): Name of servable model.
+        model_version (int): Version of servable model.
+        kwargs (dict): Optional keyword arguments.
+    """
+
+    __slots__ = (
+        'host',
+        'filepath',
+        'model_name',
+        'model_version',
+        'job_type',
+        'data_scale',
+        'data_label',
+        'preprocess',
+        'postprocess',
+        'upload_prefix',
+        'expire_time',
+        'update_interval',
+        'original_name',
+        'download_results',
+        'chunked_upload',
+        'upload_chunk_size',
+        'output_dir',
+        'failed',
+        'is_expired',
+        'cache_hit',
+        'bundle_members',
+        'shard_of',
+        'tile_of',
+        'tile_box',
+        'hedge_of',
+        'cancelled',
+        'status',
+        'job_id',
+        'created_at',
+        'finished_at',
+        'output_url',
+        'output_file',
+        'reason',
+        'client_upload_time',
+        'client_upload_rate',
+        'started_at',
+        'status_changed_at',
+        'timeout',
+        'deadline',
+        'pool',
+        'on_response',
+        'on_status_change',
+        '__dict__',  # only created if a method is monkey-patched
+    ) + tuple('_' + name for name in TIMING_ATTRIBUTES)
+
+    logger = logging.getLogger('Job')
+
+    headers = {
+        'Content-Type': ['application/json'],
+        'Connection': 'close',
+    }
+
+    sleep = staticmethod(sleep)  # allow monkey-patch
+
+    _finished_statuses = frozenset({'done', 'failed'})
+
+    _http_errors = (
+        twisted_client.ResponseNeverReceived,
+        twisted_client.RequestTransmissionFailed,
+        twisted_errors.ConnectBindError,
+        twisted_errors.TimeoutError,
+        twisted_errors.ConnectError,
+        twisted_errors.ConnectionRefusedError,
+    )
+
+    prediction_time = _SplitValue('prediction_time')
+    predict_retries = _SplitValue('predict_retries')
+    postprocess_time = _SplitValue('postprocess_time')
+    upload_time = _SplitValue('upload_time')
+    download_time = _SplitValue('download_time')
+    children_upload_time = _SplitValue('children_upload_time')
+    cleanup_time = _SplitValue('cleanup_time')
+    total_jobs = _SplitValue('total_jobs')
+    total_time = _SplitValue('total_time')
+
+    def __init__(self, host, filepath, model_name, model_version, **kwargs):
         self.host = str(host)
         self.filepath = str(filepath)
         self.model_name = str(model_name)
@@ -89,8 +205,10 @@ class Job(object):
         self.update_interval = int(kwargs.get('update_interval', 10))
         self.original_name = kwargs.get('original_name', self.filepath)
         self.download_results = kwargs.get('download_results', False)
+        self.chunked_upload = kwargs.get('chunked_upload', False)
+        self.upload_chunk_size = int(kwargs.get('upload_chunk_size', 2 ** 16))
 
-        self.output_dir = kwargs.get('output_dir', get_download_path())
+        self.output_dir = kwargs.get('output_dir') or get_download_path()
         if not os.path.isdir(self.output_dir):
             raise ValueError('Invalid value for output_dir,'
                              ' %s is not a directory.' % self.output_dir)
@@ -100,47 +218,58 @@ class Job(object):
 
         self.failed = False  # for error handling
         self.is_expired = False
-
-        self.headers = {
-            'Content-Type': ['application/json'],
-            'Connection': 'close',
-        }
+        self.cache_hit = False  # results were found in the result cache
+
+        # names of files bundled into this job's archive mapped to their paths
+        self.bundle_members = kwargs.get('bundle_members')
+        # the original archive if this job is one shard of a larger archive
+        self.shard_of = kwargs.get('shard_of')
+        # the original image and the box of this tile if this job is a tile
+        self.tile_of = kwargs.get('tile_of')
+        self.tile_box = kwargs.get('tile_box')
+        # the job ID of the straggler this job duplicates
+        self.hedge_of = kwargs.get('hedge_of')
+        self.cancelled = False  # a duplicate finished first
 
         # summary data
         self.status = None
         self.job_id = None
         self.created_at = None
         self.finished_at = None
-        self.postprocess_time = None
-        self.prediction_time = None
-        self.download_time = None
-        self.upload_time = None
         self.output_url = None
-        self.total_jobs = None
-        self.total_time = None
+        self.output_file = None
         self.reason = None
-        self.children_upload_time = None
-        self.cleanup_time = None
-        self.predict_retries = None
-        self._finished_statuses = {'done', 'failed'}
-
-        self.pool = kwargs.get('pool')
+        for name in TIMING_ATTRIBUTES:
+            setattr(self, name, None)
+        self.client_upload_time = None  # seconds to send the input file
+        self.client_upload_rate = None  # bytes/s of the input file upload
+        self.started_at = None  # when start() was first called
+        self.status_changed_at = None
 
-        self.sleep = sleep  # allow monkey-patch
+        # seconds the job may run before it is timed out, disabled if 0
+        self.timeout = float(kwargs.get('timeout', 0))
+        self.deadline = None  # set when started, may be shortened later
 
-        self._http_errors = (
-            twisted_client.ResponseNeverReceived,
-            twisted_client.RequestTransmissionFailed,
-            twisted_errors.ConnectBindError,
-            twisted_errors.TimeoutError,
-            twisted_errors.ConnectError,
-            twisted_errors.ConnectionRefusedError,
-        )
+        self.pool = kwargs.get('pool')
+        # called with the latency of each API response, in seconds
+        self.on_response = kwargs.get('on_response')
+        # called with the job, its previous status and the seconds spent
+        # in it (or None if unknown) each time the status changes
+        self.on_status_change = kwargs.get('on_status_change')
 
     @property
     def is_done(self):
         return self.status in self._finished_statuses
 
+    @property
+    def timed_out(self):
+        return self.status == TIMEOUT_STATUS
+
+    @property
+    def is_past_deadline(self):
+        return (self.deadline is not None and
+                timeit.default_timer() >= self.deadline)
+
     @property
     def is_summarized(self):
         if self.status == 'failed':
@@ -161,6 +290,7 @@ class Job(object):
 
         return {
             'input_file': self.original_name,
+            'host': self.host,
             'status': self.status,
             'total_time': _float(self.total_time),
             'total_jobs': _float(self.total_jobs),
@@ -179,15 +309,30 @@ class Job(object):
             'preprocess': self.preprocess,
             'reason': self.reason,
             'job_id': self.job_id,
+            'client_upload_time': self.client_upload_time,
+            'client_upload_rate': self.client_upload_rate,
+            'cache_hit': self.cache_hit,
+            'bundled_files': (sorted(self.bundle_members.values())
+                              if self.bundle_members else None),
+            'shard_of': self.shard_of,
+            'tile_of': self.tile_of,
+            'tile_box': self.tile_box,
+            'hedge_of': self.hedge_of,
+            'cancelled': self.cancelled,
         }
 
-    def _log_http_response(self, response, created_at):
-        log = self.logger.debug if response.code == 200 else self.logger.warning
-        log('%s %s - %s %s - took %ss',
-            response.request.method.decode(),
-            response.request.absoluteURI.decode(),
-            response.code, response.phrase.decode(),
-            timeit.default_timer() - created_at)
+    def _log_http_response(self, response, created_at, category='request'):
+        level = logging.DEBUG if response.code == 200 else logging.WARNING
+        if not self.logger.isEnabledFor(level):
+            return  # skip decoding the response of every request
+        if not logs.sample(category, level):
+            return  # sampled out, skip creating the record
+        self.logger.log(level, '%s %s - %s %s - took %ss',
+                        response.request.method.decode(),
+                        response.request.absoluteURI.decode(),
+                        response.code, response.phrase.decode(),
+                        timeit.default_timer() - created_at,
+                        extra={'category': category, 'sampled': True})
 
     def _make_post_request(self, host, **kwargs):
         req_kwargs = {
@@ -203,8 +348,17 @@ class Job(object):
 
         return treq.post(host, **req_kwargs)
 
+    def _check_deadline(self, err):
+        """Time out the job rather than retry a failed request once the job
+        is past its deadline."""
+        if self.started_at is not None and self.is_past_deadline:
+            if not self.timed_out:
+                self.time_out()
+            raise err
+
     @defer.inlineCallbacks
-    def _retry_post_request_wrapper(self, host, name='REDIS', **kwargs):
+    def _retry_post_request_wrapper(self, host, name='REDIS',
+                                    log_category='request', **kwargs):
         retrying = True  # retry loop to prevent stackoverflow
         while retrying:
             created_at = timeit.default_timer()
@@ -214,16 +368,21 @@ class Job(object):
             except self._http_errors as err:
                 self.logger.warning('[%s]: Encountered %s during %s: %s',
                                     self.job_id, type(err).__name__, name, err)
+                self._check_deadline(err)
                 yield self.sleep(self.update_interval)
                 continue  # return to top of retry loop
 
+            if self.on_response is not None:
+                self.on_response(timeit.default_timer() - created_at)
+
             try:
-                self._log_http_response(response, created_at)
+                self._log_http_response(response, created_at, log_category)
                 json_content = yield response.json()  # parse the JSON data
             except (ValueError, AttributeError) as err:
                 self.logger.error('[%s]: Failed to parse %s response as JSON '
                                   'due to %s: %s', self.job_id, name,
                                   type(err).__name__, err)
+                self._check_deadline(err)
                 yield self.sleep(self.update_interval)
                 continue  # return to top of retry loop
 
@@ -235,10 +394,22 @@ class Job(object):
     def upload_file(self):
         host = '{}/api/upload'.format(self.host)
         name = 'UPLOAD {}'.format(self.filepath)
-        with open(self.filepath, 'rb') as f:
-            payload = {'file': (self.filepath, f)}
-            response = yield self._retry_post_request_wrapper(
-                host, name, files=payload, headers=self.headers)
+        producer = MultipartFileProducer(
+            self.filepath,
+            chunk_size=self.upload_chunk_size,
+            chunked=self.chunked_upload)
+        headers = {
+            'Content-Type': [producer.content_type],
+            'Connection': 'close',
+        }
+        response = yield self._retry_post_request_wrapper(
+            host, name, data=producer, headers=headers)
+
+        self.client_upload_time = producer.elapsed
+        self.client_upload_rate = producer.rate
+        self.logger.info('Uploaded %s bytes of %s in %ss (%.0f bytes/s).',
+                         producer.bytes_sent, self.filepath,
+                         producer.elapsed, producer.rate)
         uploaded_path = response.get('uploadedName')
         defer.returnValue(uploaded_path)  # "return" the value
 
@@ -247,8 +418,10 @@ class Job(object):
         host = '{}/api/redis'.format(self.host)
         payload = {'hash': self.job_id, 'key': field}
         name = 'REDIS HGET {}'.format(field)
-        response = yield self._retry_post_request_wrapper(host, name,
-                                                          json=payload)
+        # status is polled every update_interval by each job
+        log_category = 'status' if field == 'status' else 'request'
+        response = yield self._retry_post_request_wrapper(
+            host, name, log_category=log_category, json=payload)
         value = response.get('value')
         defer.returnValue(value)  # "return" the value
 
@@ -283,18 +456,60 @@ class Job(object):
 
     @defer.inlineCallbacks
     def monitor(self):
-        while not self.is_done:
+        while not self.is_done and not self.cancelled and not self.timed_out:
 
             yield self.sleep(self.update_interval)  # prevent 429s
 
+            if self.cancelled:
+                break
+
+            if self.is_past_deadline:
+                self.time_out()
+                break
+
             status = yield self.get_redis_value('status')
 
             if self.status != status:
-                self.status = status
-                self.logger.info('[%s]: Found new %sstatus `%s`.', self.job_id,
-                                 'final ' if self.is_done else '', self.status)
-
-        defer.returnValue(self.is_done)  # "return" the value
+                self._set_status(status)
+
+        # "return" the value
+        defer.returnValue(self.is_done or self.cancelled or self.timed_out)
+
+    def _set_status(self, status):
+        now = timeit.default_timer()
+        previous, changed_at = self.status, self.status_changed_at
+        self.status = status
+        self.status_changed_at = now
+        self.logger.info('[%s]: Found new %sstatus `%s`.', self.job_id,
+                         'final ' if self.is_done else '', self.status)
+
+        if self.on_status_change is not None:
+            seconds = now - changed_at if changed_at is not None else None
+            self.on_status_change(self, previous, seconds)
+
+    def cancel(self):
+        """Stop monitoring the job and expire it, as a duplicate of the job
+        finished first."""
+        if not self.cancelled:
+            self.logger.info('[%s]: Cancelled with status `%s`.',
+                             self.job_id, self.status)
+        self.cancelled = True
+
+    def time_out(self):
+        """Stop monitoring the job and expire it, as it is past its
+        deadline."""
+        elapsed = timeit.default_timer() - self.started_at
+        self.reason = 'Timed out after {:.1f}s with status `{}`.'.format(
+            elapsed, self.status)
+        self.logger.warning('[%s]: %s', self.job_id, self.reason)
+        self._set_status(TIMEOUT_STATUS)
+
+    def _abandon(self, err):
+        """Finish the timed out job without restarting it, although its key
+        may not be expired."""
+        self.logger.error('[%s]: Abandoned past its deadline due to %s: %s',
+                          self.job_id, type(err).__name__, err)
+        self.is_expired = True
 
     @defer.inlineCallbacks
     def summarize(self):
@@ -304,29 +519,15 @@ class Job(object):
             'reason',
             'output_url',
         )
-        attributes = (
-            'prediction_time',
-            'predict_retries',
-            'postprocess_time',
-            'upload_time',
-            'download_time',
-            'children_upload_time',
-            'cleanup_time',
-            'total_jobs',
-            'total_time',
-        )
         # get the string values
         for name in summary_attributes:
             value = yield self.get_redis_value(name)
             setattr(self, name, value)  # save the valid value to self
 
-        # get the numerical values and parse into list if required
-        for name in attributes:
+        # get the numerical values, split into a list when they are read
+        for name in TIMING_ATTRIBUTES:
             value = yield self.get_redis_value(name)
-            value = str(value).split(',')
-            if len(value) == 1:
-                value = value[0]
-            setattr(self, name, value)  # save the valid value to self
+            setattr(self, name, str(value))  # save the valid value to self
 
         defer.returnValue(self.is_summarized)  # "return" the value
 
@@ -356,6 +557,7 @@ class Job(object):
             except self._http_errors as err:
                 self.logger.warning('[%s]: Encountered %s during %s: %s',
                                     self.job_id, type(err).__name__, name, err)
+                self._check_deadline(err)
                 yield self.sleep(self.update_interval)
                 continue  # return to top of retry loop
             retrying = False  # success
@@ -366,6 +568,7 @@ class Job(object):
         self.logger.info('Saved output file: "%s" in %s s.',
                          dest, timeit.default_timer() - start)
 
+        self.output_file = dest
         defer.returnValue(dest)
 
     @defer.inlineCallbacks
@@ -383,11 +586,8 @@ class Job(object):
         if self.job_id is None:  # never got started in the first place
             result = yield self.start()
 
-        elif self.is_done:  # no need to monitor, skip straight to summarize
-            result = yield self.summarize()
-
-        else:  # job has begun but was not finished, monitor status
-            result = yield self.monitor()
+        else:  # job has begun, monitor it unless done and finish it
+            result = yield self.complete()
 
         defer.returnValue(result)
 
@@ -397,6 +597,13 @@ class Job(object):
         if delay:  # delay the start if required
             yield self.sleep(delay)
 
+        if self.started_at is None:
+            self.started_at = timeit.default_timer()
+            if self.timeout > 0:
+                deadline = self.started_at + self.timeout
+                if self.deadline is None or deadline < self.deadline:
+                    self.deadline = deadline
+
         if upload:
             uploaded_path = yield self.upload_file()
 
@@ -412,10 +619,32 @@ class Job(object):
         try:
             self.job_id = yield self.create()
             assert self.job_id is not None, 'Create did not return a job ID'
+            self.status_changed_at = timeit.default_timer()
+        except Exception as err:
+            if self.timed_out:
+                self._abandon(err)
+                defer.returnValue(False)
+            self.failed = True
+            self.logger.error('[%s]: Encountered unexpected error in '
+                              'job.start(): %s', self.job_id, err)
+            defer.returnValue(False)
 
+        value = yield self.complete()
+        defer.returnValue(value)
+
+    @defer.inlineCallbacks
+    def complete(self):
+        """Monitor the created job until it is finished, then summarize it,
+        download its results and expire its key."""
+        try:
             success = yield self.monitor()
             assert success, 'Monitor did not have a successful return vaue'
 
+            if self.cancelled or self.timed_out:  # only expire the key
+                value = yield self.expire()
+                self.is_expired = True
+                defer.returnValue(value)
+
             success = yield self.summarize()
             assert success, 'Summarize did not have a successful return vaue'
 
@@ -431,7 +660,7 @@ class Job(object):
                                  self.job_id, diff.total_seconds(),
                                  self.status, self.output_url)
 
-                if self.download_results:
+                if self.download_results and self.output_file is None:
                     success = yield self.download_output()
 
             elif self.status == 'failed':
@@ -452,7 +681,10 @@ class Job(object):
             defer.returnValue(value)
 
         except Exception as err:
+            if self.timed_out:
+                self._abandon(err)
+                defer.returnValue(False)
             self.failed = True
             self.logger.error('[%s]: Encountered unexpected error in '
-                              'job.start(): %s', self.job_id, err)
+                              'job.complete(): %s', self.job_id, err)
             defer.returnValue(False)
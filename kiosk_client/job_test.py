@@ -39,6 +39,7 @@ import pytest_twisted
 from twisted.internet import defer
 
 from kiosk_client import job
+from kiosk_client import logs
 
 global FAILED
 FAILED = False  # global toggle for failed responses
@@ -146,7 +147,7 @@ class TestJob(object):
                     model_name='model',
                     model_version='1')
 
-    def test__log_http_response(self):
+    def test__log_http_response(self, mocker):
         now = timeit.default_timer()
         j = _get_default_job()
 
@@ -155,6 +156,17 @@ class TestJob(object):
         dummy_response.failed = True
         j._log_http_response(dummy_response, now)
 
+        # sampled out records are never created
+        mocker.patch.object(logs, '_sampler', logs.SamplingFilter(
+            {'request': 0.5}))
+        mocker.patch.object(j.logger, 'isEnabledFor', return_value=True)
+        spy = mocker.spy(j.logger, 'log')
+        mocker.patch.object(DummyResponse, 'code', 200)
+        for _ in range(4):
+            j._log_http_response(dummy_response, now)
+        assert spy.call_count == 2
+        assert spy.call_args[1]['extra']['sampled']
+
     def test__make_post_request(self):
         j = _get_default_job()
         req = j._make_post_request('localhost', data={})
@@ -180,6 +192,20 @@ class TestJob(object):
         uploaded_path = yield j.upload_file()
         assert uploaded_path == 'uploads/blah.png'
 
+        # the file is streamed by a body producer
+        @pytest_twisted.inlineCallbacks
+        def dummy_request_producer(*_, **kwargs):
+            producer = kwargs['data']
+            content_type = kwargs['headers']['Content-Type'][0]
+            assert content_type == producer.content_type
+            assert producer.length > producer.file_size
+            yield defer.returnValue({'uploadedName': 'uploads/blah.png'})
+
+        j._retry_post_request_wrapper = dummy_request_producer
+        uploaded_path = yield j.upload_file()
+        assert uploaded_path == 'uploads/blah.png'
+        assert j.client_upload_time is not None
+
         filepath = 'test2.png'
         p = tmpdir.join(filepath)
         p.write('content')
@@ -230,6 +256,21 @@ class TestJob(object):
         value = yield j.summarize()
         assert value
 
+        # timing values are split when they are read
+        values = {'prediction_time': '1.5,2.5', 'total_time': '4'}
+        j.get_redis_value = lambda x: values.get(x)
+        yield j.summarize()
+        assert j.prediction_time == ['1.5', '2.5']
+        assert j.total_time == '4'
+        assert j.upload_time == 'None'
+        assert j.json()['prediction_time'] == [1.5, 2.5]
+        assert j.json()['total_time'] == 4.0
+
+    def test_slots(self):
+        j = _get_default_job()
+        assert not j.__dict__  # attributes are stored in slots
+        assert j.headers is job.Job.headers
+
     @pytest_twisted.inlineCallbacks
     def test_monitor(self):
         j = _get_default_job()
@@ -252,6 +293,139 @@ class TestJob(object):
         assert results
         assert results == j.is_done
 
+    @pytest_twisted.inlineCallbacks
+    def test_monitor_status_changes(self):
+        changes = []
+        j = job.Job(filepath='filepath.png', host='localhost',
+                    model_name='model_name', model_version='0',
+                    update_interval=0.0001,
+                    on_status_change=lambda *args: changes.append(args))
+        statuses = iter(['new', 'new', 'predict', 'done'])
+        j.get_redis_value = lambda _: defer.succeed(next(statuses))
+        j.status_changed_at = 0
+
+        result = yield j.monitor()
+        assert result
+        assert [c[:2] for c in changes] == [
+            (j, None), (j, 'new'), (j, 'predict')]
+        assert all(c[2] >= 0 for c in changes)
+
+        # a cancelled job stops monitoring
+        j = _get_default_job()
+        j.status = 'predict'
+
+        def get_redis_value(_):
+            j.cancel()
+            return defer.succeed('predict')
+
+        j.get_redis_value = get_redis_value
+        result = yield j.monitor()
+        assert result
+        assert j.cancelled
+        assert not j.is_done
+
+    @pytest_twisted.inlineCallbacks
+    def test_start_cancelled(self):
+        j = _get_default_job()
+        j.create = lambda: defer.succeed('job-id')
+        j.summarize = lambda: defer.fail(AssertionError('not summarized'))
+
+        def monitor():
+            j.cancel()
+            return defer.succeed(True)
+
+        j.monitor = monitor
+        j.expire = lambda: defer.succeed(1)
+        value = yield j.start()
+        assert value == 1
+        assert j.is_expired
+        assert not j.failed
+        assert j.started_at is not None
+        assert j.json()['cancelled']
+
+    @pytest_twisted.inlineCallbacks
+    def test_start_timed_out(self):
+        changes = []
+        j = job.Job(filepath='filepath.png', host='localhost',
+                    model_name='model_name', model_version='0',
+                    update_interval=0.0001, timeout=0.01,
+                    on_status_change=lambda *args: changes.append(args))
+        j.create = lambda: defer.succeed('job-id')
+        j.summarize = lambda: defer.fail(AssertionError('not summarized'))
+        j.get_redis_value = lambda _: defer.succeed('predict')
+        j.expire = lambda: defer.succeed(1)
+
+        value = yield j.start()
+        assert value == 1
+        assert j.is_expired
+        assert not j.failed
+        assert j.timed_out
+        assert j.status == job.TIMEOUT_STATUS
+        assert j.deadline == j.started_at + 0.01
+        assert j.reason.startswith('Timed out after')
+        assert changes[-1][:2] == (j, 'predict')
+
+        # the deadline may be shortened before the job starts
+        j = _get_default_job()
+        j.timeout = 3600
+        j.deadline = 0
+        j.status = 'predict'
+        j.get_redis_value = lambda _: defer.fail(AssertionError('polled'))
+        j.started_at = None
+        j.create = lambda: defer.succeed('job-id')
+        j.expire = lambda: defer.succeed(1)
+        value = yield j.start()
+        assert value == 1
+        assert j.deadline == 0
+        assert j.timed_out
+
+        # restarting a timed out job only expires its key
+        j.is_expired = False
+        j.failed = True
+        value = yield j.restart()
+        assert value == 1
+        assert j.is_expired
+
+    @pytest_twisted.inlineCallbacks
+    def test_retry_timed_out(self, mocker):
+        def dummy_post(*_, **__):
+            errs = _get_default_job()._http_errors
+            return defer.fail(errs[random.randint(0, len(errs) - 1)]('down'))
+
+        mocker.patch('treq.post', dummy_post)
+
+        # a job that cannot be created is not retried past its deadline
+        j = _get_default_job()
+        j.timeout = 0.01
+        value = yield j.start()
+        assert value is False
+        assert j.timed_out
+        assert j.is_expired  # finished, but not restarted
+        assert not j.failed
+
+        # nor is a job that cannot be polled or expired
+        j = _get_default_job()
+        j.timeout = 0.01
+        j.create = lambda: defer.succeed('job-id')
+        value = yield j.start()
+        assert value is False
+        assert j.timed_out
+        assert j.is_expired
+        assert not j.failed
+
+        # failed requests are retried until the deadline
+        j = _get_default_job()
+        j.started_at = timeit.default_timer()
+        j.deadline = j.started_at + 3600
+        responses = [defer.fail(j._http_errors[0]('down'))]
+        j._make_post_request = lambda *_, **__: (
+            responses.pop() if responses else defer.succeed(
+                Bunch(code=200, json=lambda: defer.succeed({'value': 1}))))
+        j._log_http_response = lambda *_: None
+        value = yield j.expire()
+        assert value == 1
+        assert not j.timed_out
+
     @pytest_twisted.inlineCallbacks
     def test_restart(self):
 
@@ -265,21 +439,43 @@ class TestJob(object):
         result = yield j.restart(0.00001)
         assert result
 
-        # test is_done
+        # test is_done, the job is summarized and expired without monitoring
         j = _get_default_job()
         j.job_id = 1
         j.status = 'done'
+        j.output_url = 'local'
+        j.created_at = j.finished_at = datetime.datetime.now().isoformat()
+        j.get_redis_value = lambda _: defer.fail(AssertionError('polled'))
         j.summarize = _dummy
+        j.download_output = _dummy
+        j.expire = _dummy
         result = yield j.restart(0.000001)
         assert result
+        assert j.is_expired
 
-        # test not is_done
+        # test not is_done, the job is monitored until it is finished
         j = _get_default_job()
         j.job_id = 1
         j.status = 'in-progress'
-        j.monitor = _dummy
+        j.output_file = 'downloaded'  # not downloaded again
+        j.get_redis_value = lambda _: defer.succeed('failed')
+        j.summarize = _dummy
+        j.download_output = lambda: defer.fail(AssertionError('downloaded'))
+        j.expire = _dummy
         result = yield j.restart(0.000001)
         assert result
+        assert j.status == 'failed'
+        assert j.is_expired
+
+        # test failing again, the job can be restarted again
+        j = _get_default_job()
+        j.job_id = 1
+        j.status = 'in-progress'
+        j.monitor = lambda: defer.fail(ValueError('on purpose'))
+        result = yield j.restart(0.000001)
+        assert result is False
+        assert j.failed
+        assert not j.is_expired
 
     @pytest_twisted.inlineCallbacks
     def test_create(self):
@@ -0,0 +1,185 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Logging handlers that keep log formatting off the reactor thread"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import atexit
+import collections
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats each record as a single line of JSON.
+
+    Any "category" passed in the ``extra`` of a log call is included.
+    """
+
+    def format(self, record):
+        data = collections.OrderedDict([
+            ('time', self.formatTime(record)),
+            ('level', record.levelname),
+            ('name', record.name),
+            ('message', record.getMessage()),
+        ])
+        category = getattr(record, 'category', None)
+        if category is not None:
+            data['category'] = category
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc_info'] = record.exc_text
+        return json.dumps(data)
+
+
+class SamplingFilter(logging.Filter):
+    """Only keeps a fraction of the records of each category.
+
+    Records are given a category with ``extra={'category': name}``.
+    Records without a sampled category, and warnings or errors, are always
+    kept. Sampling is deterministic: a rate of 0.1 keeps every 10th record.
+
+    The decision is saved on the record as "sampled", so a record is only
+    counted once by all handlers. Hot paths call sample() before creating
+    a record, and log it with ``extra={'sampled': True}`` if kept.
+
+    Args:
+        rates (dict): The fraction of records kept for each category.
+    """
+
+    def __init__(self, rates):
+        super(SamplingFilter, self).__init__()
+        self.rates = {k: float(v) for k, v in rates.items()}
+        self.seen = collections.Counter()
+        self.dropped = collections.Counter()
+
+    def filter(self, record):
+        sampled = getattr(record, 'sampled', None)
+        if sampled is None:
+            sampled = self.sample(getattr(record, 'category', None),
+                                  record.levelno)
+            record.sampled = sampled
+        return sampled
+
+    def sample(self, category, levelno=logging.DEBUG):
+        """Whether to keep the next record of the category."""
+        rate = self.rates.get(category)
+        if rate is None or rate >= 1 or levelno >= logging.WARNING:
+            return True
+
+        kept = self.seen[category] - self.dropped[category]
+        self.seen[category] += 1
+        if kept < self.seen[category] * rate:
+            return True
+
+        self.dropped[category] += 1
+        return False
+
+
+_sampler = None  # the SamplingFilter of the installed handlers
+
+
+def install_sampler(rates):
+    """Create the SamplingFilter checked by sample().
+
+    Args:
+        rates (dict): The fraction of records kept for each category.
+
+    Returns:
+        SamplingFilter: The filter to add to the handlers.
+    """
+    global _sampler  # pylint: disable=global-statement
+    _sampler = SamplingFilter(rates)
+    return _sampler
+
+
+def sample(category, levelno=logging.DEBUG):
+    """Whether to log the next record of the category, checked before the
+    record is created so that dropped records cost nothing.
+
+    Returns:
+        bool: False if the installed sampler drops the record.
+    """
+    if _sampler is None:
+        return True
+    return _sampler.sample(category, levelno)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """Enqueues records to be formatted and written by a listener thread.
+
+    Only the message is interpolated before the record is enqueued, so
+    that it does not change with its arguments. All other formatting is
+    done by the handlers of the listener.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)  # other handlers may format the original
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class QueueListener(logging.handlers.QueueListener):
+    """A QueueListener that may be stopped more than once."""
+
+    def stop(self):
+        if self._thread is not None:
+            super(QueueListener, self).stop()
+
+
+def queue_handlers(handlers, level=logging.NOTSET, sample_rates=None):
+    """Write records to the handlers from a background thread.
+
+    Args:
+        handlers (list): The handlers of the listener thread.
+        level (int): Records below this level are not enqueued.
+        sample_rates (dict): The fraction of records of each category
+            that are enqueued.
+
+    Returns:
+        tuple: The QueueHandler to add to a logger and the running
+            QueueListener, which is stopped at exit.
+    """
+    records = queue.Queue(-1)  # unbounded
+    handler = QueueHandler(records)
+    handler.setLevel(level)
+    if sample_rates:
+        handler.addFilter(install_sampler(sample_rates))
+
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # write all remaining records
+    return handler, listener
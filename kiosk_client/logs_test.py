@@ -0,0 +1,137 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for queued and sampled logging"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import logging
+import sys
+import threading
+
+from kiosk_client import logs
+
+
+def _record(msg, *args, **kwargs):
+    level = kwargs.pop('level', logging.DEBUG)
+    record = logging.LogRecord('test', level, __file__, 1, msg, args, None)
+    record.__dict__.update(kwargs)
+    return record
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        super(ListHandler, self).__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((threading.current_thread(), record))
+
+
+class TestLogs(object):
+
+    def test_json_formatter(self):
+        formatter = logs.JSONFormatter()
+        data = json.loads(formatter.format(_record('%s jobs', 5)))
+        assert data['message'] == '5 jobs'
+        assert data['level'] == 'DEBUG'
+        assert data['name'] == 'test'
+        assert 'category' not in data
+
+        data = json.loads(formatter.format(_record('GET', category='status')))
+        assert data['category'] == 'status'
+
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            record = _record('failed')
+            record.exc_info = sys.exc_info()
+        data = json.loads(formatter.format(record))
+        assert 'ZeroDivisionError' in data['exc_info']
+
+    def test_sampling_filter(self):
+        sampler = logs.SamplingFilter({'request': 0.25, 'status': 0})
+
+        kept = [sampler.filter(_record('GET', category='request'))
+                for _ in range(8)]
+        assert kept == [True, False, False, False] * 2
+        assert sampler.dropped['request'] == 6
+
+        # other categories, warnings and errors are always kept
+        assert not sampler.filter(_record('GET', category='status'))
+        assert sampler.filter(_record('GET', category='status',
+                                      level=logging.WARNING))
+        assert sampler.filter(_record('GET', category='other'))
+        assert sampler.filter(_record('GET'))
+
+    def test_sample(self, monkeypatch):
+        monkeypatch.setattr(logs, '_sampler', None)
+        assert all(logs.sample('request') for _ in range(4))
+
+        sampler = logs.install_sampler({'request': 0.5})
+        kept = [logs.sample('request') for _ in range(4)]
+        assert kept == [True, False] * 2
+        assert logs.sample('request', logging.WARNING)
+
+        # records sampled before they were created are not counted again
+        assert sampler.filter(_record('GET', category='request',
+                                      sampled=True))
+        assert sampler.seen['request'] == 4
+
+        # the decision is saved, so each record is counted once by all
+        # of the handlers sharing the filter
+        record = _record('GET', category='request')
+        assert sampler.filter(record) == sampler.filter(record)
+        assert sampler.seen['request'] == 5
+
+    def test_queue_handlers(self, monkeypatch):
+        monkeypatch.setattr(logs, '_sampler', None)
+        target = ListHandler()
+        handler, listener = logs.queue_handlers(
+            [target], level=logging.INFO, sample_rates={'request': 0.5})
+
+        logger = logging.getLogger('test_queue_handlers')
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+        try:
+            args = ['mutable']
+            logger.info('Job %s', args)
+            args.append('changed')  # the message was already interpolated
+            logger.debug('below the level')
+            for _ in range(4):
+                logger.info('sampled', extra={'category': 'request'})
+        finally:
+            listener.stop()
+            logger.removeHandler(handler)
+
+        messages = [r.getMessage() for _, r in target.records]
+        assert messages == ["Job ['mutable']", 'sampled', 'sampled']
+        # records were written by the listener thread
+        assert all(t is not threading.current_thread()
+                   for t, _ in target.records)
@@ -28,46 +28,139 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import json
+import collections
 import logging
 import os
+import shutil
+import tempfile
 import timeit
 import uuid
 
-import requests
-from google.cloud import storage as google_storage
-from twisted.internet import defer, reactor
+import treq
+from twisted.internet import defer, reactor, threads
 from twisted.web.client import HTTPConnectionPool
+from twisted.web.client import URI
 
+from kiosk_client import preflight
+from kiosk_client.balancer import LoadBalancer
+from kiosk_client.cache import ResultCache
+from kiosk_client.cache import UploadIndex
 from kiosk_client.job import Job
+from kiosk_client.job import TIMEOUT_STATUS
+from kiosk_client.records import dump_json
+from kiosk_client.records import JobRecordStore
+from kiosk_client.utils import defer_map
+from kiosk_client.utils import extract_bundle_results
+from kiosk_client.utils import get_file_hash
+from kiosk_client.utils import iter_bundles
+from kiosk_client.utils import is_archive_file
 from kiosk_client.utils import iter_image_files
+from kiosk_client.utils import merge_results
+from kiosk_client.utils import shard_zip
+from kiosk_client.utils import write_bundle
 from kiosk_client.utils import sleep
 from kiosk_client.utils import strip_bucket_prefix
 from kiosk_client.utils import get_download_path
 from kiosk_client import settings
 
-from kiosk_client.cost import CostGetter
+
+# A file to submit as a single job in batch mode.
+# source is the original file when the file is a shard or tile of it,
+# and tile is the (left, upper, right, lower) box of the tile in the source.
+Submission = collections.namedtuple(
+    'Submission', ['filepath', 'digest', 'bundle_members', 'source', 'tile',
+                   'features'])
+Submission.__new__.__defaults__ = (None, None, None, None, None)
 
 
 class JobManager(object):
     """Manages many DeepCell Kiosk jobs.
 
     Args:
-        host (str): public IP address of the DeepCell Kiosk cluster.
+        host (str): public IP address of the DeepCell Kiosk cluster,
+            or a comma-separated list of the addresses of several clusters.
         job_type (str): DeepCell Kiosk job type (e.g. "segmentation").
         upload_prefix (str): upload all files to this folder in the bucket.
         refresh_rate (int): seconds between each manager status check.
         update_interval (int): seconds between each job status refresh.
         expire_time (int): seconds until finished jobs are expired.
         start_delay (int): delay between each job, in seconds.
+        cost_update_interval (float): seconds between each update of the
+            running costs, if calculate_cost is set. Disabled if 0.
+        upload_index (str): path of a persistent index of uploaded files.
+            Files already in the index are not uploaded again.
+        upload_index_max_entries (int): maximum number of uploaded files
+            in the upload index.
+        upload_index_max_age (float): seconds until an uploaded file is
+            uploaded again.
+        hash_workers (int): number of threads used to hash files.
+        result_cache (str): directory of the local result cache.
+            Files already processed with the same job parameters are not
+            processed again.
+        result_cache_max_bytes (int): maximum size of the result cache.
+        result_cache_max_age (float): seconds until a cached result expires.
+        bundle_size (int): bundle images smaller than this many bytes into
+            zip archives of up to this many bytes. Disabled if 0.
+        bundle_count (int): maximum number of images in each bundle.
+        shard_size (int): split zip archives larger than this many bytes
+            into num_shards jobs. Disabled if 0.
+        num_shards (int): number of jobs to split each large archive into.
+        shard_by (str): balance shards by member "bytes" or "count".
+        tile_size (int): split images wider or taller than this many pixels
+            into overlapping tiles of this size. Disabled if 0.
+        tile_overlap (int): number of pixels shared by adjacent tiles.
+        job_order (str): order of the files of a batch, "discovery",
+            "largest-first", "shortest-first" or "interleave".
+        probe_dimensions (bool): count the pixels of each image to
+            estimate the time of its job.
+        hedge_percentile (float): start a duplicate of each job that has
+            been in its status for longer than this percentile of the
+            durations of the status. Whichever finishes first is kept.
+            Disabled if 0.
+        hedge_min_samples (int): number of durations of a status needed
+            before jobs in that status are duplicated.
+        max_hedges (int): maximum number of duplicate jobs. Unlimited if 0.
+        job_timeout (float): seconds each job may run before it is timed
+            out and expired. Disabled if 0.
+        time_budget (float): seconds the run may take before it stops
+            submitting new jobs and drains unfinished jobs. Disabled if 0.
+        drain_timeout (float): seconds unfinished jobs may run once the
+            time budget is used, before they are timed out.
+        chunked_upload (bool): upload files with chunked transfer encoding.
+        upload_chunk_size (int): number of bytes sent at a time during
+            file uploads.
+        output_format (str): format of the output file, "json" or a
+            compact columnar "npz".
+        max_active_jobs (int): maximum number of unfinished jobs in
+            benchmark mode. Unlimited if 0.
+        job_store (str): path of a JSON lines file of finished jobs.
+            If set, the data of finished jobs is written to this file and
+            the jobs are removed from all_jobs.
+        preflight_connections (int): number of connections to the host
+            opened before the first job is created. Jobs send
+            "Connection: close", so each connection only serves the first
+            request that uses it. Disabled if 0.
+        preflight_probes (int): number of requests used to measure the
+            round trip time and API latency of the host before the first
+            job is created. Disabled if 0.
+        load_balancing (str): how the host of each job is chosen if there
+            are several hosts, "round-robin", "least-outstanding" or "ewma".
     """
 
     def __init__(self, host, job_type, **kwargs):
+        # numpy and Pillow are only imported once a manager is created
+        # pylint: disable=import-outside-toplevel
+        from kiosk_client.cost import CostGetter
+        from kiosk_client.hedging import StragglerDetector
+        from kiosk_client.scheduling import CostEstimator
+
         self.logger = logging.getLogger(str(self.__class__.__name__))
         self.created_at = timeit.default_timer()
-        self.all_jobs = []
+        self.all_jobs = []  # unfinished jobs if using a job_store
+        self.pending_tasks = set()  # finished before summarizing
+        self.waiting = {}  # Deferreds of jobs, fired once they are expired
+        self.is_scheduling = False  # more jobs will be added to all_jobs
 
-        self.host = self._get_host(host)
         self.job_type = job_type
 
         model = kwargs.get('model', '')
@@ -113,8 +206,91 @@ class JobManager(object):
         self.upload_results = kwargs.get('upload_results', False)
         self.download_results = kwargs.get('download_results', True)
         self.calculate_cost = kwargs.get('calculate_cost', False)
+        self.cost_update_interval = float(
+            kwargs.get('cost_update_interval', 60))
+        self.hash_workers = int(kwargs.get('hash_workers', 4))
+        self.chunked_upload = kwargs.get('chunked_upload', False)
+        self.upload_chunk_size = int(kwargs.get('upload_chunk_size', 2 ** 16))
+        self.max_active_jobs = int(kwargs.get('max_active_jobs', 0))
+        self.output_format = kwargs.get('output_format', 'json')
+        if self.output_format not in {'json', 'npz'}:
+            raise ValueError('output_format must be "json" or "npz".')
+
+        self.preflight_connections = int(
+            kwargs.get('preflight_connections', 0))
+        self.preflight_probes = int(kwargs.get('preflight_probes', 0))
+        self.preflight_data = {}
+
+        job_store = kwargs.get('job_store')
+        self.job_store = JobRecordStore(job_store) if job_store else None
+
+        upload_index = kwargs.get('upload_index')
+        self.upload_index = None
+        if upload_index:
+            self.upload_index = UploadIndex(
+                upload_index,
+                max_entries=kwargs.get('upload_index_max_entries', 100000),
+                max_age=kwargs.get('upload_index_max_age', 86400))
+        self.reused_uploads = {}  # jobs and the index key of their upload
+
+        result_cache = kwargs.get('result_cache')
+        self.result_cache = None
+        if result_cache:
+            self.result_cache = ResultCache(
+                result_cache,
+                max_bytes=kwargs.get('result_cache_max_bytes', 10 * 2 ** 30),
+                max_age=kwargs.get('result_cache_max_age', 604800))
+
+        self.bundle_size = int(kwargs.get('bundle_size', 0))
+        self.bundle_count = int(kwargs.get('bundle_count', 0))
+        self.shard_size = int(kwargs.get('shard_size', 0))
+        self.num_shards = int(kwargs.get('num_shards', 2))
+        self.shard_by = kwargs.get('shard_by', 'bytes')
+        if self.shard_by not in {'bytes', 'count'}:
+            raise ValueError('shard_by must be "bytes" or "count".')
+
+        self.tile_size = int(kwargs.get('tile_size', 0))
+        self.tile_overlap = int(kwargs.get('tile_overlap', 0))
+        if self.tile_size and not 0 <= self.tile_overlap < self.tile_size:
+            raise ValueError('tile_overlap must be at least 0 and less than '
+                             'tile_size.')
+        if self.tile_size:
+            # images too large for Pillow by default are meant to be tiled
+            from kiosk_client import tiling
+            tiling.allow_large_images()
+
+        self.job_order = kwargs.get('job_order', 'discovery')
+        self.probe_dimensions = kwargs.get('probe_dimensions', False)
+        self.cost_estimator = CostEstimator()
+
+        self.stragglers = None
+        hedge_percentile = float(kwargs.get('hedge_percentile', 0))
+        if hedge_percentile:
+            self.stragglers = StragglerDetector(
+                hedge_percentile,
+                min_samples=int(kwargs.get('hedge_min_samples', 20)))
+        self.max_hedges = int(kwargs.get('max_hedges', 0))
+        self.hedges = {}  # unfinished hedged jobs and duplicates, both ways
+        self.hedge_tasks = {}  # hedged jobs and when their duplicate is done
+        self.hedge_winners = {}  # hedged jobs and the duplicate that won
+        self.hedge_summary = {
+            'hedges': 0,
+            'hedge_wins': 0,
+            'original_wins': 0,
+            'estimated_time_saved': 0.0,
+            'unestimated_wins': 0,
+        }
+        self.latencies = {'hedged': [], 'unhedged': []}
+
+        self.job_timeout = float(kwargs.get('job_timeout', 0))
+        self.time_budget = float(kwargs.get('time_budget', 0))
+        self.drain_timeout = float(kwargs.get('drain_timeout', 120))
+        self.drain_deadline = None  # set once the time budget is used
+        self.abandoned_jobs = 0  # unfinished when the run stopped waiting
+
+        self._tmp_dir = None  # created when required
 
-        self.output_dir = kwargs.get('output_dir', get_download_path())
+        self.output_dir = kwargs.get('output_dir') or get_download_path()
         if not os.path.isdir(self.output_dir):
             raise ValueError('Invalid value for output_dir,'
                              ' %s is not a directory.' % self.output_dir)
@@ -122,45 +298,178 @@ class JobManager(object):
             raise ValueError('Invalid value for output_dir,'
                              ' %s is not writable.' % self.output_dir)
 
-        # initializing cost estimation workflow
-        self.cost_getter = CostGetter()
-
         self.sleep = sleep  # allow monkey-patch
 
-        # twisted configuration
-        self.pool = HTTPConnectionPool(reactor, persistent=True)
-        self.pool.maxPersistentPerHost = settings.CONCURRENT_REQUESTS_PER_HOST
-        self.pool.retryAutomatically = False
+        # each host has its own connection pool, resolved when the run starts
+        if isinstance(host, (list, tuple)):
+            hosts = host
+        else:
+            hosts = [h for h in str(host).split(',') if h.strip()]
+        self.balancer = LoadBalancer(
+            [self._get_host(h) for h in hosts],
+            policy=kwargs.get('load_balancing', 'round-robin'),
+            pool_factory=self._make_pool)
+
+        # initializing cost estimation workflow
+        self.cost_getter = CostGetter(pool=self.pool)
+        self.running_costs = {}
+        self._cost_update = None  # the in-flight running cost update
+        self._cost_updated_at = self.created_at
+
+    @property
+    def host(self):
+        """The first host."""
+        return self.balancer.backends[0].host
+
+    @property
+    def pool(self):
+        """The connection pool of the first host."""
+        return self.balancer.backends[0].pool
+
+    def _make_pool(self):
+        pool = HTTPConnectionPool(reactor, persistent=True)
+        pool.maxPersistentPerHost = settings.CONCURRENT_REQUESTS_PER_HOST
+        pool.retryAutomatically = False
+        return pool
 
     def _get_host(self, host):
-        """Send a GET request to the provided host. Check for redirects.
+        """Add a scheme to the provided host if it does not have one."""
+        host = str(host).strip().lower()
+        if not any(host.startswith(x) for x in ('http://', 'https://')):
+            host = 'http://{}'.format(host)
+        return host
 
-        Twisted does not allow POST requests to follow redirects. Use requests
-        to send a single GET request to the host and follow any redirects.
+    @defer.inlineCallbacks
+    def resolve_host(self):
+        """Send a GET request to each host. Check for redirects.
 
-        Args:
-            host (str): The user-provided hostname.
+        Twisted does not allow POST requests to follow redirects. Send a
+        single GET request to each host and follow any redirects.
 
         Returns:
-            str: The hostname after all redirects.
+            str: The first hostname after all redirects.
         """
-        host = str(host).lower()
-        if not any(host.startswith(x) for x in ('http://', 'https://')):
-            host = 'http://{}'.format(host)
+        for backend in self.balancer:
+            try:
+                response = yield treq.get(backend.host, pool=backend.pool)
+                yield response.content()
+                url = response.request.absoluteURI.decode()
+            except Exception:
+                raise RuntimeError('Could not connect to host: %s' %
+                                   backend.host)
 
+            backend.host = url[:-1] if url.endswith('/') else url
+        defer.returnValue(self.host)
+
+    @defer.inlineCallbacks
+    def _probe_api(self, backend):
+        """Time a request for a key that does not exist."""
+        host = '{}/api/redis'.format(backend.host)
+        payload = {'hash': 'preflight-{}'.format(uuid.uuid4().hex),
+                   'key': 'status'}
+        start = timeit.default_timer()
+        response = yield treq.post(host, json=payload, pool=backend.pool)
+        yield response.content()
+        defer.returnValue(timeit.default_timer() - start)
+
+    @defer.inlineCallbacks
+    def _warm_connection(self, backend):
+        response = yield treq.get(backend.host, pool=backend.pool)
+        yield response.content()  # return the connection to the pool
+
+    @defer.inlineCallbacks
+    def _preflight_host(self, backend):
+        start = timeit.default_timer()
+        uri = URI.fromBytes(backend.host.encode())
+        hostname = uri.host.decode()
+
+        resolver = preflight.install_caching_resolver(reactor)
+        addresses = yield preflight.resolve(resolver, hostname, uri.port)
+        data = {
+            'addresses': sorted(set(a.host for a in addresses)),
+            'dns_time': timeit.default_timer() - start,
+            'connections': 0,
+        }
+
+        rtt, api_latency = [], []
         try:
-            url = str(requests.get(host).url)
-            url = url[:-1] if url.endswith('/') else url
-            return url
-        except:
-            raise RuntimeError('Could not connect to host: %s' % host)
+            for _ in range(self.preflight_probes):
+                elapsed = yield preflight.time_connect(
+                    reactor, hostname, uri.port)
+                rtt.append(elapsed)
+
+            for _ in range(self.preflight_probes):
+                elapsed = yield self._probe_api(backend)
+                api_latency.append(elapsed)
+                backend.observe(elapsed)  # the first latency of the host
+
+            # no more connections than the pool will keep
+            num_connections = min(self.preflight_connections,
+                                  backend.pool.maxPersistentPerHost)
+            yield defer.gatherResults([
+                self._warm_connection(backend) for _ in range(num_connections)
+            ], consumeErrors=True)
+            data['connections'] = num_connections
+        except Exception as err:  # pylint: disable=broad-except
+            if isinstance(err, defer.FirstError):
+                err = err.subFailure.value
+            self.logger.warning('Encountered %s during preflight of %s: %s',
+                                type(err).__name__, backend.host, err)
+
+        from kiosk_client.analyze import get_stats  # pylint: disable=C0415
+        data['rtt'] = get_stats(rtt, percentiles=(50,))
+        data['api_latency'] = get_stats(api_latency, percentiles=(50,))
+        data['time'] = timeit.default_timer() - start
+
+        self.logger.info('Preflight of %s (%s) finished in %.3fs: median RTT '
+                         'is %ss and median API latency is %ss.',
+                         backend.host, ', '.join(data['addresses']),
+                         data['time'], data['rtt'].get('p50'),
+                         data['api_latency'].get('p50'))
+        defer.returnValue(data)
+
+    @defer.inlineCallbacks
+    def preflight(self):
+        """Warm up connections to each host and measure its latency.
+
+        Each hostname is resolved once and cached for the rest of the run,
+        preflight_connections connections are opened and left in the pool
+        of each host, and the round trip time and API latency of each host
+        are measured with preflight_probes requests. Job requests close
+        their connection, so the opened connections only save the connects
+        of the first requests.
+
+        Returns:
+            dict: The baseline latency of each host, in seconds.
+        """
+        if not self.preflight_connections and not self.preflight_probes:
+            defer.returnValue(self.preflight_data)
 
+        for backend in self.balancer:
+            data = yield self._preflight_host(backend)
+            self.preflight_data[backend.host] = data
+        defer.returnValue(self.preflight_data)
+
+    @defer.inlineCallbacks
     def upload_file(self, filepath, acl='publicRead',
                     hash_filename=True, prefix=None):
         prefix = self.upload_prefix if prefix is None else prefix
         start = timeit.default_timer()
-        storage_client = google_storage.Client()
 
+        key = None
+        if hash_filename and self.upload_index is not None:
+            digest = yield threads.deferToThread(get_file_hash, filepath)
+            key = UploadIndex.get_key(digest, bucket=self.bucket,
+                                      prefix=prefix)
+            dest = self.upload_index.get(key)
+            if dest is not None:
+                self.logger.debug('Skipping upload of %s, already uploaded '
+                                  'as %s.', filepath, dest)
+                defer.returnValue(dest)
+
+        # only imported when used, it is slow to import
+        from google.cloud import storage  # pylint: disable=C0415
+        storage_client = storage.Client()
         self.logger.debug('Uploading %s.', filepath)
         if hash_filename:
             _, ext = os.path.splitext(filepath)
@@ -171,13 +480,80 @@ class JobManager(object):
         bucket = storage_client.get_bucket(self.bucket)
         blob = bucket.blob(os.path.join(prefix, dest))
         blob.upload_from_filename(filepath, predefined_acl=acl)
+        upload_time = timeit.default_timer() - start
         self.logger.debug('Uploaded %s to %s in %s seconds.',
-                          filepath, dest, timeit.default_timer() - start)
-        return dest
+                          filepath, dest, upload_time)
+        if key is not None:
+            self.upload_index.add(key, dest,
+                                  size=os.path.getsize(filepath),
+                                  upload_time=upload_time)
+        defer.returnValue(dest)
+
+    @defer.inlineCallbacks
+    def upload_job_file(self, job, digest=None):
+        """Upload the job's file through the API and update its filepath.
 
-    def make_job(self, filepath):
+        If the content hash of the file is found in the upload index,
+        the upload is skipped and the previously uploaded name is used.
+
+        Args:
+            job (kiosk_client.job.Job): The job whose file to upload.
+            digest (str): The content hash of the job's file.
+
+        Returns:
+            str: The uploaded path of the file.
+        """
+        start = timeit.default_timer()
+        uploaded_path, key = None, None
+        if digest is not None and self.upload_index is not None:
+            # the cluster of the job's host stores the upload
+            key = UploadIndex.get_key(digest, host=job.host,
+                                      prefix=self.upload_prefix)
+            uploaded_path = self.upload_index.get(key)
+
+        if uploaded_path is not None:
+            self.logger.info('Skipping upload of file "%s", already uploaded '
+                             'as "%s".', job.filepath, uploaded_path)
+            self.reused_uploads[job] = key
+        else:
+            self.logger.info('Uploading file "%s".', job.filepath)
+            uploaded_path = yield job.upload_file()
+            upload_time = timeit.default_timer() - start
+            self.logger.info('Uploaded file "%s" in %s seconds.',
+                             job.filepath, upload_time)
+            if key is not None:
+                self.upload_index.add(key, uploaded_path,
+                                      size=os.path.getsize(job.filepath),
+                                      upload_time=upload_time)
+
+        try:
+            job.filepath = os.path.relpath(uploaded_path, self.upload_prefix)
+        except ValueError:
+            # relpath on Windows can cause ValuError
+            # if the paths are not on the same drive.
+            # ValueError: path is on mount 'C:', start on mount 'D:'
+            job.filepath = uploaded_path
+
+        defer.returnValue(uploaded_path)
+
+    @property
+    def tmp_dir(self):
+        """Temporary directory for files created by the manager."""
+        if self._tmp_dir is None:
+            self._tmp_dir = tempfile.mkdtemp(prefix='kiosk-client-')
+        return self._tmp_dir
+
+    def remove_tmp_dir(self):
+        """Remove the bundles, shards and tiles created by the manager."""
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None
+
+    def make_job(self, filepath, backend=None):
+        if backend is None:
+            backend = self.balancer.choose()
         return Job(filepath=filepath,
-                   host=self.host,
+                   host=backend.host,
                    model_name=self.model_name,
                    model_version=self.model_version,
                    job_type=self.job_type,
@@ -188,14 +564,124 @@ class JobManager(object):
                    update_interval=self.update_interval,
                    download_results=self.download_results,
                    expire_time=self.expire_time,
-                   pool=self.pool,
+                   timeout=self.job_timeout,
+                   pool=backend.pool,
+                   on_response=backend.observe,
+                   on_status_change=(self._on_status_change
+                                     if self.stragglers is not None
+                                     else None),
+                   chunked_upload=self.chunked_upload,
+                   upload_chunk_size=self.upload_chunk_size,
                    output_dir=self.output_dir)
 
+    def get_result_key(self, digest):
+        """Get the result cache key of a file processed by this manager."""
+        return ResultCache.get_key(
+            digest,
+            model_name=self.model_name,
+            model_version=self.model_version,
+            preprocess=self.preprocess,
+            postprocess=self.postprocess,
+            data_scale=self.data_scale,
+            data_label=self.data_label,
+            job_type=self.job_type)
+
+    def get_cached_result(self, job, digest):
+        """Complete the job with results from the result cache, if possible.
+
+        Args:
+            job (kiosk_client.job.Job): The job to complete.
+            digest (str): The content hash of the job's file.
+
+        Returns:
+            bool: Whether the job was completed from the result cache.
+        """
+        if digest is None or self.result_cache is None:
+            return False
+
+        entry = self.result_cache.get(self.get_result_key(digest))
+        if entry is None:
+            return False
+
+        summary = entry.get('summary', {})
+        job.status = 'done'
+        job.output_url = entry['output_url']
+        job.created_at = summary.get('created_at')
+        job.finished_at = summary.get('finished_at')
+        job.cache_hit = True
+        job.is_expired = True  # there is no key to expire
+
+        cached_file = entry.get('output_file')
+        if self.download_results and cached_file:
+            basename = job.output_url.split('/')[-1]
+            job.output_file = os.path.join(self.output_dir, basename)
+            if not os.path.exists(job.output_file):
+                shutil.copyfile(cached_file, job.output_file)
+
+        self.logger.info('Found cached results for "%s" at `%s`.',
+                         job.filepath, job.output_url)
+        return True
+
+    def cache_result(self, job, digest):
+        """Add the results of a successful job to the result cache."""
+        if digest is None or self.result_cache is None:
+            return
+        if job.status != 'done' or not job.is_summarized or job.cache_hit:
+            return
+        self.result_cache.add(
+            self.get_result_key(digest),
+            job.output_url,
+            output_file=job.output_file,
+            created_at=job.created_at,
+            finished_at=job.finished_at)
+
+    def save_indices(self):
+        """Persist the upload index and result cache to disk."""
+        for index in (self.upload_index, self.result_cache):
+            if index is None:
+                continue
+            try:
+                index.save()
+            except (IOError, OSError) as err:
+                self.logger.error('Could not save index %s: %s',
+                                  index.path, err)
+
+    @property
+    def num_jobs(self):
+        """The number of jobs, including those in the job_store."""
+        stored = len(self.job_store) if self.job_store is not None else 0
+        return len(self.all_jobs) + stored
+
+    def iter_job_data(self):
+        """Iterate over the JSON data of all jobs."""
+        if self.job_store is not None:
+            for record in self.job_store:
+                yield record
+        for j in self.all_jobs:
+            yield j.json()
+
+    def store_finished_jobs(self):
+        """Move the data of finished jobs from memory to the job_store."""
+        unfinished = []
+        for j in self.all_jobs:
+            if j.is_expired and not j.failed:
+                self.job_store.add(j.json())
+            else:
+                unfinished.append(j)
+        self.all_jobs = unfinished
+        self.job_store.flush()
+
     def get_completed_job_count(self):
         created, complete, failed, expired = 0, 0, 0, 0
 
         statuses = {}
 
+        if self.job_store is not None:
+            self.store_finished_jobs()
+            # stored jobs were created, summarized and expired
+            created = complete = expired = len(self.job_store)
+            statuses.update(self.job_store.statuses)
+
         for j in self.all_jobs:
             expired += int(j.is_expired)  # true mark of being done
             complete += int(j.is_summarized)
@@ -208,7 +694,8 @@ class JobManager(object):
                     statuses[j.status] += 1
 
             if j.failed:
-                j.restart(delay=self.start_delay * failed)
+                self.track_job(j, defer.maybeDeferred(
+                    j.restart, delay=self.start_delay * failed))
 
             # # TODO: patched! "done" jobs can get stranded before summarization
             # if j.status == 'done' and not j.is_summarized:
@@ -222,9 +709,9 @@ class JobManager(object):
                          '%s; %s jobs total', created, expired, complete,
                          '; '.join('%s %s' % (v, k)
                                    for k, v in statuses.items()),
-                         len(self.all_jobs))
+                         self.num_jobs)
 
-        if len(self.all_jobs) - expired <= 25:
+        if self.num_jobs - expired <= 25:
             for j in self.all_jobs:
                 if not j.is_expired:
                     self.logger.info('Waiting on key `%s` with status %s',
@@ -232,6 +719,244 @@ class JobManager(object):
 
         return expired
 
+    def get_cost_per_job(self, cost):
+        """Divide the cost by the number of successfully completed jobs."""
+        done = sum(int(j.status == 'done') for j in self.all_jobs)
+        if self.job_store is not None:
+            done += self.job_store.statuses['done']
+        return float(cost) / done if done else None
+
+    def _log_running_costs(self, costs):
+        costs['cost_per_job'] = self.get_cost_per_job(costs['node_cost'])
+        self.running_costs = costs
+        self.logger.info('Running node cost is $%.4f ($%.4f/hour, $%s per '
+                         'completed job).', costs['node_cost'],
+                         costs['cost_per_hour'], costs['cost_per_job'])
+        return costs
+
+    def update_running_costs(self):
+        """Update the running costs if cost_update_interval has passed.
+
+        The update is not waited on, so it does not delay status checks.
+
+        Returns:
+            Deferred: the in-flight update, or None if no update is due.
+        """
+        if self._cost_update is not None:
+            return self._cost_update
+
+        now = timeit.default_timer()
+        if now - self._cost_updated_at < self.cost_update_interval:
+            return None
+
+        self._cost_updated_at = now
+
+        def _error(failure):
+            self.logger.error('Encountered %s while updating running costs: '
+                              '%s', failure.type.__name__, failure.value)
+
+        def _done(result):
+            self._cost_update = None
+            return result
+
+        d = defer.maybeDeferred(self.cost_getter.update)
+        d.addCallback(self._log_running_costs)
+        d.addErrback(_error)
+        d.addBoth(_done)
+        if not d.called:
+            self._cost_update = d
+        return d
+
+    def add_pending_task(self, d):
+        """Wait for the Deferred to fire before summarizing the run."""
+        self.pending_tasks.add(d)
+
+        def _remove(result):
+            self.pending_tasks.discard(d)
+            return result
+
+        d.addBoth(_remove)
+        return d
+
+    def check_reused_upload(self, result, job):
+        """Remove the reused upload of a failed job from the upload index,
+        as the uploaded file may have been deleted from the bucket."""
+        key = self.reused_uploads.pop(job, None)
+        if key is not None and self.get_winner(job).status == 'failed':
+            self.logger.warning('Job of previously uploaded file "%s" failed, '
+                                'it will be uploaded again.', job.filepath)
+            self.upload_index.remove(key)
+        return result
+
+    def when_finished(self, job):
+        """Get a Deferred that fires with the job once its key is expired.
+
+        A job that fails is restarted, so the Deferred returned by its
+        start() may fire long before the job is finished.
+        """
+        if job.is_expired:
+            return defer.succeed(job)
+        d = defer.Deferred()
+        self.waiting.setdefault(job, []).append(d)
+        return d
+
+    def track_job(self, job, d):
+        """Count the job as running on its host until the Deferred fires,
+        then fire the Deferreds waiting for the job if it is finished."""
+        backend = self.balancer.get(job.host)
+        if backend is not None:  # made by this manager
+            backend.acquire()
+
+        def _release(result):
+            if backend is not None:
+                backend.release(job)
+            if job.is_expired:
+                for waiting in self.waiting.pop(job, []):
+                    waiting.callback(job)
+            return result
+
+        d.addBoth(_release)
+        return d
+
+    def _on_status_change(self, job, previous, seconds):
+        now = timeit.default_timer()
+        if previous is not None and seconds is not None:
+            self.stragglers.add(previous, seconds)
+
+        if job.status == 'failed' and job in self.hedges:
+            # the other job of the pair keeps running, and wins if done
+            partner = self.hedges.pop(job)
+            self.logger.warning('[%s]: Failed, waiting on its hedged pair.',
+                                job.job_id)
+            if job.hedge_of is None and partner.status != 'failed':
+                self.hedge_winners[job] = partner
+            return
+
+        if job.status != 'done' or job.cancelled:
+            return
+
+        partner = self.hedges.pop(job, None)
+        if partner is None:  # never hedged
+            if job.started_at is not None:
+                self.latencies['unhedged'].append(now - job.started_at)
+            return
+
+        self.hedges.pop(partner, None)
+        if job.hedge_of is None:
+            original = job
+            self.hedge_summary['original_wins'] += 1
+        else:
+            original = partner
+            self.hedge_summary['hedge_wins'] += 1
+            self.hedge_winners[partner] = job
+            remaining = self.stragglers.expected_remaining(
+                partner.status, now - partner.status_changed_at)
+            if remaining is None:
+                self.hedge_summary['unestimated_wins'] += 1
+            else:
+                self.hedge_summary['estimated_time_saved'] += remaining
+
+        if original.started_at is not None:
+            self.latencies['hedged'].append(now - original.started_at)
+        if partner.status != 'failed':
+            partner.cancel()
+
+    def hedge(self, job):
+        """Start a duplicate of the job on the same host. Whichever is done
+        first is kept and the other is cancelled. If either fails, the
+        other keeps running."""
+        self.logger.warning('[%s]: Straggling with status `%s` for %.1fs, '
+                            'starting a duplicate job.', job.job_id,
+                            job.status,
+                            timeit.default_timer() - job.status_changed_at)
+        # the file was uploaded to the original job's host
+        hedge = self.make_job(job.filepath,
+                              backend=self.balancer.get(job.host))
+        for name in ('original_name', 'bundle_members', 'shard_of',
+                     'tile_of', 'tile_box'):
+            setattr(hedge, name, getattr(job, name))
+        hedge.hedge_of = job.job_id
+        self.hedges[job] = hedge
+        self.hedges[hedge] = job
+        self.hedge_summary['hedges'] += 1
+        self.all_jobs.append(hedge)
+
+        self.track_job(hedge, defer.maybeDeferred(hedge.start))
+        self.hedge_tasks[job] = self.when_finished(hedge)
+        self.add_pending_task(self.when_finished(hedge))
+        return hedge
+
+    def hedge_stragglers(self):
+        """Start a duplicate of each job straggling in its status.
+
+        Returns:
+            list: The new duplicate jobs.
+        """
+        if self.stragglers is None or self.drain_deadline is not None:
+            return []
+
+        now = timeit.default_timer()
+        hedges = []
+        for j in list(self.all_jobs):
+            if self.max_hedges and \
+                    self.hedge_summary['hedges'] >= self.max_hedges:
+                break
+
+            if (j.is_done or j.cancelled or j.failed or j in self.hedges or
+                    j.hedge_of is not None or j.status_changed_at is None):
+                continue
+
+            if self.stragglers.is_straggler(j.status,
+                                            now - j.status_changed_at):
+                hedges.append(self.hedge(j))
+        return hedges
+
+    def get_winner(self, job):
+        """Get the job, or its duplicate if the duplicate finished first."""
+        return self.hedge_winners.get(job, job)
+
+    def wait_for_winner(self, result, job):
+        """Wait for the duplicate of the job, if it finished first."""
+        if job in self.hedge_winners:
+            return self.hedge_tasks.pop(job)
+        return result
+
+    @property
+    def is_over_budget(self):
+        """Whether the run has used its time budget."""
+        elapsed = timeit.default_timer() - self.created_at
+        return self.time_budget > 0 and elapsed >= self.time_budget
+
+    @property
+    def is_drained(self):
+        """Whether unfinished jobs have had time to notice their drain
+        deadline and expire their keys."""
+        if self.drain_deadline is None:
+            return False
+        grace = 2 * float(self.update_interval)
+        return timeit.default_timer() >= self.drain_deadline + grace
+
+    def drain(self):
+        """Time out each unfinished job within drain_timeout seconds."""
+        self.drain_deadline = timeit.default_timer() + self.drain_timeout
+        unfinished = [j for j in self.all_jobs if not j.is_expired]
+        self.logger.warning('Used the time budget of %ss, draining %s '
+                            'unfinished jobs within %ss.', self.time_budget,
+                            len(unfinished), self.drain_timeout)
+        for j in unfinished:
+            if j.deadline is None or j.deadline > self.drain_deadline:
+                j.deadline = self.drain_deadline
+
+    def check_time_budget(self):
+        """Drain the run if it has used its time budget.
+
+        Returns:
+            bool: Whether new jobs should no longer be submitted.
+        """
+        if self.drain_deadline is None and self.is_over_budget:
+            self.drain()
+        return self.drain_deadline is not None
+
     @defer.inlineCallbacks
     def _stop(self):
         yield reactor.stop()  # pylint: disable=no-member
@@ -240,53 +965,189 @@ class JobManager(object):
     def check_job_status(self):
         complete = -1  # initialize comparison value
 
-        while complete != len(self.all_jobs):
+        while self.is_scheduling or complete != self.num_jobs:
             yield self.sleep(self.refresh_rate)
 
             complete = self.get_completed_job_count()  # synchronous
 
-        self.summarize()  # synchronous
+            if self.check_time_budget() and self.is_drained:
+                self.abandoned_jobs = self.num_jobs - complete
+                if self.abandoned_jobs:
+                    self.logger.error('Stopped waiting on %s unfinished '
+                                      'jobs after draining.',
+                                      self.abandoned_jobs)
+                break
+
+            self.hedge_stragglers()
+
+            if self.calculate_cost and self.cost_update_interval > 0:
+                self.update_running_costs()
+
+        if self.pending_tasks and not self.abandoned_jobs:
+            self.logger.info('Waiting on %s tasks to finish.',
+                             len(self.pending_tasks))
+            yield defer.DeferredList(list(self.pending_tasks))
+
+        yield self.summarize()
+
+        self.remove_tmp_dir()
 
         yield self._stop()
 
+    @defer.inlineCallbacks
     def summarize(self):
         time_elapsed = timeit.default_timer() - self.created_at
         self.logger.info('Finished %s jobs in %s seconds.',
-                         len(self.all_jobs), time_elapsed)
+                         self.num_jobs, time_elapsed)
 
         # add cost and timing data to json output
         cpu_cost, gpu_cost, total_cost = '', '', ''
         if self.calculate_cost:
             try:
-                cpu_cost, gpu_cost, total_cost = self.cost_getter.finish()
+                costs = yield defer.maybeDeferred(self.cost_getter.finish)
+                cpu_cost, gpu_cost, total_cost = costs
             except Exception as err:  # pylint: disable=broad-except
                 self.logger.error('Encountered %s while getting cost data: %s',
                                   type(err).__name__, err)
 
+        utilization = {}
+        if total_cost != '':
+            try:
+                utilization = yield defer.maybeDeferred(
+                    self.cost_getter.get_utilization)
+                self.logger.info('GPUs were %.1f%% utilized, %.2f of %.2f '
+                                 'GPU-hours were idle.',
+                                 utilization['gpu_utilization'] * 100,
+                                 utilization['idle_gpu_hours'],
+                                 utilization['gpu_hours'])
+            except Exception as err:  # pylint: disable=broad-except
+                self.logger.error('Encountered %s while getting GPU '
+                                  'utilization data: %s',
+                                  type(err).__name__, err)
+
+        cost_per_hour, cost_per_job, jobs_per_dollar = None, None, None
+        node_data = self.cost_getter.node_data
+        node_pools = {}
+        if total_cost != '':
+            node_cost = float(cpu_cost) + float(gpu_cost)
+            cost_per_hour = node_cost / (time_elapsed / 60 / 60)
+            cost_per_job = self.get_cost_per_job(total_cost)
+            if cost_per_job:
+                jobs_per_dollar = 1 / cost_per_job
+            self.logger.info('Total cost is $%s ($%.4f/hour of node costs, '
+                             '$%s per completed job).', total_cost,
+                             cost_per_hour, cost_per_job)
+            if node_data:
+                node_pools = self.cost_getter.compute_node_pool_costs(
+                    node_data)
+
+        upload_summary = {}
+        if self.upload_index is not None:
+            upload_summary = self.upload_index.summary()
+            self.logger.info('Skipped %s uploads of previously uploaded files, '
+                             'saving %s bytes and %s seconds.',
+                             upload_summary['hits'],
+                             upload_summary['bytes_saved'],
+                             upload_summary['time_saved'])
+
+        cache_summary = {}
+        if self.result_cache is not None:
+            cache_summary = self.result_cache.summary()
+            self.logger.info('Found %s of %s results in the result cache.',
+                             cache_summary['hits'],
+                             cache_summary['hits'] + cache_summary['misses'])
+
+        self.save_indices()
+
+        hedging = {}
+        if self.stragglers is not None:
+            from kiosk_client.analyze import get_stats  # pylint: disable=C0415
+            hedging = dict(self.hedge_summary, **self.stragglers.json())
+            hedged = self.latencies['hedged']
+            hedging['latency'] = get_stats(
+                hedged + self.latencies['unhedged'])
+            hedging['hedged_latency'] = get_stats(hedged)
+            self.logger.info('Started %s duplicates of straggling jobs, %s '
+                             'of which finished first, saving an estimated '
+                             '%.1fs.', hedging['hedges'],
+                             hedging['hedge_wins'],
+                             hedging['estimated_time_saved'])
+
+        timed_out = sum(int(j.status == TIMEOUT_STATUS) for j in self.all_jobs)
+        if self.job_store is not None:
+            timed_out += self.job_store.statuses[TIMEOUT_STATUS]
+        time_budget = {
+            'job_timeout': self.job_timeout,
+            'time_budget': self.time_budget,
+            'drain_timeout': self.drain_timeout,
+            'exhausted': self.drain_deadline is not None,
+            'timed_out': timed_out,
+            'abandoned': self.abandoned_jobs,
+        }
+        if timed_out or self.abandoned_jobs:
+            self.logger.warning('%s jobs timed out and %s were abandoned.',
+                                timed_out, self.abandoned_jobs)
+
+        hosts = self.balancer.json(time_elapsed)
+        if len(hosts) > 1:
+            for h in hosts:
+                self.logger.info('%s completed %s jobs (%.2f/minute) with a '
+                                 'mean request latency of %ss.', h['host'],
+                                 h['completed'], h['jobs_per_minute'],
+                                 h['latency'])
+
         jsondata = {
             'cpu_node_cost': cpu_cost,
             'gpu_node_cost': gpu_cost,
             'total_node_and_networking_costs': total_cost,
+            'node_cost_per_hour': cost_per_hour,
+            'cost_per_job': cost_per_job,
+            'running_costs': self.running_costs,
+            'gpu_utilization': utilization,
+            'jobs_per_dollar': jobs_per_dollar,
+            'node_pools': node_pools,
+            'node_data': node_data,
+            'pricing': self.cost_getter.pricing.json(),
             'start_delay': self.start_delay,
-            'num_jobs': len(self.all_jobs),
+            'num_jobs': self.num_jobs,
             'time_elapsed': time_elapsed,
-            'job_data': [j.json() for j in self.all_jobs]
+            'upload_index': upload_summary,
+            'result_cache': cache_summary,
+            'preflight': self.preflight_data,
+            'load_balancing': self.balancer.policy,
+            'hosts': hosts,
+            'job_order': self.job_order,
+            'cost_estimator': self.cost_estimator.json(),
+            'hedging': hedging,
+            'time_budget': time_budget,
         }
 
-        output_filepath = '{}{}jobs_{}delay_{}.json'.format(
+        output_filepath = '{}{}jobs_{}delay_{}.{}'.format(
             '{}gpu_'.format(settings.NUM_GPUS) if settings.NUM_GPUS else '',
-            len(self.all_jobs), self.start_delay, uuid.uuid4().hex)
+            self.num_jobs, self.start_delay, uuid.uuid4().hex,
+            self.output_format)
         output_filepath = os.path.join(self.output_dir, output_filepath)
 
-        with open(output_filepath, 'w') as jsonfile:
-            json.dump(jsondata, jsonfile, indent=4)
-            self.logger.info('Wrote job data as JSON to %s.', output_filepath)
+        if self.output_format == 'npz':
+            from kiosk_client import columnar  # pylint: disable=C0415
+            columnar.save_columns(output_filepath, self.iter_job_data(),
+                                  jsondata)
+            self.logger.info('Wrote job data as columns to %s.',
+                             output_filepath)
+        else:
+            with open(output_filepath, 'w') as jsonfile:
+                dump_json(jsondata, self.iter_job_data(), jsonfile)
+                self.logger.info('Wrote job data as JSON to %s.',
+                                 output_filepath)
+
+        if self.job_store is not None:
+            self.job_store.close()
 
         if self.upload_results:
             try:
-                _ = self.upload_file(output_filepath,
-                                     hash_filename=False,
-                                     prefix='output')
+                _ = yield self.upload_file(output_filepath,
+                                           hash_filename=False,
+                                           prefix='output')
             except Exception as err:  # pylint: disable=broad-except
                 self.logger.error(err)
                 self.logger.error('Could not upload output file to bucket. '
@@ -301,51 +1162,333 @@ class BenchmarkingJobManager(JobManager):
     # pylint: disable=arguments-differ
 
     @defer.inlineCallbacks
-    def run(self, filepath, count, upload=False):
-        self.logger.info('Benchmarking %s jobs of file `%s`', count, filepath)
+    def schedule_jobs(self, filepath, count, upload=False):
+        """Start count jobs of the file, start_delay seconds apart.
 
-        for i in range(count):
+        Each job is only created when it is about to start, so a single
+        timer is pending no matter how many jobs are scheduled.
+        If max_active_jobs is set, new jobs wait for earlier jobs to finish.
+        """
+        semaphore = None
+        if self.max_active_jobs > 0:
+            semaphore = defer.DeferredSemaphore(self.max_active_jobs)
 
-            job = self.make_job(filepath)
+        def _release(result):
+            semaphore.release()
+            return result
 
-            self.all_jobs.append(job)
+        self.is_scheduling = True
+        started_at = timeit.default_timer()
+        try:
+            for i in range(count):
+                # fixed schedule, so waiting on the semaphore does not drift
+                delay = started_at + self.start_delay * i
+                yield self.sleep(max(delay - timeit.default_timer(), 0))
+
+                if semaphore is not None:
+                    yield semaphore.acquire()
+
+                if self.check_time_budget():
+                    self.logger.warning('Skipping the last %s of %s jobs.',
+                                        count - i, count)
+                    if semaphore is not None:
+                        semaphore.release()
+                    break
+
+                job = self.make_job(filepath)
+                self.all_jobs.append(job)
+
+                self.track_job(job, defer.maybeDeferred(
+                    job.start, delay=0, upload=upload))
+                if semaphore is not None:
+                    # a failed job is restarted, release it once expired
+                    self.when_finished(job).addBoth(_release)
+        finally:
+            self.is_scheduling = False
 
-            # stagger the delay seconds; if upload it will be staggered already
-            job.start(delay=self.start_delay * i * int(not upload),
-                      upload=upload)
+    @defer.inlineCallbacks
+    def run(self, filepath, count, upload=False):
+        self.logger.info('Benchmarking %s jobs of file `%s`', count, filepath)
 
-            yield self.sleep(self.start_delay * upload)
+        yield self.resolve_host()
+        yield self.preflight()  # before the first job is created
 
-            if upload:
-                self.get_completed_job_count()  # log during uploading
+        # check the status of started jobs while scheduling the rest
+        status = self.check_job_status()
 
-        yield self.check_job_status()
+        yield self.schedule_jobs(filepath, count, upload=upload)
+
+        yield status
 
 
 class BatchProcessingJobManager(JobManager):
     # pylint: disable=arguments-differ
 
+    def iter_submissions(self, filepath):
+        """Yield the group of files to submit in each job.
+
+        If bundling is enabled, small images are grouped to be bundled into
+        a single zip archive. Otherwise, each file is submitted on its own.
+        """
+        files = iter_image_files(filepath)
+        if not self.bundle_size:
+            return ([f] for f in files)
+        return iter_bundles(files, self.bundle_size, self.bundle_count)
+
+    def prepare_submission(self, paths):
+        """Bundle, shard, and hash the files to submit.
+
+        This is run in a worker thread.
+
+        Args:
+            paths (list): A group of files from iter_submissions().
+
+        Returns:
+            list: A Submission for each job to create.
+        """
+        is_hashed = (self.upload_index is not None or
+                     self.result_cache is not None)
+
+        def _hash(filepath):
+            return get_file_hash(filepath) if is_hashed else None
+
+        def _features(filepath):
+            # only files created here, the rest were found when ordered
+            if self.job_order == 'discovery':
+                return None
+            # pylint: disable=import-outside-toplevel
+            from kiosk_client.scheduling import get_features
+            return get_features(filepath, self.probe_dimensions)
+
+        if len(paths) > 1:
+            filepath = os.path.join(
+                self.tmp_dir, 'bundle_{}.zip'.format(uuid.uuid4().hex))
+            members = write_bundle(paths, filepath)
+            return [Submission(filepath, _hash(filepath), members)]
+
+        filepath = paths[0]
+        is_large = (self.shard_size and is_archive_file(filepath) and
+                    os.path.getsize(filepath) > self.shard_size)
+        if is_large:
+            shard_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+            shards = shard_zip(filepath, self.num_shards, shard_dir,
+                               by=self.shard_by)
+            return [Submission(s, _hash(s), source=filepath,
+                               features=_features(s)) for s in shards]
+
+        if self.tile_size and not is_archive_file(filepath):
+            from kiosk_client import tiling  # pylint: disable=C0415
+            width, height = tiling.get_image_size(filepath)
+            if max(width, height) > self.tile_size:
+                tile_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+                tiles = tiling.write_tiles(filepath, tile_dir, self.tile_size,
+                                           self.tile_overlap)
+                return [Submission(t, _hash(t), source=filepath, tile=box,
+                                   features=_features(t))
+                        for t, box in tiles]
+
+        return [Submission(filepath, _hash(filepath))]
+
+    def _prepare_submission(self, paths):
+        """Prepare the submission, or log the error and skip its files."""
+        try:
+            return self.prepare_submission(paths)
+        except Exception as err:  # pylint: disable=broad-except
+            self.logger.error('Skipping %s, could not prepare them due to '
+                              '%s: %s', paths, type(err).__name__, err)
+            return []
+
     @defer.inlineCallbacks
-    def run(self, filepath):
-        self.logger.info('Benchmarking all image/zip files in `%s`', filepath)
+    def finish_job(self, job, digest):
+        """Cache the results of the job and map bundled results back to
+        their original files."""
+        self.cache_result(job, digest)
 
-        for f in iter_image_files(filepath):
-            _ = timeit.default_timer()
-            job = self.make_job(f)
-            self.all_jobs.append(job)
-            self.logger.info('Uploading file "%s".', f)
-            uploaded_path = yield job.upload_file()
-            self.logger.info('Uploaded file "%s" in %s seconds.',
-                             f, timeit.default_timer() - _)
+        if job.bundle_members and job.output_file:
             try:
-                job.filepath = os.path.relpath(
-                    uploaded_path, self.upload_prefix)
-            except ValueError:
-                # relpath on Windows can cause ValuError
-                # if the paths are not on the same drive.
-                # ValueError: path is on mount 'C:', start on mount 'D:'
-                job.filepath = uploaded_path
+                results = yield threads.deferToThread(
+                    extract_bundle_results, job.output_file,
+                    job.bundle_members, self.output_dir)
+                self.logger.info('Extracted results of %s bundled files '
+                                 'from %s.', len(results), job.output_file)
+            except Exception as err:  # pylint: disable=broad-except
+                self.logger.error('Could not extract bundled results from '
+                                  '%s due to %s: %s', job.output_file,
+                                  type(err).__name__, err)
+
+    @defer.inlineCallbacks
+    def merge_shard_results(self, source, jobs):
+        """Merge the results of all shards of an archive into one archive.
+
+        Args:
+            source (str): The original archive that was sharded.
+            jobs (list): The job of each shard.
+
+        Returns:
+            str: The filepath of the merged results.
+        """
+        outputs = [j.output_file for j in jobs if j.output_file]
+        if len(outputs) != len(jobs):
+            self.logger.warning('Only %s of %s shards of %s have results.',
+                                len(outputs), len(jobs), source)
+        if not outputs:
+            defer.returnValue(None)
+
+        stem = os.path.splitext(os.path.basename(source))[0]
+        dest = os.path.join(self.output_dir, '{}_results.zip'.format(stem))
+        try:
+            yield threads.deferToThread(merge_results, outputs, dest)
+        except Exception as err:  # pylint: disable=broad-except
+            self.logger.error('Could not merge results of %s due to %s: %s',
+                              source, type(err).__name__, err)
+            defer.returnValue(None)
+
+        self.logger.info('Merged results of %s shards of %s into %s.',
+                         len(outputs), source, dest)
+        defer.returnValue(dest)
+
+    def _stitch_tiles(self, source, jobs):
+        from kiosk_client import tiling  # pylint: disable=C0415
+        width, height = tiling.get_image_size(source)
+        tiles = [(j.output_file, j.tile_box) for j in jobs]
+        labels = tiling.stitch_labels(tiles, width, height)
+
+        stem = os.path.splitext(os.path.basename(source))[0]
+        dest = os.path.join(self.output_dir, '{}_labels.tif'.format(stem))
+        return tiling.save_labels(labels, dest)
+
+    @defer.inlineCallbacks
+    def stitch_tile_results(self, source, jobs):
+        """Stitch the labels of all tiles of an image into one image.
+
+        Args:
+            source (str): The original image that was tiled.
+            jobs (list): The job of each tile.
+
+        Returns:
+            str: The filepath of the stitched labels.
+        """
+        missing = [j for j in jobs if not j.output_file]
+        if missing:
+            self.logger.error('Cannot stitch %s, %s of %s tiles have no '
+                              'downloaded results.', source, len(missing),
+                              len(jobs))
+            defer.returnValue(None)
+
+        try:
+            dest = yield threads.deferToThread(self._stitch_tiles,
+                                               source, jobs)
+        except Exception as err:  # pylint: disable=broad-except
+            self.logger.error('Could not stitch results of %s due to %s: %s',
+                              source, type(err).__name__, err)
+            defer.returnValue(None)
+
+        self.logger.info('Stitched results of %s tiles of %s into %s.',
+                         len(jobs), source, dest)
+        defer.returnValue(dest)
+
+    def _add_job_cost(self, result, job, features):
+        """Learn the time of the remaining jobs from the finished job."""
+        job = self.get_winner(job)
+        if job.status == 'done':
+            self.cost_estimator.add(features, job.total_time)
+        return result
+
+    @defer.inlineCallbacks
+    def submit(self, submission):
+        """Create a job for the submission and start it.
+
+        Returns:
+            tuple: The job, and a Deferred that fires once it is finished.
+        """
+        job = self.make_job(submission.filepath)
+        job.bundle_members = submission.bundle_members
+        if submission.tile is None:
+            job.shard_of = submission.source
+        else:
+            job.tile_of = submission.source
+            job.tile_box = submission.tile
+        self.all_jobs.append(job)
+
+        digest = submission.digest
+        if self.get_cached_result(job, digest):
+            finished = self.finish_job(job, digest)
+        else:
+            yield self.upload_job_file(job, digest)
+            # a failed job is restarted, finish it once it is expired
+            finished = self.when_finished(job)
+            self.track_job(job, defer.maybeDeferred(
+                job.start, delay=self.start_delay))
+            finished.addCallback(self.wait_for_winner, job)
+            finished.addCallback(self.check_reused_upload, job)
+            if self.job_order != 'discovery':
+                finished.addCallback(self._add_job_cost, job,
+                                     submission.features)
+            finished.addCallback(
+                lambda _, j=job, h=digest: self.finish_job(
+                    self.get_winner(j), h))
+        self.add_pending_task(finished)
+
+        if submission.bundle_members or submission.source:
+            # the file was created by the manager and is no longer needed
+            os.remove(submission.filepath)
+
+        defer.returnValue((job, finished))
 
-            job.start(delay=self.start_delay)
+    @defer.inlineCallbacks
+    def run(self, filepath):
+        self.logger.info('Benchmarking all image/zip files in `%s`', filepath)
+
+        yield self.resolve_host()
+        yield self.preflight()  # before the first job is created
+
+        # size all files before the first is submitted
+        # pylint: disable=import-outside-toplevel
+        from kiosk_client.scheduling import SubmissionQueue
+        submissions = yield threads.deferToThread(
+            SubmissionQueue, self.iter_submissions(filepath),
+            order=self.job_order, estimator=self.cost_estimator,
+            probe_dimensions=self.probe_dimensions)
+        is_hashed = (self.upload_index is not None or
+                     self.result_cache is not None)
+        if self.bundle_size or self.shard_size or self.tile_size or is_hashed:
+            # prepare files in the thread pool ahead of their upload
+            prepared = defer_map(self._prepare_submission, submissions,
+                                 self.hash_workers)
+        else:
+            prepared = (defer.succeed((p, [Submission(p[0])]))
+                        for p in submissions)
+
+        for d in prepared:
+            paths, group = yield d
+            if self.check_time_budget():
+                self.logger.warning('Skipping the remaining files in `%s`.',
+                                    filepath)
+                break
+
+            if not group:  # the files could not be prepared
+                continue
+
+            jobs, finished = [], []
+            for submission in group:
+                if self.job_order != 'discovery' and \
+                        submission.features is None:
+                    # the files were already sized when they were ordered
+                    submission = submission._replace(
+                        features=submissions.group_features(paths))
+                job, done = yield self.submit(submission)
+                jobs.append(job)
+                finished.append(done)
+
+            source = group[0].source
+            if source is not None:
+                if group[0].tile is not None:
+                    merge = self.stitch_tile_results
+                else:
+                    merge = self.merge_shard_results
+                d = defer.DeferredList(finished)
+                d.addCallback(lambda _, f=merge, s=source, j=jobs: f(
+                    s, [self.get_winner(x) for x in j]))
+                self.add_pending_task(d)
 
         yield self.check_job_status()
@@ -28,17 +28,22 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import json
 import os
 import random
+import timeit
+import zipfile
 
 from PIL import Image
 from twisted.internet import defer
 
 import pytest
 import pytest_twisted
-import requests
+import treq
 
+from kiosk_client import columnar
 from kiosk_client import manager
+from kiosk_client import scheduling
 from kiosk_client import settings
 
 
@@ -48,14 +53,17 @@ class Bunch(object):
 
 
 def dummy_ssl_redirect(url, **__):
-    return Bunch(url=url.replace('http://', 'https://'))
+    url = url.replace('http://', 'https://') + '/'
+    return defer.succeed(Bunch(
+        request=Bunch(absoluteURI=url.encode()),
+        content=lambda: defer.succeed(b'')))
 
 
 class TestJobManager(object):
 
     @pytest.fixture(autouse=True)
     def monkeypatch(self, monkeypatch):
-        monkeypatch.setattr(requests, 'get', dummy_ssl_redirect)
+        monkeypatch.setattr(treq, 'get', dummy_ssl_redirect)
 
     def test_init(self, mocker):
         mgr = manager.JobManager(
@@ -104,6 +112,13 @@ class TestJobManager(object):
                 data_scale='1',
                 data_label='1',
                 output_dir='not_a_directory')
+        # test bad tile_overlap value
+        with pytest.raises(ValueError):
+            mgr = manager.JobManager(
+                job_type='job',
+                host='localhost',
+                tile_size=64,
+                tile_overlap=64)
         # output_dir should be writable
         mocker.patch('os.access', return_value=False)
         with pytest.raises(ValueError):
@@ -114,21 +129,250 @@ class TestJobManager(object):
                 data_scale='1',
                 data_label='1')
 
-    def test__get_host(self, mocker):
+    def test__get_host(self):
         host = 'example.com'
         mgr = manager.JobManager(job_type='job', host=host)
 
-        assert mgr._get_host(host) == 'https://%s' % host
+        assert mgr._get_host(host) == 'http://%s' % host
+
+        host = 'HTTPS://example.com'
+        assert mgr._get_host(host) == host.lower()
+
+    @pytest_twisted.inlineCallbacks
+    def test_resolve_host(self, mocker):
+        mgr = manager.JobManager(job_type='job', host='example.com')
+        assert mgr.host == 'http://example.com'  # not resolved yet
 
-        host = 'http://example.com'
-        assert mgr._get_host(host) == host.replace('http://', 'https://', 1)
+        host = yield mgr.resolve_host()
+        assert host == mgr.host == 'https://example.com'
 
         def fail(*_, **__):
-            raise ValueError('on purpose')
+            return defer.fail(ValueError('on purpose'))
 
-        mocker.patch('requests.get', fail)
+        mocker.patch('treq.get', fail)
         with pytest.raises(RuntimeError):
-            mgr._get_host(host)
+            yield mgr.resolve_host()
+
+    @pytest_twisted.inlineCallbacks
+    def test_preflight(self, mocker):
+        mgr = manager.JobManager(job_type='job', host='example.com')
+        data = yield mgr.preflight()
+        assert data == mgr.preflight_data == {}  # disabled by default
+
+        mgr = manager.JobManager(job_type='job', host='example.com:8080',
+                                 preflight_connections=1000,
+                                 preflight_probes=3)
+        resolved = []
+
+        def dummy_resolve(resolver, hostname, port=0):
+            resolved.append((hostname, port))
+            return defer.succeed([Bunch(host='10.0.0.1')] * 2)
+
+        def dummy_post(url, **kwargs):
+            assert url == 'http://example.com:8080/api/redis'
+            assert kwargs['pool'] is mgr.pool
+            return defer.succeed(Bunch(content=lambda: defer.succeed(b'')))
+
+        install = mocker.patch('kiosk_client.preflight.'
+                               'install_caching_resolver')
+        mocker.patch('kiosk_client.preflight.resolve', dummy_resolve)
+        mocker.patch('kiosk_client.preflight.time_connect',
+                     lambda *_: defer.succeed(0.01))
+        mocker.patch('treq.post', dummy_post)
+        get = mocker.patch('treq.get', side_effect=dummy_ssl_redirect)
+
+        data = yield mgr.preflight()
+        assert install.called
+        assert resolved == [('example.com', 8080)]
+        assert list(data) == [mgr.host]
+        data = data[mgr.host]
+        assert data['addresses'] == ['10.0.0.1']
+        assert data['rtt']['count'] == 3
+        assert data['rtt']['p50'] == 0.01
+        assert data['api_latency']['count'] == 3
+        # no more connections are opened than the pool will keep
+        assert data['connections'] == mgr.pool.maxPersistentPerHost
+        assert get.call_count == mgr.pool.maxPersistentPerHost
+        # the API latency is the first latency of the host
+        assert mgr.balancer.backends[0].requests == 3
+
+        # failed probes are logged, not raised
+        mocker.patch('kiosk_client.preflight.time_connect',
+                     lambda *_: defer.fail(ValueError('on purpose')))
+        data = yield mgr.preflight()
+        data = data[mgr.host]
+        assert data['rtt'] == {'count': 0}
+        assert data['connections'] == 0
+
+    @pytest_twisted.inlineCallbacks
+    def test_multiple_hosts(self, tmpdir, mocker):
+        mgr = manager.JobManager(job_type='job', host='a.com, B.com',
+                                 load_balancing='least-outstanding',
+                                 output_dir=str(tmpdir))
+        hosts = ['http://a.com', 'http://b.com']
+        assert [b.host for b in mgr.balancer] == hosts
+        assert mgr.host == hosts[0]
+        # each host has its own pool
+        assert mgr.balancer.backends[0].pool is not \
+            mgr.balancer.backends[1].pool
+
+        resolved = yield mgr.resolve_host()
+        hosts = ['https://a.com', 'https://b.com']
+        assert resolved == hosts[0]
+        assert [b.host for b in mgr.balancer] == hosts
+
+        # jobs use the host and pool they were created with
+        jobs = [mgr.make_job('test.png') for _ in range(3)]
+        assert [j.host for j in jobs] == [hosts[0], hosts[1], hosts[0]]
+        for j in jobs:
+            assert j.pool is mgr.balancer.get(j.host).pool
+
+        # started jobs are outstanding until they finish
+        running = [defer.Deferred() for _ in jobs]
+        for j, d in zip(jobs, running):
+            mgr.track_job(j, d)
+        assert [b.outstanding for b in mgr.balancer] == [2, 1]
+        assert mgr.make_job('test.png').host == hosts[1]
+
+        jobs[0].status = 'done'
+        jobs[0].is_expired = True
+        running[0].callback(True)
+        assert [b.outstanding for b in mgr.balancer] == [1, 1]
+
+        jobs[1].on_response(0.5)
+        mgr.all_jobs = jobs
+        yield mgr.summarize()
+        outputs = [f for f in os.listdir(str(tmpdir)) if f.endswith('.json')]
+        with open(os.path.join(str(tmpdir), outputs[0])) as f:
+            output = json.load(f)
+        assert output['load_balancing'] == 'least-outstanding'
+        assert [h['host'] for h in output['hosts']] == hosts
+        assert output['hosts'][0]['completed'] == 1
+        assert output['hosts'][0]['statuses'] == {'done': 1}
+        assert output['hosts'][1]['latency'] == 0.5
+        assert [j['host'] for j in output['job_data']] == \
+            [hosts[0], hosts[1], hosts[0]]
+
+        with pytest.raises(ValueError):
+            manager.JobManager(job_type='job', host='a.com',
+                               load_balancing='random')
+
+    @pytest_twisted.inlineCallbacks
+    def test_hedge_stragglers(self, tmpdir):
+        mgr = manager.JobManager(host='localhost', job_type='job',
+                                 hedge_percentile=90, hedge_min_samples=10,
+                                 max_hedges=2, output_dir=str(tmpdir))
+        started = {}
+
+        def make_job(filepath, **kwargs):
+            j = manager.JobManager.make_job(mgr, filepath, **kwargs)
+            started[j] = defer.Deferred()
+            j.start = lambda *_, **__: started[j]
+            return j
+
+        mgr.make_job = make_job
+
+        jobs = [mgr.make_job('test%s.png' % i) for i in range(4)]
+        for i, j in enumerate(jobs):
+            j.job_id = 'job%s' % i
+            j.started_at = 0
+            j._set_status('predict')
+        mgr.all_jobs = list(jobs)
+        assert mgr.hedge_stragglers() == []  # no durations yet
+
+        for _ in range(10):
+            mgr.stragglers.add('predict', 1)
+        for j in jobs[:3]:
+            j.status_changed_at -= 100  # straggling
+
+        hedges = mgr.hedge_stragglers()
+        assert [h.hedge_of for h in hedges] == ['job0', 'job1']
+        assert [h.original_name for h in hedges] == ['test0.png', 'test1.png']
+        assert len(mgr.all_jobs) == 6
+        assert mgr.hedge_stragglers() == []  # max_hedges
+
+        # the duplicate of job0 finishes first
+        hedges[0]._set_status('done')
+        assert jobs[0].cancelled
+        assert mgr.get_winner(jobs[0]) is hedges[0]
+        waiting = mgr.wait_for_winner(None, jobs[0])
+        assert not waiting.called
+        started[hedges[0]].callback(1)
+        assert not waiting.called  # not yet expired
+        hedges[0].is_expired = True
+        mgr.track_job(hedges[0], defer.succeed(True))
+        assert waiting.called
+
+        # job1 finishes before its duplicate
+        jobs[1]._set_status('done')
+        assert hedges[1].cancelled
+        assert mgr.get_winner(jobs[1]) is jobs[1]
+        assert mgr.wait_for_winner(True, jobs[1]) is True
+        started[hedges[1]].callback(1)
+
+        jobs[3]._set_status('done')
+        jobs[0]._set_status('done')  # already cancelled, ignored
+
+        yield mgr.summarize()
+        outputs = [f for f in os.listdir(str(tmpdir)) if f.endswith('.json')]
+        with open(os.path.join(str(tmpdir), outputs[0])) as f:
+            hedging = json.load(f)['hedging']
+        assert hedging['hedges'] == 2
+        assert hedging['hedge_wins'] == 1
+        assert hedging['original_wins'] == 1
+        assert hedging['unestimated_wins'] == 1
+        assert hedging['latency']['count'] == 3
+        assert hedging['hedged_latency']['count'] == 2
+        assert hedging['percentile'] == 90
+        # the durations of finished statuses are recorded
+        assert len(mgr.stragglers.durations['predict']) == 13
+
+    def test_hedge_failures(self, tmpdir):
+        mgr = manager.JobManager(host='localhost,otherhost', job_type='job',
+                                 hedge_percentile=90, hedge_min_samples=10,
+                                 output_dir=str(tmpdir))
+        jobs = [mgr.make_job('test%s.png' % i) for i in range(2)]
+        for i, j in enumerate(jobs):
+            j.job_id = 'job%s' % i
+            j.started_at = 0
+            j._set_status('predict')
+            j.status_changed_at -= 100  # straggling
+        mgr.all_jobs = list(jobs)
+        for _ in range(10):
+            mgr.stragglers.add('predict', 1)
+
+        def make_job(filepath, **kwargs):
+            j = manager.JobManager.make_job(mgr, filepath, **kwargs)
+            j.start = lambda *_, **__: defer.Deferred()
+            return j
+
+        mgr.make_job = make_job
+
+        # duplicates run on the host the file was uploaded to
+        hedges = mgr.hedge_stragglers()
+        assert len(hedges) == 2
+        for j, h in zip(jobs, hedges):
+            assert h.host == j.host
+            assert h.pool is j.pool
+
+        # a failed duplicate is discarded, the original keeps running
+        hedges[0]._set_status('failed')
+        assert not jobs[0].cancelled
+        jobs[0]._set_status('done')
+        assert mgr.get_winner(jobs[0]) is jobs[0]
+        assert mgr.hedge_summary['original_wins'] == 1
+
+        # a failed original waits on its duplicate
+        jobs[1]._set_status('failed')
+        assert not hedges[1].cancelled
+        assert mgr.get_winner(jobs[1]) is hedges[1]
+        waiting = mgr.wait_for_winner(None, jobs[1])
+        hedges[1]._set_status('done')
+        assert mgr.hedge_summary['hedge_wins'] == 1
+        assert not waiting.called
+        hedges[1].is_expired = True
+        mgr.track_job(hedges[1], defer.succeed(True))
+        assert waiting.called
 
     def test_make_job(self):
         mgr = manager.JobManager(
@@ -184,6 +428,43 @@ class TestJobManager(object):
         j1.expire = lambda: None
         assert mgr.get_completed_job_count() == 0
 
+    @pytest_twisted.inlineCallbacks
+    def test_job_store(self, tmpdir):
+        tmpdir = str(tmpdir)
+        mgr = manager.JobManager(host='localhost', job_type='job',
+                                 job_store=os.path.join(tmpdir, 'jobs.jsonl'),
+                                 output_dir=tmpdir)
+
+        jobs = [mgr.make_job('test%s.png' % i) for i in range(3)]
+        mgr.all_jobs = list(jobs)
+        for j in jobs:
+            j.status = 'done'
+        jobs[0].is_expired = True
+        jobs[1].is_expired = True
+        jobs[1].failed = True  # will be restarted
+        jobs[1].restart = lambda delay: None
+
+        # finished jobs are moved to the job store
+        assert mgr.get_completed_job_count() == 2
+        assert mgr.all_jobs == jobs[1:]
+        assert mgr.num_jobs == 3
+        assert mgr.get_cost_per_job(3) == 1
+        assert [r['input_file'] for r in mgr.job_store] == ['test0.png']
+
+        jobs[1].failed = False
+        jobs[2].is_expired = True
+        assert mgr.get_completed_job_count() == 3
+        assert mgr.all_jobs == []
+
+        yield mgr.summarize()
+        outputs = [f for f in os.listdir(tmpdir) if f.endswith('.json')]
+        with open(os.path.join(tmpdir, outputs[0])) as f:
+            output = json.load(f)
+        assert output['num_jobs'] == 3
+        assert [j['input_file'] for j in output['job_data']] == [
+            'test0.png', 'test1.png', 'test2.png']
+
+    @pytest_twisted.inlineCallbacks
     def test_summarize(self, tmpdir):
         # pylint: disable=unused-argument
         def fake_upload_file(filepath, hash_filename, prefix):
@@ -204,18 +485,222 @@ class TestJobManager(object):
                                  output_dir=str(tmpdir))
 
         fakejson = lambda: {'output_url': 'example.com/json.txt'}
-        mgr.all_jobs = [Bunch(output_url='example.com/a.txt', json=fakejson),
-                        Bunch(output_url='example.com/b.txt', json=fakejson)]
+        mgr.all_jobs = [Bunch(output_url='example.com/a.txt', json=fakejson,
+                              status='done'),
+                        Bunch(output_url='example.com/b.txt', json=fakejson,
+                              status='done')]
 
         # monkey-patches for testing
         mgr.cost_getter.finish = lambda: (1, 2, 3)
+        mgr.cost_getter.get_utilization = lambda: {
+            'gpu_utilization': 0.5, 'idle_gpu_hours': 1, 'gpu_hours': 2}
         mgr.upload_file = fake_upload_file
-        mgr.summarize()
+        yield mgr.summarize()
 
         # test Exceptions
         mgr.cost_getter.finish = lambda: 0 / 1
         mgr.upload_file = fake_upload_file_bad
-        mgr.summarize()
+        yield mgr.summarize()
+
+        # write columnar output
+        mgr = manager.JobManager(host='localhost', job_type='job',
+                                 output_format='npz',
+                                 output_dir=str(tmpdir))
+        fakejson = lambda: {'status': 'done', 'total_time': 1.5}
+        mgr.all_jobs = [Bunch(json=fakejson, status='done')] * 3
+        yield mgr.summarize()
+        outputs = [f for f in os.listdir(str(tmpdir)) if f.endswith('.npz')]
+        assert len(outputs) == 1
+        summary, columns = columnar.load_columns(
+            os.path.join(str(tmpdir), outputs[0]))
+        assert summary['num_jobs'] == 3
+        assert columns['total_time'].tolist() == [1.5] * 3
+
+        with pytest.raises(ValueError):
+            manager.JobManager(host='localhost', job_type='job',
+                               output_format='csv')
+
+    @pytest_twisted.inlineCallbacks
+    def test_update_running_costs(self, tmpdir):
+        mgr = manager.JobManager(host='localhost', job_type='job',
+                                 calculate_cost=True,
+                                 cost_update_interval=60,
+                                 output_dir=str(tmpdir))
+        mgr.all_jobs = [Bunch(status='done'), Bunch(status='failed'),
+                        Bunch(status='done')]
+
+        updates = []
+        costs = {'node_cost': 3.0, 'cost_per_hour': 1.5,
+                 'cpu_node_cost': 1.0, 'gpu_node_cost': 2.0}
+
+        def fake_update():
+            updates.append(1)
+            return defer.succeed(dict(costs))
+
+        mgr.cost_getter.update = fake_update
+
+        # not enough time has passed since the manager was created
+        assert mgr.update_running_costs() is None
+        assert not updates
+
+        mgr._cost_updated_at -= 60
+        result = yield mgr.update_running_costs()
+        assert len(updates) == 1
+        assert result['cost_per_job'] == 1.5
+        assert mgr.running_costs == result
+
+        # errors are logged, not raised
+        mgr._cost_updated_at -= 60
+        mgr.cost_getter.update = lambda: 1 / 0
+        yield mgr.update_running_costs()
+        assert mgr.running_costs == result
+
+    @pytest_twisted.inlineCallbacks
+    def test_upload_job_file(self, tmpdir):
+        tmpdir = str(tmpdir)
+        mgr = manager.JobManager(
+            host='localhost',
+            job_type='job',
+            upload_index=os.path.join(tmpdir, 'index.json'),
+            output_dir=tmpdir)
+
+        filepath = os.path.join(tmpdir, 'image.png')
+        img = Image.new('RGB', (80, 128), (255, 255, 255))
+        img.save(filepath, 'PNG')
+
+        global _upload_count
+        _upload_count = 0
+
+        def upload_file():
+            global _upload_count
+            _upload_count += 1
+            return 'uploads/hashed.png'
+
+        j = mgr.make_job(filepath)
+        j.upload_file = upload_file
+        uploaded_path = yield mgr.upload_job_file(j, 'digest')
+        assert uploaded_path == 'uploads/hashed.png'
+        assert j.filepath == 'hashed.png'
+        assert _upload_count == 1
+
+        # the same content should not be uploaded again
+        j = mgr.make_job(filepath)
+        j.upload_file = upload_file
+        uploaded_path = yield mgr.upload_job_file(j, 'digest')
+        assert uploaded_path == 'uploads/hashed.png'
+        assert j.filepath == 'hashed.png'
+        assert _upload_count == 1
+        assert mgr.upload_index.summary()['hits'] == 1
+
+        # the same content is uploaded again to another cluster
+        j = mgr.make_job(filepath)
+        j.host = 'http://other.example.com'
+        j.upload_file = upload_file
+        uploaded_path = yield mgr.upload_job_file(j, 'digest')
+        assert _upload_count == 2
+
+        # no digest, always upload
+        j = mgr.make_job(filepath)
+        j.upload_file = upload_file
+        uploaded_path = yield mgr.upload_job_file(j)
+        assert _upload_count == 3
+
+        # a failed job of a reused upload is uploaded again, its upload
+        # may have been deleted
+        j = mgr.make_job(filepath)
+        j.upload_file = upload_file
+        yield mgr.upload_job_file(j, 'digest')
+        assert _upload_count == 3
+        j.status = 'done'
+        assert mgr.check_reused_upload(True, j) is True
+        assert len(mgr.upload_index) == 2
+
+        j = mgr.make_job(filepath)
+        j.upload_file = upload_file
+        yield mgr.upload_job_file(j, 'digest')
+        assert _upload_count == 3
+        j.status = 'failed'
+        mgr.check_reused_upload(None, j)
+        assert len(mgr.upload_index) == 1
+        j = mgr.make_job(filepath)
+        j.upload_file = upload_file
+        yield mgr.upload_job_file(j, 'digest')
+        assert _upload_count == 4
+
+    @pytest_twisted.inlineCallbacks
+    def test_upload_file(self, tmpdir, mocker):
+        tmpdir = str(tmpdir)
+        mgr = manager.JobManager(
+            host='localhost',
+            job_type='job',
+            storage_bucket='bucket',
+            upload_index=os.path.join(tmpdir, 'index.json'),
+            output_dir=tmpdir)
+
+        filepath = os.path.join(tmpdir, 'image.png')
+        with open(filepath, 'wb') as f:
+            f.write(b'content')
+
+        client = mocker.patch('google.cloud.storage.Client')
+        blob = client.return_value.get_bucket.return_value.blob
+        hash_thread = mocker.spy(manager.threads, 'deferToThread')
+
+        dest = yield mgr.upload_file(filepath)
+        assert dest.endswith('.png')
+        assert blob.call_count == 1
+        assert hash_thread.call_count == 1  # not hashed on the reactor
+
+        # the same content is not uploaded again to the same prefix
+        cached = yield mgr.upload_file(filepath)
+        assert cached == dest
+        assert blob.call_count == 1
+
+        # but is uploaded to another prefix
+        other = yield mgr.upload_file(filepath, prefix='other')
+        assert other != dest
+        assert blob.call_count == 2
+
+    def test_get_cached_result(self, tmpdir):
+        tmpdir = str(tmpdir)
+        output_dir = os.path.join(tmpdir, 'output')
+        os.makedirs(output_dir)
+        mgr = manager.JobManager(
+            host='localhost',
+            job_type='job',
+            model='m:0',
+            result_cache=os.path.join(tmpdir, 'cache'),
+            output_dir=output_dir)
+
+        j = mgr.make_job('test.png')
+        assert not mgr.get_cached_result(j, None)
+        assert not mgr.get_cached_result(j, 'digest')
+
+        # unfinished jobs are not cached
+        mgr.cache_result(j, 'digest')
+        assert not mgr.get_cached_result(j, 'digest')
+
+        downloaded = os.path.join(tmpdir, 'results.zip')
+        with open(downloaded, 'w') as f:
+            f.write('results')
+
+        j.status = 'done'
+        j.output_url = 'example.com/results.zip'
+        j.created_at = 'created'
+        j.finished_at = 'finished'
+        j.output_file = downloaded
+        mgr.cache_result(j, 'digest')
+
+        j = mgr.make_job('test.png')
+        assert mgr.get_cached_result(j, 'digest')
+        assert j.cache_hit
+        assert j.json()['cache_hit']
+        assert j.is_summarized and j.is_expired
+        assert j.output_url == 'example.com/results.zip'
+        assert os.path.isfile(os.path.join(output_dir, 'results.zip'))
+
+        # different job parameters are not a cache hit
+        mgr.model_version = 1
+        assert not mgr.get_cached_result(mgr.make_job('test.png'), 'digest')
 
     @pytest_twisted.inlineCallbacks
     def test_check_job_status(self):
@@ -246,10 +731,12 @@ class TestJobManager(object):
         mgr.get_completed_job_count = get_completed_job_count
         mgr._stop = dummy_stop
         mgr.summarize = lambda: True
+        tmp_dir = mgr.tmp_dir
 
         _ = yield mgr.check_job_status()
         assert _status_counter == len(mgr.all_jobs)
         assert _is_stopped
+        assert not os.path.exists(tmp_dir)  # removed once finished
 
 
 class TestBenchmarkingJobManager(object):
@@ -257,7 +744,7 @@ class TestBenchmarkingJobManager(object):
     @pytest_twisted.inlineCallbacks
     def test_run(self, tmpdir, mocker):
         tmpdir = str(tmpdir)
-        mocker.patch('requests.get', dummy_ssl_redirect)
+        mocker.patch('treq.get', dummy_ssl_redirect)
         mgr = manager.BenchmarkingJobManager(host='localhost', job_type='job')
 
         # pylint: disable=unused-argument
@@ -290,13 +777,112 @@ class TestBenchmarkingJobManager(object):
 
         yield mgr.run(valid_image, count=2, upload=False)
 
+    @pytest_twisted.inlineCallbacks
+    def test_time_budget(self, tmpdir):
+        mgr = manager.BenchmarkingJobManager(host='localhost', job_type='job',
+                                             start_delay=0.01,
+                                             time_budget=0.05,
+                                             drain_timeout=0.01,
+                                             job_timeout=3600,
+                                             update_interval=0,
+                                             refresh_rate=0.01,
+                                             output_dir=str(tmpdir))
+
+        def make_job(filepath):
+            j = manager.JobManager.make_job(mgr, filepath)
+            j.started_at = timeit.default_timer()
+            j.deadline = j.started_at + j.timeout
+            j.start = lambda *_, **__: defer.Deferred()  # never finishes
+            return j
+
+        mgr.make_job = make_job
+        mgr._stop = lambda: None
+
+        status = mgr.check_job_status()
+        yield mgr.schedule_jobs('image.png', count=1000)
+        assert mgr.drain_deadline is not None
+        assert 0 < len(mgr.all_jobs) < 1000
+        assert all(j.deadline == mgr.drain_deadline for j in mgr.all_jobs)
+        assert mgr.hedge_stragglers() == []
+
+        # the summary is written even though no job finished
+        yield status
+        assert mgr.is_drained
+        assert mgr.abandoned_jobs == len(mgr.all_jobs)
+        output_files = os.listdir(str(tmpdir))
+        assert len(output_files) == 1
+        with open(os.path.join(str(tmpdir), output_files[0])) as f:
+            summary = json.load(f)
+        assert summary['time_budget']['exhausted']
+        assert summary['time_budget']['abandoned'] == len(mgr.all_jobs)
+        assert summary['time_budget']['timed_out'] == 0
+
+    @pytest_twisted.inlineCallbacks
+    def test_schedule_jobs(self, tmpdir, mocker):
+        mocker.patch('treq.get', dummy_ssl_redirect)
+        mgr = manager.BenchmarkingJobManager(host='localhost', job_type='job',
+                                             start_delay=0,
+                                             max_active_jobs=2,
+                                             output_dir=str(tmpdir))
+        started = []
+
+        # pylint: disable=unused-argument
+        def dummy_start(delay, upload=False):
+            started.append(defer.Deferred())
+            return started[-1]
+
+        def make_job(filepath):
+            return Bunch(filepath=filepath, host=mgr.host, start=dummy_start,
+                         status=None, is_expired=False)
+
+        mgr.make_job = make_job
+
+        d = mgr.schedule_jobs('image.png', count=5)
+        yield manager.sleep(0.01)
+
+        # jobs are only created once there is room for them
+        assert mgr.is_scheduling
+        assert len(mgr.all_jobs) == len(started) == 2
+        mgr.all_jobs[0].is_expired = True
+        started[0].callback(True)
+        started[1].callback(False)  # failed, so not finished
+        yield manager.sleep(0.01)
+        assert len(mgr.all_jobs) == 3
+
+        # the failed job is only released once its restart is finished
+        failed = mgr.all_jobs[1]
+        failed.is_expired = True
+        yield mgr.track_job(failed, defer.succeed(True))
+        yield manager.sleep(0.01)
+        assert len(mgr.all_jobs) == 4
+
+        for i in range(2, 5):
+            mgr.all_jobs[i].is_expired = True
+            started[i].callback(True)
+            yield manager.sleep(0.01)
+        yield d
+        assert len(mgr.all_jobs) == 5
+        assert not mgr.is_scheduling
+
+        # the status check waits for all scheduled jobs
+        mgr.is_scheduling = True
+        mgr.get_completed_job_count = lambda: len(mgr.all_jobs)
+        mgr.summarize = lambda: None
+        mgr._stop = lambda: None
+        mgr.refresh_rate = 0
+        status = mgr.check_job_status()
+        yield manager.sleep(0.01)
+        assert not status.called
+        mgr.is_scheduling = False
+        yield status
+
 
 class TestBatchProcessingJobManager(object):
 
     @pytest_twisted.inlineCallbacks
     def test_run(self, tmpdir, mocker):
         tmpdir = str(tmpdir)
-        mocker.patch('requests.get', dummy_ssl_redirect)
+        mocker.patch('treq.get', dummy_ssl_redirect)
         mgr = manager.BatchProcessingJobManager(
             host='localhost',
             job_type='job')
@@ -333,3 +919,312 @@ class TestBatchProcessingJobManager(object):
             valid_images.append(valid_image)
 
         yield mgr.run(tmpdir)
+        assert len(mgr.all_jobs) == num
+
+        # hash all files in the thread pool and check the upload index
+        mgr = manager.BatchProcessingJobManager(
+            host='localhost',
+            job_type='job',
+            upload_index=os.path.join(tmpdir, 'index.json'))
+        mgr.check_job_status = lambda: True
+        mgr.make_job = make_job
+
+        yield mgr.run(tmpdir)
+        assert len(mgr.all_jobs) == num
+        # all images are identical, only the first is uploaded
+        assert mgr.upload_index.summary()['misses'] == 1
+        assert mgr.upload_index.summary()['hits'] == num - 1
+
+        # bundle all images into a single zip archive
+        mgr = manager.BatchProcessingJobManager(
+            host='localhost',
+            job_type='job',
+            bundle_size=10 ** 9)
+        mgr.check_job_status = lambda: True
+        mgr.make_job = make_job
+
+        yield mgr.run(tmpdir)
+        assert len(mgr.all_jobs) == 1
+        if num > 1:  # a single image is not bundled
+            bundle = mgr.all_jobs[0]
+            assert sorted(bundle.bundle_members.values()) == valid_images
+            assert bundle.json()['bundled_files'] == valid_images
+            assert not os.path.exists(bundle.filepath)  # cleaned up
+
+    @pytest_twisted.inlineCallbacks
+    def test_run_restarted_bundle(self, tmpdir, mocker):
+        tmpdir = str(tmpdir)
+        mocker.patch('treq.get', dummy_ssl_redirect)
+        output_dir = os.path.join(tmpdir, 'output')
+        os.makedirs(output_dir)
+        mgr = manager.BatchProcessingJobManager(
+            host='localhost',
+            job_type='job',
+            bundle_size=10 ** 9,
+            output_dir=output_dir)
+
+        data_dir = os.path.join(tmpdir, 'data')
+        os.makedirs(data_dir)
+        for i in range(2):
+            img = Image.new('L', (10, 10))
+            img.save(os.path.join(data_dir, 'image%s.png' % i))
+
+        def make_job(filepath):
+            j = manager.JobManager.make_job(mgr, filepath)
+            attempts = []
+
+            def dummy_start(delay=0):
+                attempts.append(delay)
+                if len(attempts) == 1:  # the first attempt fails
+                    j.failed = True
+                    return False
+                # simulate downloading the results of the bundle
+                j.output_file = os.path.join(tmpdir, 'results.zip')
+                with zipfile.ZipFile(j.output_file, 'w') as zf:
+                    for name in j.bundle_members:
+                        stem = os.path.splitext(name)[0]
+                        zf.writestr(stem + '_feature_0.tif', 'result')
+                j.is_expired = True
+                return True
+
+            j.start = dummy_start
+            j.upload_file = lambda: j.filepath
+            return j
+
+        mgr.check_job_status = lambda: True
+        mgr.make_job = make_job
+
+        yield mgr.run(data_dir)
+        assert len(mgr.all_jobs) == 1
+        bundle = mgr.all_jobs[0]
+        assert bundle.failed
+        # the failed bundle is not finished until it is restarted
+        assert not os.listdir(output_dir)
+
+        expired = mgr.get_completed_job_count()
+        assert expired == 0  # counted before restarting
+        yield defer.DeferredList(list(mgr.pending_tasks))
+        assert bundle.is_expired
+        assert sorted(os.listdir(output_dir)) == [
+            'image0_feature_0.tif', 'image1_feature_0.tif']
+
+    @pytest_twisted.inlineCallbacks
+    def test_run_job_order(self, tmpdir, mocker):
+        tmpdir = str(tmpdir)
+        mocker.patch('treq.get', dummy_ssl_redirect)
+        mgr = manager.BatchProcessingJobManager(
+            host='localhost',
+            job_type='job',
+            job_order='largest-first',
+            output_dir=tmpdir)
+
+        data_dir = os.path.join(tmpdir, 'data')
+        os.makedirs(data_dir)
+        for i, size in enumerate([100, 400, 200]):
+            img = Image.new('L', (size, size))
+            img.save(os.path.join(data_dir, 'image%s.png' % i))
+
+        def make_job(filepath):
+            j = manager.JobManager.make_job(mgr, filepath)
+
+            def dummy_start(delay):
+                j.status = 'done'
+                j.total_time = str(os.path.getsize(filepath))
+                j.is_expired = True
+                return True
+
+            j.start = dummy_start
+            j.upload_file = lambda: j.filepath
+            return j
+
+        mgr.check_job_status = lambda: True
+        mgr.make_job = make_job
+        # the files are only sized once, in the thread pool when ordered
+        get_features = mocker.patch('kiosk_client.scheduling.get_features',
+                                    wraps=scheduling.get_features)
+
+        yield mgr.run(data_dir)
+        submitted = [os.path.basename(j.filepath) for j in mgr.all_jobs]
+        assert submitted == ['image1.png', 'image2.png', 'image0.png']
+        assert get_features.call_count == 3
+        # the finished jobs are used to estimate the time of later jobs
+        assert len(mgr.cost_estimator) == 3
+
+    @pytest_twisted.inlineCallbacks
+    def test_run_shards(self, tmpdir, mocker):
+        tmpdir = str(tmpdir)
+        mocker.patch('treq.get', dummy_ssl_redirect)
+        output_dir = os.path.join(tmpdir, 'output')
+        os.makedirs(output_dir)
+        mgr = manager.BatchProcessingJobManager(
+            host='localhost',
+            job_type='job',
+            shard_size=1,
+            num_shards=3,
+            output_dir=output_dir)
+
+        zippath = os.path.join(tmpdir, 'data', 'large.zip')
+        os.makedirs(os.path.dirname(zippath))
+        with zipfile.ZipFile(zippath, 'w') as zf:
+            for i in range(5):
+                zf.writestr('image%s.png' % i, 'image')
+
+        def make_job(filepath):
+            j = manager.JobManager.make_job(mgr, filepath)
+            fail_once = [not mgr.all_jobs]  # only the first shard fails
+
+            def dummy_start(delay=0):
+                if fail_once[0]:
+                    fail_once[0] = False
+                    j.failed = True
+                    return False
+                # simulate downloading the results of the shard
+                j.output_file = os.path.join(
+                    tmpdir, os.path.basename(filepath))
+                with zipfile.ZipFile(j.output_file, 'w') as zf:
+                    zf.writestr(os.path.basename(filepath), 'result')
+                j.is_expired = True
+                return True
+
+            j.start = dummy_start
+            j.upload_file = lambda: j.filepath
+            return j
+
+        mgr.check_job_status = lambda: True
+        mgr.make_job = make_job
+
+        yield mgr.run(zippath)
+        merged = os.path.join(output_dir, 'large_results.zip')
+        assert not os.path.exists(merged)  # waiting on the failed shard
+
+        mgr.get_completed_job_count()  # restarts the failed shard
+        yield defer.DeferredList(list(mgr.pending_tasks))
+        assert not mgr.pending_tasks
+        assert len(mgr.all_jobs) == 3
+        assert all(j.shard_of == zippath for j in mgr.all_jobs)
+        assert all(j.json()['shard_of'] == zippath for j in mgr.all_jobs)
+
+        with zipfile.ZipFile(merged, 'r') as zf:
+            assert len(zf.namelist()) == 3
+
+    @pytest_twisted.inlineCallbacks
+    def test_run_tiles(self, tmpdir, mocker):
+        tmpdir = str(tmpdir)
+        mocker.patch('treq.get', dummy_ssl_redirect)
+        output_dir = os.path.join(tmpdir, 'output')
+        os.makedirs(output_dir)
+        mgr = manager.BatchProcessingJobManager(
+            host='localhost',
+            job_type='job',
+            tile_size=64,
+            tile_overlap=16,
+            output_dir=output_dir)
+
+        image = os.path.join(tmpdir, 'data', 'large.png')
+        os.makedirs(os.path.dirname(image))
+        img = Image.new('L', (100, 70), 255)
+        img.save(image, 'PNG')
+
+        def make_job(filepath):
+            j = manager.JobManager.make_job(mgr, filepath)
+            fail_once = [not mgr.all_jobs]  # only the first tile fails
+
+            def dummy_start(delay=0):
+                if fail_once[0]:
+                    fail_once[0] = False
+                    j.failed = True
+                    return False
+                # simulate downloading a label image of the tile
+                left, upper, right, lower = j.tile_box
+                labels = Image.new('I', (right - left, lower - upper), 1)
+                j.output_file = os.path.join(
+                    tmpdir, os.path.basename(filepath))
+                labels.save(j.output_file, format='TIFF')
+                j.is_expired = True
+                return True
+
+            j.start = dummy_start
+            j.upload_file = lambda: j.filepath
+            return j
+
+        mgr.check_job_status = lambda: True
+        mgr.make_job = make_job
+
+        yield mgr.run(image)
+        stitched = os.path.join(output_dir, 'large_labels.tif')
+        assert not os.path.exists(stitched)  # waiting on the failed tile
+
+        mgr.get_completed_job_count()  # restarts the failed tile
+        yield defer.DeferredList(list(mgr.pending_tasks))
+        assert len(mgr.all_jobs) == 4
+        assert all(j.tile_of == image for j in mgr.all_jobs)
+        assert all(j.json()['tile_box'] for j in mgr.all_jobs)
+
+        with Image.open(stitched) as im:
+            assert im.size == (100, 70)
+            assert im.getextrema() == (1, 1)  # a single object
+
+        # tiles cannot be stitched without results
+        j = mgr.all_jobs[0]
+        j.output_file = None
+        result = yield mgr.stitch_tile_results(image, [j])
+        assert result is None
+
+    @pytest_twisted.inlineCallbacks
+    def test_run_prepare_error(self, tmpdir, mocker):
+        tmpdir = str(tmpdir)
+        mocker.patch('treq.get', dummy_ssl_redirect)
+        mgr = manager.BatchProcessingJobManager(
+            host='localhost',
+            job_type='job',
+            tile_size=64)
+
+        for i in range(3):
+            img = Image.new('L', (10, 10))
+            img.save(os.path.join(tmpdir, 'image%s.png' % i))
+
+        prepare_submission = mgr.prepare_submission
+
+        def dummy_prepare_submission(paths):
+            if os.path.basename(paths[0]) == 'image1.png':
+                raise OSError('on purpose')
+            return prepare_submission(paths)
+
+        def make_job(filepath):
+            j = manager.JobManager.make_job(mgr, filepath)
+            j.start = lambda delay: True
+            j.upload_file = lambda: j.filepath
+            return j
+
+        mgr.check_job_status = lambda: True
+        mgr.prepare_submission = dummy_prepare_submission
+        mgr.make_job = make_job
+
+        # only the files that could not be prepared are skipped
+        yield mgr.run(tmpdir)
+        submitted = sorted(os.path.basename(j.filepath) for j in mgr.all_jobs)
+        assert submitted == ['image0.png', 'image2.png']
+
+    @pytest_twisted.inlineCallbacks
+    def test_finish_job(self, tmpdir, mocker):
+        tmpdir = str(tmpdir)
+        mocker.patch('treq.get', dummy_ssl_redirect)
+        mgr = manager.BatchProcessingJobManager(
+            host='localhost',
+            job_type='job',
+            output_dir=tmpdir)
+
+        members = {'000000_a.png': os.path.join(tmpdir, 'a.png')}
+        results_zip = os.path.join(tmpdir, 'results.zip')
+        with zipfile.ZipFile(results_zip, 'w') as zf:
+            zf.writestr('000000_a_feature_0.tif', 'result')
+
+        j = mgr.make_job('bundle.zip')
+        j.bundle_members = members
+        j.output_file = results_zip
+        yield mgr.finish_job(j, None)
+        assert os.path.isfile(os.path.join(tmpdir, 'a_feature_0.tif'))
+
+        # bad results should not raise
+        j.output_file = os.path.join(tmpdir, 'missing.zip')
+        yield mgr.finish_job(j, None)
@@ -0,0 +1,175 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Streaming multipart/form-data file uploads"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import logging
+import mimetypes
+import mmap
+import os
+import timeit
+import uuid
+
+from twisted.internet import task
+from twisted.web.iweb import IBodyProducer, UNKNOWN_LENGTH
+from zope.interface import implementer
+
+
+CRLF = b'\r\n'
+
+
+@implementer(IBodyProducer)
+class MultipartFileProducer(object):
+    """Produces a multipart/form-data body for a single file.
+
+    The file is memory-mapped and written to the consumer in fixed-size
+    chunks, so the request body is never held in memory. The file is opened
+    each time the producer is started, so the same producer may be reused
+    when a request is retried.
+
+    Args:
+        filepath (str): The file to upload.
+        field_name (str): The name of the form field.
+        filename (str): The filename sent in the form data.
+            Defaults to filepath.
+        chunk_size (int): Number of bytes written to the consumer at a time.
+        chunked (bool): Whether to use chunked transfer encoding
+            instead of sending a Content-Length.
+        progress (function): Called with the bytes sent and the total bytes
+            of the file after each chunk is written.
+        cooperator (twisted.internet.task.Cooperator): Schedules the writes.
+    """
+
+    def __init__(self, filepath, field_name='file', filename=None,
+                 chunk_size=2 ** 16, chunked=False, progress=None,
+                 cooperator=task):
+        self.logger = logging.getLogger(str(self.__class__.__name__))
+        self.filepath = str(filepath)
+        self.chunk_size = int(chunk_size)
+        if self.chunk_size <= 0:
+            raise ValueError('chunk_size must be a positive integer.')
+        self.progress = progress
+        self._cooperator = cooperator
+        self._task = None
+
+        filename = self.filepath if filename is None else str(filename)
+        file_type = mimetypes.guess_type(filename)[0]
+        file_type = file_type or 'application/octet-stream'
+
+        self.boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary={}'.format(
+            self.boundary)
+
+        self.file_size = os.path.getsize(self.filepath)
+        header = (
+            '--{boundary}\r\n'
+            'Content-Disposition: form-data; name="{name}"; '
+            'filename="{filename}"\r\n'
+            'Content-Type: {file_type}\r\n'
+            'Content-Length: {size}\r\n\r\n'
+        ).format(boundary=self.boundary,
+                 name=field_name.replace('"', '%22'),
+                 filename=filename.replace('"', '%22'),
+                 file_type=file_type,
+                 size=self.file_size)
+        self._header = header.encode('utf-8')
+        self._footer = CRLF + '--{}--'.format(self.boundary).encode() + CRLF
+
+        if chunked:
+            self.length = UNKNOWN_LENGTH
+        else:
+            self.length = (len(self._header) + self.file_size +
+                           len(self._footer))
+
+        # upload statistics
+        self.bytes_sent = 0
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def elapsed(self):
+        """Seconds taken to send the file."""
+        if self.started_at is None:
+            return 0
+        finished_at = self.finished_at
+        if finished_at is None:
+            finished_at = timeit.default_timer()
+        return finished_at - self.started_at
+
+    @property
+    def rate(self):
+        """Bytes of the file sent per second."""
+        elapsed = self.elapsed
+        return self.bytes_sent / elapsed if elapsed > 0 else 0
+
+    def _write_chunks(self, consumer):
+        consumer.write(self._header)
+        if self.file_size:
+            with open(self.filepath, 'rb') as f:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    for i in range(0, self.file_size, self.chunk_size):
+                        consumer.write(buf[i:i + self.chunk_size])
+                        self.bytes_sent = min(i + self.chunk_size,
+                                              self.file_size)
+                        if self.progress is not None:
+                            self.progress(self.bytes_sent, self.file_size)
+                        yield None
+                finally:
+                    buf.close()
+        consumer.write(self._footer)
+
+    def _finish(self, result):
+        self.finished_at = timeit.default_timer()
+        self._task = None
+        return result
+
+    def startProducing(self, consumer):
+        self.bytes_sent = 0
+        self.started_at = timeit.default_timer()
+        self.finished_at = None
+        self._task = self._cooperator.cooperate(self._write_chunks(consumer))
+        d = self._task.whenDone()
+        d.addCallback(lambda _: None)
+        d.addBoth(self._finish)
+        return d
+
+    def pauseProducing(self):
+        if self._task is not None:
+            self._task.pause()
+
+    def resumeProducing(self):
+        if self._task is not None:
+            self._task.resume()
+
+    def stopProducing(self):
+        if self._task is not None:
+            try:
+                self._task.stop()
+            except task.TaskFinished:
+                pass
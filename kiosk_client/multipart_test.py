@@ -0,0 +1,115 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for streaming multipart uploads"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import email.parser
+import os
+
+import pytest
+import pytest_twisted
+
+from twisted.web.iweb import UNKNOWN_LENGTH
+
+from kiosk_client import multipart
+
+
+class DummyConsumer(object):
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+
+def _parse(producer, body):
+    headers = 'Content-Type: {}\r\n\r\n'.format(producer.content_type)
+    message = email.parser.BytesParser().parsebytes(headers.encode() + body)
+    return message.get_payload()
+
+
+class TestMultipartFileProducer(object):
+
+    @pytest_twisted.inlineCallbacks
+    def test_start_producing(self, tmpdir):
+        path = os.path.join(str(tmpdir), 'image.png')
+        content = os.urandom(1000)
+        with open(path, 'wb') as f:
+            f.write(content)
+
+        progress = []
+        producer = multipart.MultipartFileProducer(
+            path, chunk_size=64,
+            progress=lambda sent, total: progress.append((sent, total)))
+
+        # produce the body twice, as if the request was retried
+        for _ in range(2):
+            progress = []
+            consumer = DummyConsumer()
+            yield producer.startProducing(consumer)
+            body = b''.join(consumer.chunks)
+            assert len(body) == producer.length
+
+            # the file is written in fixed size chunks
+            file_chunks = consumer.chunks[1:-1]
+            assert [len(c) for c in file_chunks] == [64] * 15 + [40]
+            assert progress[-1] == (1000, 1000)
+            assert len(progress) == 16
+
+            parts = _parse(producer, body)
+            assert len(parts) == 1
+            assert parts[0].get_param('name', header='content-disposition') \
+                == 'file'
+            assert parts[0].get_filename() == path
+            assert parts[0].get_content_type() == 'image/png'
+            assert parts[0].get_payload(decode=True) == content
+
+        assert producer.bytes_sent == 1000
+        assert producer.elapsed > 0
+        assert producer.rate > 0
+
+    @pytest_twisted.inlineCallbacks
+    def test_chunked(self, tmpdir):
+        path = os.path.join(str(tmpdir), 'empty.zip')
+        open(path, 'wb').close()
+
+        producer = multipart.MultipartFileProducer(path, chunked=True)
+        assert producer.length is UNKNOWN_LENGTH
+
+        consumer = DummyConsumer()
+        yield producer.startProducing(consumer)
+        parts = _parse(producer, b''.join(consumer.chunks))
+        assert parts[0].get_payload(decode=True) == b''
+        assert producer.rate == 0
+
+    def test_invalid_chunk_size(self, tmpdir):
+        path = os.path.join(str(tmpdir), 'image.png')
+        open(path, 'wb').close()
+        with pytest.raises(ValueError):
+            multipart.MultipartFileProducer(path, chunk_size=0)
@@ -0,0 +1,185 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Warm up connections to a host and measure its latency before a run"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import timeit
+
+from twisted.internet import defer
+from twisted.internet import protocol
+from twisted.internet.endpoints import HostnameEndpoint
+from twisted.internet.interfaces import IHostResolution
+from twisted.internet.interfaces import IHostnameResolver
+from twisted.internet.interfaces import IResolutionReceiver
+from zope.interface import implementer
+
+
+@implementer(IHostResolution)
+class _CachedResolution(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    def cancel(self):
+        pass  # the addresses are delivered immediately
+
+
+@implementer(IResolutionReceiver)
+class _NullReceiver(object):
+
+    def resolutionBegan(self, resolution):
+        pass
+
+    def addressResolved(self, address):
+        pass
+
+    def resolutionComplete(self):
+        pass
+
+
+@implementer(IResolutionReceiver)
+class _RecordingReceiver(object):
+    """Pass resolved addresses to a receiver and record them."""
+
+    def __init__(self, receiver, on_complete):
+        self.receiver = receiver
+        self.on_complete = on_complete
+        self.addresses = []
+
+    def resolutionBegan(self, resolution):
+        self.receiver.resolutionBegan(resolution)
+
+    def addressResolved(self, address):
+        self.addresses.append(address)
+        self.receiver.addressResolved(address)
+
+    def resolutionComplete(self):
+        self.on_complete(self.addresses)
+        self.receiver.resolutionComplete()
+
+
+@implementer(IHostnameResolver)
+class CachingNameResolver(object):
+    """Cache the addresses of each hostname resolved by another resolver.
+
+    Twisted resolves the hostname of every new connection in a thread,
+    and every job request opens a new connection.
+
+    Args:
+        resolver (IHostnameResolver): resolves hostnames not in the cache.
+        ttl (float): seconds until a cached hostname is resolved again.
+        clock (function): returns the current time in seconds.
+    """
+
+    def __init__(self, resolver, ttl=300, clock=timeit.default_timer):
+        self.resolver = resolver
+        self.ttl = float(ttl)
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._cache = {}
+
+    def resolveHostName(self, resolutionReceiver, hostName, portNumber=0,
+                        addressTypes=None, transportSemantics='TCP'):
+        key = (hostName, portNumber, transportSemantics,
+               None if addressTypes is None else frozenset(addressTypes))
+
+        cached = self._cache.get(key)
+        if cached is not None and self.clock() - cached[0] < self.ttl:
+            self.hits += 1
+            resolution = _CachedResolution(hostName)
+            resolutionReceiver.resolutionBegan(resolution)
+            for address in cached[1]:
+                resolutionReceiver.addressResolved(address)
+            resolutionReceiver.resolutionComplete()
+            return resolution
+
+        self.misses += 1
+
+        def _save(addresses):
+            if addresses:  # do not cache failed lookups
+                self._cache[key] = (self.clock(), tuple(addresses))
+
+        receiver = _RecordingReceiver(resolutionReceiver, _save)
+        return self.resolver.resolveHostName(
+            receiver, hostName, portNumber, addressTypes, transportSemantics)
+
+
+def install_caching_resolver(reactor, ttl=300):
+    """Cache the hostnames resolved by the reactor.
+
+    Args:
+        reactor (IReactorPluggableNameResolver): the reactor.
+        ttl (float): seconds until a cached hostname is resolved again.
+
+    Returns:
+        CachingNameResolver: the installed resolver.
+    """
+    if not isinstance(reactor.nameResolver, CachingNameResolver):
+        reactor.installNameResolver(
+            CachingNameResolver(reactor.nameResolver, ttl=ttl))
+    return reactor.nameResolver
+
+
+def resolve(resolver, hostname, port=0):
+    """Resolve a hostname.
+
+    Args:
+        resolver (IHostnameResolver): the resolver.
+        hostname (str): the hostname to resolve.
+        port (int): the port of the addresses.
+
+    Returns:
+        twisted.internet.defer.Deferred: the list of resolved addresses.
+    """
+    d = defer.Deferred()
+    receiver = _RecordingReceiver(_NullReceiver(), d.callback)
+    resolver.resolveHostName(receiver, hostname, port)
+    return d
+
+
+@defer.inlineCallbacks
+def time_connect(reactor, hostname, port, timeout=30):
+    """Open and close a TCP connection to the host.
+
+    Args:
+        reactor (twisted.internet.reactor): the reactor.
+        hostname (str): the hostname of the host.
+        port (int): the port of the host.
+        timeout (float): seconds until the connection attempt is abandoned.
+
+    Returns:
+        float: seconds taken to connect, about one round trip.
+    """
+    endpoint = HostnameEndpoint(reactor, hostname, port, timeout=timeout)
+    start = timeit.default_timer()
+    conn = yield endpoint.connect(protocol.Factory.forProtocol(
+        protocol.Protocol))
+    elapsed = timeit.default_timer() - start
+    conn.transport.loseConnection()
+    defer.returnValue(elapsed)
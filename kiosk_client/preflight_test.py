@@ -0,0 +1,134 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for the preflight of a run"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import pytest_twisted
+
+from twisted.internet import protocol
+from twisted.internet import reactor
+from twisted.internet.address import IPv4Address
+
+from kiosk_client import preflight
+
+
+class DummyResolver(object):
+
+    def __init__(self, addresses):
+        self.addresses = addresses
+        self.calls = 0
+
+    def resolveHostName(self, resolutionReceiver, hostName, portNumber=0,
+                        addressTypes=None, transportSemantics='TCP'):
+        self.calls += 1
+        resolution = preflight._CachedResolution(hostName)
+        resolutionReceiver.resolutionBegan(resolution)
+        for host in self.addresses:
+            resolutionReceiver.addressResolved(
+                IPv4Address(transportSemantics, host, portNumber))
+        resolutionReceiver.resolutionComplete()
+        return resolution
+
+
+class DummyReactor(object):
+
+    def __init__(self, resolver):
+        self.nameResolver = resolver
+
+    def installNameResolver(self, resolver):
+        self.nameResolver = resolver
+
+
+class TestCachingNameResolver(object):
+
+    @pytest_twisted.inlineCallbacks
+    def test_resolve_host_name(self):
+        now = [0]
+        dummy = DummyResolver(['10.0.0.1', '10.0.0.2'])
+        resolver = preflight.CachingNameResolver(
+            dummy, ttl=10, clock=lambda: now[0])
+
+        addresses = yield preflight.resolve(resolver, 'example.com', 80)
+        assert [a.host for a in addresses] == ['10.0.0.1', '10.0.0.2']
+        assert all(a.port == 80 for a in addresses)
+        assert dummy.calls == 1
+
+        # the addresses are cached
+        dummy.addresses = ['10.0.0.3']
+        cached = yield preflight.resolve(resolver, 'example.com', 80)
+        assert cached == addresses
+        assert dummy.calls == 1
+        assert resolver.hits == 1
+
+        # other ports and hosts are resolved separately
+        yield preflight.resolve(resolver, 'example.com', 443)
+        yield preflight.resolve(resolver, 'other.com', 80)
+        assert dummy.calls == 3
+
+        # cached addresses expire
+        now[0] = 10
+        addresses = yield preflight.resolve(resolver, 'example.com', 80)
+        assert [a.host for a in addresses] == ['10.0.0.3']
+        assert dummy.calls == 4
+        assert resolver.misses == 4
+
+    @pytest_twisted.inlineCallbacks
+    def test_failed_lookup(self):
+        dummy = DummyResolver([])
+        resolver = preflight.CachingNameResolver(dummy)
+        for _ in range(2):
+            addresses = yield preflight.resolve(resolver, 'example.com')
+            assert addresses == []
+        assert dummy.calls == 2  # failed lookups are not cached
+
+    def test_install_caching_resolver(self):
+        dummy = DummyResolver([])
+        dummy_reactor = DummyReactor(dummy)
+        resolver = preflight.install_caching_resolver(dummy_reactor, ttl=5)
+        assert isinstance(resolver, preflight.CachingNameResolver)
+        assert resolver.resolver is dummy
+        assert resolver.ttl == 5
+        assert dummy_reactor.nameResolver is resolver
+
+        # only installed once
+        again = preflight.install_caching_resolver(dummy_reactor)
+        assert again is resolver
+
+
+class TestTimeConnect(object):
+
+    @pytest_twisted.inlineCallbacks
+    def test_time_connect(self):
+        factory = protocol.Factory.forProtocol(protocol.Protocol)
+        port = reactor.listenTCP(0, factory, interface='127.0.0.1')
+        try:
+            elapsed = yield preflight.time_connect(
+                reactor, '127.0.0.1', port.getHost().port)
+            assert elapsed > 0
+        finally:
+            yield port.stopListening()
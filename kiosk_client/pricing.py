@@ -0,0 +1,78 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Versioned pricing tables of cloud resources"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+
+
+DEFAULT_PRICING_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'data', 'pricing.json')
+
+
+class Pricing(object):
+    """Hourly prices of machines and GPUs in a single region.
+
+    The pricing file is a JSON object with a "version" and a table of
+    "machines", "gpus" and flat "networking_costs" for each region.
+    Each machine type and GPU has an "ondemand" and a "preemptible"
+    (spot) hourly price.
+
+    Args:
+        path (str): The pricing file. Defaults to the bundled pricing file.
+        region (str): The region of the prices. Defaults to the file's
+            "default_region".
+    """
+
+    def __init__(self, path=None, region=None):
+        self.path = DEFAULT_PRICING_FILE if not path else str(path)
+        with open(self.path, 'r') as f:
+            data = json.load(f)
+
+        self.version = data.get('version')
+        self.currency = data.get('currency', 'USD')
+        self.region = region if region else data.get('default_region')
+
+        regions = data.get('regions', {})
+        if self.region not in regions:
+            raise ValueError('Region `%s` not found in %s. Choose from %s.' %
+                             (self.region, self.path, list(regions)))
+
+        prices = regions[self.region]
+        self.machines = prices.get('machines', {})
+        self.gpus = prices.get('gpus', {})
+        self.networking_costs = float(prices.get('networking_costs', 0))
+
+    def json(self):
+        return {
+            'path': self.path,
+            'version': self.version,
+            'region': self.region,
+            'currency': self.currency,
+        }
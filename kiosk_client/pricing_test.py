@@ -0,0 +1,76 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for pricing tables"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+
+import pytest
+
+from kiosk_client import pricing
+
+
+class TestPricing(object):
+
+    def test_default_pricing(self):
+        p = pricing.Pricing()
+        assert p.path == pricing.DEFAULT_PRICING_FILE
+        assert p.version
+        assert p.region == 'us-west1'
+        assert p.machines['n1-highmem-2']['preemptible'] == 0.025
+        assert p.gpus['nvidia-tesla-v100']['ondemand'] == 2.48
+        assert p.networking_costs == 7
+
+        with pytest.raises(ValueError):
+            pricing.Pricing(region='invalid-region')
+
+    def test_custom_pricing(self, tmpdir):
+        path = os.path.join(str(tmpdir), 'pricing.json')
+        with open(path, 'w') as f:
+            json.dump({
+                'version': 'test',
+                'default_region': 'a',
+                'regions': {
+                    'a': {'machines': {'m': {'ondemand': 1}}},
+                    'b': {'machines': {'m': {'ondemand': 2}},
+                          'gpus': {'g': {'ondemand': 3}},
+                          'networking_costs': 4},
+                },
+            }, f)
+
+        p = pricing.Pricing(path)
+        assert p.region == 'a'
+        assert p.machines['m']['ondemand'] == 1
+        assert p.gpus == {}
+        assert p.networking_costs == 0
+
+        p = pricing.Pricing(path, region='b')
+        assert p.gpus['g']['ondemand'] == 3
+        assert p.json() == {'path': path, 'version': 'test',
+                            'region': 'b', 'currency': 'USD'}
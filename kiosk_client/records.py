@@ -0,0 +1,109 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Disk-backed storage of finished job data"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import json
+import textwrap
+
+
+class JobRecordStore(object):
+    """Appends the JSON data of finished jobs to a file, one job per line.
+
+    Jobs can be dropped from memory once their data is stored, so the
+    memory used by a run depends on the number of unfinished jobs rather
+    than the total number of jobs. Any existing file is overwritten.
+    Added jobs are appended to the file when it is flushed, so no file is
+    kept open between flushes.
+
+    Args:
+        path (str): The JSON lines file of job data.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.statuses = collections.Counter()
+        self._count = 0
+        self._lines = []  # added since the last flush
+        with open(self.path, 'w'):
+            pass  # overwrite any existing file
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        """Iterate over the stored job data, in the order it was added."""
+        self.flush()
+        with open(self.path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def add(self, record):
+        """Store the data of a finished job.
+
+        Args:
+            record (dict): The job data, from Job.json().
+        """
+        self._lines.append(json.dumps(record) + '\n')
+        self.statuses[record.get('status')] += 1
+        self._count += 1
+
+    def flush(self):
+        if self._lines:
+            with open(self.path, 'a') as f:
+                f.writelines(self._lines)
+            self._lines = []
+
+    def close(self):
+        self.flush()
+
+
+def dump_json(data, records, f, key='job_data'):
+    """Write the data as indented JSON, with the records streamed as a list.
+
+    The output is the same as json.dump(dict(data, key=list(records)), f,
+    indent=4), without holding all records in memory.
+
+    Args:
+        data (dict): The data, without the records.
+        records (iterable): The dicts written to the list.
+        f (file): The file to write to.
+        key (str): The key of the list of records.
+    """
+    data = {k: v for k, v in data.items() if k != key}
+    data[key] = []  # the last key, replaced with the records
+    header = json.dumps(data, indent=4)
+    prefix, suffix = header.rsplit('[]', 1)
+    f.write(prefix + '[')
+    sep = '\n'
+    for record in records:
+        f.write(sep + textwrap.indent(json.dumps(record, indent=4), ' ' * 8))
+        sep = ',\n'
+    f.write(('\n    ]' if sep != '\n' else ']') + suffix)
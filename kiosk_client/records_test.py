@@ -0,0 +1,79 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for disk-backed storage of job data"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+import json
+import os
+
+from kiosk_client import records
+
+
+class TestJobRecordStore(object):
+
+    def test_add(self, tmpdir):
+        path = os.path.join(str(tmpdir), 'jobs.jsonl')
+        with open(path, 'w') as f:
+            f.write('{"status": "stale"}\n')
+
+        store = records.JobRecordStore(path)
+        assert len(store) == 0
+        assert list(store) == []  # the existing file is overwritten
+
+        jobs = [{'status': 'done', 'total_time': 1.5},
+                {'status': 'failed', 'reason': 'bad\nnews'},
+                {'status': 'done', 'total_time': [1, 2]}]
+        for job in jobs:
+            store.add(job)
+
+        assert len(store) == 3
+        assert store.statuses == {'done': 2, 'failed': 1}
+        assert list(store) == jobs
+
+        # added jobs are written when the store is closed
+        store.add({'status': 'done'})
+        store.close()
+        with open(path, 'r') as f:
+            assert len(f.readlines()) == 4
+
+
+class TestDumpJson(object):
+
+    def test_dump_json(self):
+        data = {'num_jobs': 2, 'empty': [], 'nested': {'a': [1, 2]}}
+        for jobs in ([], [{'status': 'done'}], [{'a': []}, {'b': {'c': 1}}]):
+            f = io.StringIO()
+            records.dump_json(data, iter(jobs), f)
+            expected = dict(data, job_data=jobs)
+            assert f.getvalue() == json.dumps(expected, indent=4)
+
+        # an existing key is replaced
+        f = io.StringIO()
+        records.dump_json({'job_data': [1], 'b': 2}, [{'c': 3}], f)
+        assert json.loads(f.getvalue()) == {'b': 2, 'job_data': [{'c': 3}]}
@@ -0,0 +1,226 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Order the files of a batch by the estimated time of their jobs"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import logging
+import os
+import zipfile
+
+import numpy as np
+
+from kiosk_client import tiling
+from kiosk_client.columnar import to_floats
+from kiosk_client.utils import is_archive_file
+
+
+ORDERS = ('discovery', 'largest-first', 'shortest-first', 'interleave')
+
+# the features of a file used to estimate the time of its job
+FEATURES = ('bytes', 'pixels', 'images')
+
+
+def get_features(filepath, probe_dimensions=False):
+    """Get the size of a file.
+
+    Args:
+        filepath (str): An image or zip archive.
+        probe_dimensions (bool): Whether to read the header of each image
+            to count its pixels. Otherwise the pixels are 0.
+
+    Returns:
+        tuple: The number of bytes, pixels and images of the file.
+    """
+    num_bytes = os.path.getsize(filepath)
+    if is_archive_file(filepath):
+        try:
+            with zipfile.ZipFile(filepath, 'r') as zf:
+                images = sum(1 for i in zf.infolist() if not i.is_dir())
+        except zipfile.BadZipFile:
+            images = 0
+        return (num_bytes, 0, images)
+
+    pixels = 0
+    if probe_dimensions:
+        try:
+            width, height = tiling.get_image_size(filepath)
+            pixels = width * height
+        except (IOError, OSError, ValueError):
+            pass  # not a readable image, only use its size
+    return (num_bytes, pixels, 1)
+
+
+class CostEstimator(object):
+    """Estimate the seconds a job will take from the features of its file.
+
+    The total_time of completed jobs is fit to a linear function of the
+    bytes, pixels and images of their files with least squares. Until
+    min_samples jobs are completed, the estimate is the number of bytes,
+    which orders files the same way as any increasing function of size.
+
+    Args:
+        min_samples (int): Number of completed jobs needed for a fit.
+    """
+
+    def __init__(self, min_samples=8):
+        self.min_samples = max(int(min_samples), len(FEATURES) + 1)
+        self.coefficients = None  # intercept, then one for each feature
+        self.version = 0  # incremented each time the estimator is fit
+        self._x = []
+        self._y = []
+
+    def __len__(self):
+        return len(self._y)
+
+    def add(self, features, total_time):
+        """Add the features and total_time of a completed job.
+
+        The estimator is fit again each time the number of jobs doubles.
+        """
+        seconds = sum(to_floats(total_time))
+        if not seconds:
+            return  # failed or not summarized
+
+        self._x.append((1,) + tuple(features))
+        self._y.append(seconds)
+
+        n = len(self._y)
+        if n >= self.min_samples and not n & (n - 1):  # a power of 2
+            self.fit()
+
+    def fit(self):
+        x = np.array(self._x, dtype=np.float64)
+        y = np.array(self._y, dtype=np.float64)
+        self.coefficients = np.linalg.lstsq(x, y, rcond=None)[0]
+        self.version += 1
+
+    def estimate(self, features):
+        """Estimate the seconds a job of a file with the features will take.
+
+        Args:
+            features (tuple): The output of get_features().
+        """
+        if self.coefficients is None:
+            return float(features[0])
+        return float(self.coefficients[0] +
+                     np.dot(self.coefficients[1:], features))
+
+    def json(self):
+        coefficients = None
+        if self.coefficients is not None:
+            names = ('intercept',) + FEATURES
+            coefficients = dict(zip(names, self.coefficients.tolist()))
+        return {'samples': len(self), 'coefficients': coefficients}
+
+
+class SubmissionQueue(object):
+    """Order groups of files for submission by the estimated time of their
+    jobs.
+
+    All groups are read and sized when the queue is created. The remaining
+    groups are ordered again each time the estimator is fit.
+
+    Orders:
+        discovery: the order the files were found in, without sizing them.
+        largest-first: the longest jobs first, so no long job is started
+            at the end of the batch (LPT).
+        shortest-first: the shortest jobs first, so the most jobs finish
+            early (SPT).
+        interleave: alternate between the longest and shortest jobs.
+
+    Args:
+        groups (iterable): The lists of files to submit in each job.
+        order (str): The name of the order.
+        estimator (CostEstimator): Estimates the time of each job.
+        probe_dimensions (bool): Whether to count the pixels of each image.
+    """
+
+    def __init__(self, groups, order='discovery', estimator=None,
+                 probe_dimensions=False):
+        self.logger = logging.getLogger(str(self.__class__.__name__))
+        if order not in ORDERS:
+            raise ValueError('order must be one of %s, got %s.' %
+                             (', '.join(ORDERS), order))
+        self.order = order
+        self.estimator = estimator if estimator is not None else \
+            CostEstimator()
+        self.probe_dimensions = probe_dimensions
+        self.features = {}  # the features of each file
+
+        if order == 'discovery':
+            self._groups = iter(groups)
+            self._pending = None
+            return
+
+        self._pending = []
+        for group in groups:
+            for path in group:
+                self.features[path] = get_features(path, probe_dimensions)
+            self._pending.append(group)
+        self._sorted_version = None
+        self._take_largest = True  # for interleave
+        self.logger.info('Ordering %s groups of files %s.',
+                         len(self._pending), order)
+
+    def __len__(self):
+        return len(self._pending) if self._pending is not None else 0
+
+    def __iter__(self):
+        return self
+
+    def group_features(self, group):
+        """Sum the features of each file in the group."""
+        return tuple(sum(f) for f in zip(*(self.features[p] for p in group)))
+
+    def _sort(self):
+        # the next group is popped from the end, the largest unless
+        # the order is shortest-first
+        pending = list(self._pending)
+        estimates = [self.estimator.estimate(self.group_features(g))
+                     for g in pending]
+        indices = sorted(range(len(pending)), key=estimates.__getitem__,
+                         reverse=self.order == 'shortest-first')
+        self._pending = collections.deque(pending[i] for i in indices)
+        self._sorted_version = self.estimator.version
+
+    def __next__(self):
+        if self._pending is None:
+            return next(self._groups)
+
+        if not self._pending:
+            raise StopIteration
+
+        if self._sorted_version != self.estimator.version:
+            self._sort()
+
+        take_largest = self._take_largest
+        if self.order == 'interleave':
+            self._take_largest = not take_largest
+        return self._pending.pop() if take_largest else \
+            self._pending.popleft()
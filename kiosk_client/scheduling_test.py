@@ -0,0 +1,155 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for ordering the files of a batch"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import zipfile
+
+from PIL import Image
+
+import pytest
+
+from kiosk_client import scheduling
+
+
+def _write_file(tmpdir, name, size):
+    path = os.path.join(str(tmpdir), name)
+    with open(path, 'wb') as f:
+        f.write(b'0' * size)
+    return path
+
+
+class TestGetFeatures(object):
+
+    def test_get_features(self, tmpdir):
+        image = os.path.join(str(tmpdir), 'image.png')
+        Image.new('L', (30, 20)).save(image)
+        size = os.path.getsize(image)
+        assert scheduling.get_features(image) == (size, 0, 1)
+        assert scheduling.get_features(image, probe_dimensions=True) == \
+            (size, 600, 1)
+
+        archive = os.path.join(str(tmpdir), 'images.zip')
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.write(image, 'a.png')
+            zf.write(image, 'b.png')
+        assert scheduling.get_features(archive, True) == \
+            (os.path.getsize(archive), 0, 2)
+
+        # unreadable files are only sized
+        path = _write_file(tmpdir, 'bad.zip', 10)
+        assert scheduling.get_features(path) == (10, 0, 0)
+        path = _write_file(tmpdir, 'bad.png', 10)
+        assert scheduling.get_features(path, True) == (10, 0, 1)
+
+
+class TestCostEstimator(object):
+
+    def test_estimate(self):
+        estimator = scheduling.CostEstimator(min_samples=8)
+        assert estimator.estimate((100, 5, 1)) == 100  # sized by bytes
+        assert estimator.json() == {'samples': 0, 'coefficients': None}
+
+        def _time(features):
+            return 2 + 0.5 * features[0] + 0.01 * features[1] + features[2]
+
+        for i in range(1, 8):
+            features = (10 * i, i * i, i % 3)
+            estimator.add(features, str(_time(features)))
+        estimator.add((1, 1, 1), None)  # failed jobs are skipped
+        assert estimator.coefficients is None
+        assert estimator.version == 0
+
+        estimator.add((80, 64, 2), [_time((80, 64, 2)) / 2] * 2)
+        assert estimator.version == 1
+        assert estimator.estimate((200, 100, 2)) == \
+            pytest.approx(_time((200, 100, 2)))
+
+        coefficients = estimator.json()['coefficients']
+        assert estimator.json()['samples'] == 8
+        assert coefficients['intercept'] == pytest.approx(2)
+        assert coefficients['bytes'] == pytest.approx(0.5)
+
+        # fit again each time the number of jobs doubles
+        for i in range(7):
+            estimator.add((i, i, i), 1)
+            assert estimator.version == 1
+        estimator.add((1, 1, 1), 1)
+        assert estimator.version == 2
+
+
+class TestSubmissionQueue(object):
+
+    def _groups(self, tmpdir):
+        sizes = [3, 1, 5, 2, 4]
+        return [[_write_file(tmpdir, '%s.png' % i, s)]
+                for i, s in enumerate(sizes)]
+
+    def _sizes(self, queue):
+        return [os.path.getsize(g[0]) for g in queue]
+
+    def test_orders(self, tmpdir):
+        groups = self._groups(tmpdir)
+
+        queue = scheduling.SubmissionQueue(iter(groups))
+        assert list(queue) == groups
+        assert queue.features == {}  # not sized
+
+        queue = scheduling.SubmissionQueue(groups, 'largest-first')
+        assert len(queue) == 5
+        assert self._sizes(queue) == [5, 4, 3, 2, 1]
+
+        queue = scheduling.SubmissionQueue(groups, 'shortest-first')
+        assert self._sizes(queue) == [1, 2, 3, 4, 5]
+
+        queue = scheduling.SubmissionQueue(groups, 'interleave')
+        assert self._sizes(queue) == [5, 1, 4, 2, 3]
+
+        with pytest.raises(ValueError):
+            scheduling.SubmissionQueue(groups, 'random')
+
+    def test_groups(self, tmpdir):
+        bundle = [_write_file(tmpdir, 'a.png', 2),
+                  _write_file(tmpdir, 'b.png', 2)]
+        single = [_write_file(tmpdir, 'c.png', 3)]
+        queue = scheduling.SubmissionQueue([single, bundle], 'largest-first')
+        assert queue.group_features(bundle) == (4, 0, 2)
+        assert list(queue) == [bundle, single]
+
+    def test_sorted_again(self, tmpdir):
+        groups = self._groups(tmpdir)
+        estimator = scheduling.CostEstimator()
+        queue = scheduling.SubmissionQueue(groups, 'largest-first',
+                                           estimator=estimator)
+        assert self._sizes([next(queue)]) == [5]
+
+        # smaller files turn out to take longer
+        for i in range(1, 9):
+            estimator.add((i, 0, 1), 100 - i)
+        assert self._sizes(queue) == [1, 2, 3, 4]
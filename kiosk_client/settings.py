@@ -28,13 +28,10 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import errno
 import os
 
 from decouple import config
 
-from kiosk_client.utils import get_download_path
-
 
 NUM_GPUS = config('NUM_GPUS', cast=int, default=0)
 
@@ -46,10 +43,25 @@ HOST = config('API_HOST', cast=str, default='')
 if not any(HOST.lower().startswith(x) for x in ('http://', 'https://')):
     HOST = 'http://{}'.format(HOST)
 
+# How the host of each job is chosen if there are several hosts:
+# "round-robin", "least-outstanding" or "ewma" (lowest request latency).
+LOAD_BALANCING = config('LOAD_BALANCING', default='round-robin')
+
 # Grafana resources for cost estimation
 GRAFANA_HOST = config('GRAFANA_HOST', default='prometheus-operator-grafana')
 GRAFANA_USER = config('GRAFANA_USER', default='admin')
 GRAFANA_PASSWORD = config('GRAFANA_PASSWORD', default='prom-operator')
+GRAFANA_TIMEOUT = config('GRAFANA_TIMEOUT', default=30, cast=float)
+# query long benchmarks in parallel chunks instead of increasing the step
+GRAFANA_FULL_RESOLUTION = config('GRAFANA_FULL_RESOLUTION',
+                                 default=False, cast=bool)
+# prices of cloud resources, defaults to kiosk_client/data/pricing.json
+PRICING_FILE = config('PRICING_FILE', default='')
+PRICING_REGION = config('PRICING_REGION', default='')
+# cache query responses of closed time windows in GRAFANA_CACHE_DIR
+GRAFANA_CACHE_DIR = config('GRAFANA_CACHE_DIR', default='')
+GRAFANA_CACHE_MAX_BYTES = config('GRAFANA_CACHE_MAX_BYTES',
+                                 default=2 ** 30, cast=int)
 
 # TensorFlow Servable
 MODEL = config('MODEL', default='')
@@ -69,8 +81,31 @@ UPDATE_INTERVAL = config('UPDATE_INTERVAL', default=10, cast=float)
 # Time to wait between starting jobs (for staggering redis entries)
 START_DELAY = config('START_DELAY', default=0.05, cast=float)
 
+# Maximum number of unfinished jobs in benchmark mode. Unlimited if 0.
+MAX_ACTIVE_JOBS = config('MAX_ACTIVE_JOBS', default=0, cast=int)
+
+# Connections opened and requests used to measure the latency of the host
+# before the first job is created. Disabled if 0. Jobs close connections
+# after each request, so opened connections only save the first connects.
+PREFLIGHT_CONNECTIONS = config('PREFLIGHT_CONNECTIONS', default=0, cast=int)
+PREFLIGHT_PROBES = config('PREFLIGHT_PROBES', default=5, cast=int)
+
+# Start a duplicate of each job that has been in its status for longer than
+# HEDGE_PERCENTILE of the durations of the status. Disabled if 0.
+HEDGE_PERCENTILE = config('HEDGE_PERCENTILE', default=0, cast=float)
+HEDGE_MIN_SAMPLES = config('HEDGE_MIN_SAMPLES', default=20, cast=int)
+MAX_HEDGES = config('MAX_HEDGES', default=0, cast=int)
+
+# Seconds each job may run before it is timed out and expired, and seconds
+# the run may take before it stops submitting jobs and drains unfinished jobs
+# within DRAIN_TIMEOUT seconds. Disabled if 0.
+JOB_TIMEOUT = config('JOB_TIMEOUT', default=0, cast=float)
+TIME_BUDGET = config('TIME_BUDGET', default=0, cast=float)
+DRAIN_TIMEOUT = config('DRAIN_TIMEOUT', default=120, cast=float)
+
 # Time interval between Manager status checks
 MANAGER_REFRESH_RATE = config('MANAGER_REFRESH_RATE', default=10, cast=float)
+COST_UPDATE_INTERVAL = config('COST_UPDATE_INTERVAL', default=60, cast=float)
 
 # Time in seconds to expire the completed jobs.
 EXPIRE_TIME = config('EXPIRE_TIME', default=3600, cast=int)
@@ -78,14 +113,67 @@ EXPIRE_TIME = config('EXPIRE_TIME', default=3600, cast=int)
 # Name of upload folder in storage bucket.
 UPLOAD_PREFIX = config('UPLOAD_PREFIX', default='uploads', cast=str)
 
+# Persistent index of previously uploaded files, keyed by content hash.
+# Files in the index are not uploaded again. Disabled if empty.
+UPLOAD_INDEX = config('UPLOAD_INDEX', default='', cast=str)
+UPLOAD_INDEX_MAX_ENTRIES = config('UPLOAD_INDEX_MAX_ENTRIES',
+                                  default=100000, cast=int)
+UPLOAD_INDEX_MAX_AGE = config('UPLOAD_INDEX_MAX_AGE',
+                              default=86400, cast=float)
+
+# Number of threads used to hash files before uploading.
+HASH_WORKERS = config('HASH_WORKERS', default=4, cast=int)
+
+# Local cache of job results, keyed by input file hash and job parameters.
+# Cached files are not processed again. Disabled if empty.
+RESULT_CACHE_DIR = config('RESULT_CACHE_DIR', default='', cast=str)
+RESULT_CACHE_MAX_BYTES = config('RESULT_CACHE_MAX_BYTES',
+                                default=10 * 2 ** 30, cast=int)
+RESULT_CACHE_MAX_AGE = config('RESULT_CACHE_MAX_AGE',
+                              default=604800, cast=float)
+
+# Bundle images smaller than BUNDLE_SIZE bytes into zip archives of up to
+# BUNDLE_SIZE bytes and BUNDLE_COUNT images. Disabled if BUNDLE_SIZE is 0.
+BUNDLE_SIZE = config('BUNDLE_SIZE', default=0, cast=int)
+BUNDLE_COUNT = config('BUNDLE_COUNT', default=1000, cast=int)
+
+# Split zip archives larger than SHARD_SIZE bytes into NUM_SHARDS jobs,
+# balanced by member "bytes" or "count". Disabled if SHARD_SIZE is 0.
+SHARD_SIZE = config('SHARD_SIZE', default=0, cast=int)
+NUM_SHARDS = config('NUM_SHARDS', default=2, cast=int)
+SHARD_BY = config('SHARD_BY', default='bytes', cast=str)
+
+# Split images larger than TILE_SIZE pixels into overlapping tiles which
+# are processed in parallel and stitched back together. Disabled if 0.
+TILE_SIZE = config('TILE_SIZE', default=0, cast=int)
+TILE_OVERLAP = config('TILE_OVERLAP', default=64, cast=int)
+
+# Order the files of a batch by the estimated time of their jobs:
+# "discovery", "largest-first", "shortest-first" or "interleave".
+# PROBE_DIMENSIONS also reads the header of each image to count its pixels.
+JOB_ORDER = config('JOB_ORDER', default='discovery', cast=str)
+PROBE_DIMENSIONS = config('PROBE_DIMENSIONS', default=False, cast=bool)
+
 # HTTP Settings
 CONCURRENT_REQUESTS_PER_HOST = config('CONCURRENT_REQUESTS_PER_HOST',
                                       default=64, cast=int)
 
-# Application directories
+# Stream uploaded files in chunks of UPLOAD_CHUNK_SIZE bytes, optionally
+# using chunked transfer encoding instead of a Content-Length header.
+UPLOAD_CHUNK_SIZE = config('UPLOAD_CHUNK_SIZE', default=65536, cast=int)
+CHUNKED_UPLOAD = config('CHUNKED_UPLOAD', default=False, cast=bool)
+
+# Write the data of finished jobs to this JSON lines file and drop them from
+# memory, so memory use is bounded by the unfinished jobs. Disabled if empty.
+JOB_STORE = config('JOB_STORE', default='', cast=str)
+
+# Format of the output file, "json" or a compact columnar "npz".
+OUTPUT_FORMAT = config('OUTPUT_FORMAT', default='json', cast=str)
+
+# Application directories, created when they are first used
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DOWNLOAD_DIR = os.path.join(ROOT_DIR, 'download')
-OUTPUT_DIR = get_download_path()
+OUTPUT_DIR = ''  # the user's Downloads directory
 LOG_DIR = os.path.join(ROOT_DIR, 'logs')
 
 # Log settings
@@ -93,16 +181,18 @@ LOG_ENABLED = config('LOG_ENABLED', default=True, cast=bool)
 LOG_FORMAT = '[%(asctime)s]:[%(levelname)s]:[%(name)s]: %(message)s'
 LOG_LEVEL = config('LOG_LEVEL', cast=str, default='DEBUG')
 LOG_FILE = config('LOG_FILE', default='benchmark.log')
-LOG_FILE = os.path.join(LOG_DIR, LOG_FILE)
+# Format and write logs in a background thread instead of the reactor thread.
+LOG_QUEUE = config('LOG_QUEUE', default=True, cast=bool)
+# Write each log record as a line of JSON.
+LOG_JSON = config('LOG_JSON', default=False, cast=bool)
+# Fraction of the DEBUG/INFO logs of HTTP requests and status polls to keep.
+LOG_REQUEST_SAMPLE_RATE = config('LOG_REQUEST_SAMPLE_RATE',
+                                 default=1, cast=float)
+LOG_STATUS_SAMPLE_RATE = config('LOG_STATUS_SAMPLE_RATE',
+                                default=1, cast=float)
 
 # Overwrite directories with environment variabls
 DOWNLOAD_DIR = config('DOWNLOAD_DIR', default=DOWNLOAD_DIR)
 OUTPUT_DIR = config('OUTPUT_DIR', default=OUTPUT_DIR)
 LOG_DIR = config('LOG_DIR', default=LOG_DIR)
-
-for d in (DOWNLOAD_DIR, OUTPUT_DIR, LOG_DIR):
-    try:
-        os.makedirs(d)
-    except OSError as e:
-        if e.errno != errno.EEXIST:
-            raise
+LOG_FILE = os.path.join(LOG_DIR, LOG_FILE)
@@ -0,0 +1,253 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Split large images into overlapping tiles and stitch their labels"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import zipfile
+
+import numpy as np
+from PIL import Image
+
+
+def allow_large_images():
+    """Disable the decompression bomb check of Pillow.
+
+    Pillow refuses to open images larger than Image.MAX_IMAGE_PIXELS,
+    which are exactly the images that are tiled.
+    """
+    Image.MAX_IMAGE_PIXELS = None
+
+
+def get_image_size(filepath):
+    """Returns the (width, height) of the image, only reading its header."""
+    with Image.open(filepath) as im:
+        return im.size
+
+
+def get_tile_boxes(width, height, tile_size, overlap=0):
+    """Get the boxes of overlapping tiles that cover an image.
+
+    Tiles are spaced tile_size - overlap pixels apart. The last tile in
+    each row and column is aligned with the edge of the image.
+
+    Args:
+        width (int): The width of the image.
+        height (int): The height of the image.
+        tile_size (int): The width and height of each tile.
+        overlap (int): The number of pixels shared by adjacent tiles.
+
+    Returns:
+        list: The (left, upper, right, lower) box of each tile.
+    """
+    tile_size, overlap = int(tile_size), int(overlap)
+    if not 0 <= overlap < tile_size:
+        raise ValueError('overlap must be at least 0 and less than '
+                         'tile_size, got %s.' % overlap)
+
+    def _get_starts(length):
+        if length <= tile_size:
+            return [0]
+        stride = tile_size - overlap
+        starts = list(range(0, length - tile_size, stride))
+        starts.append(length - tile_size)
+        return starts
+
+    return [(x, y, min(x + tile_size, width), min(y + tile_size, height))
+            for y in _get_starts(height)
+            for x in _get_starts(width)]
+
+
+def write_tiles(filepath, dest_dir, tile_size, overlap=0):
+    """Save overlapping tiles of the image as TIFF files.
+
+    The image is loaded once. Pillow memory-maps the pixel data of
+    uncompressed images rather than reading it into memory.
+
+    Args:
+        filepath (str): The image to tile.
+        dest_dir (str): The directory in which to save the tiles.
+        tile_size (int): The width and height of each tile.
+        overlap (int): The number of pixels shared by adjacent tiles.
+
+    Returns:
+        list: The (filepath, box) of each tile.
+    """
+    stem = os.path.splitext(os.path.basename(filepath))[0]
+    tiles = []
+    with Image.open(filepath) as im:
+        width, height = im.size
+        for box in get_tile_boxes(width, height, tile_size, overlap):
+            dest = os.path.join(dest_dir, '{}_{}_{}.tif'.format(
+                stem, box[0], box[1]))
+            im.crop(box).save(dest, format='TIFF')
+            tiles.append((dest, box))
+    return tiles
+
+
+def read_labels(filepath):
+    """Read a label image, or the first image in a zip archive of results.
+
+    Returns:
+        numpy.array: The labels as a 2D 32-bit integer array.
+    """
+    if zipfile.is_zipfile(filepath):
+        with zipfile.ZipFile(filepath, 'r') as zf:
+            names = sorted(n for n in zf.namelist() if not n.endswith('/'))
+            if not names:
+                raise ValueError('%s contains no images.' % filepath)
+            with zf.open(names[0]) as f:
+                with Image.open(f) as im:
+                    labels = np.array(im)
+    else:
+        with Image.open(filepath) as im:
+            labels = np.array(im)
+
+    if labels.ndim == 3:  # keep the first channel of the labels
+        labels = labels[..., 0]
+    return labels.astype('int32')
+
+
+def _get_cores(starts, ends, length):
+    """Each tile owns the pixels nearer to it than to its neighbors."""
+    starts, ends = sorted(set(starts)), sorted(set(ends))
+    cores = {}
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        core_start = 0 if i == 0 else (ends[i - 1] + start) // 2
+        core_end = length
+        if i < len(starts) - 1:
+            core_end = (end + starts[i + 1]) // 2
+        cores[start] = (core_start, core_end)
+    return cores
+
+
+def _find(parents, x):
+    """Find the root of x in the union-find forest."""
+    root = x
+    while parents.get(root, root) != root:
+        root = parents[root]
+    while x != root:  # path compression
+        parents[x], x = root, parents[x]
+    return root
+
+
+def _merge_overlapping(parents, a, b, min_overlap):
+    """Merge the labels of a and b that cover each other by at least
+    min_overlap of the smaller label's area."""
+    a_ids, a_areas = np.unique(a, return_counts=True)
+    b_ids, b_areas = np.unique(b, return_counts=True)
+    areas = dict(zip(a_ids, a_areas))
+    areas.update(zip(b_ids, b_areas))
+
+    both = (a > 0) & (b > 0)
+    pairs, counts = np.unique(np.stack([a[both], b[both]]),
+                              axis=1, return_counts=True)
+    for (x, y), count in zip(pairs.T, counts):
+        if count >= min_overlap * min(areas[x], areas[y]):
+            parents[_find(parents, y)] = _find(parents, x)
+
+
+def stitch_labels(tiles, width, height, min_overlap=0.5):
+    """Stitch the labels of overlapping tiles into a single label image.
+
+    Labels of different tiles are made unique. In the region a tile shares
+    with the tiles stitched before it, labels covering each other by at
+    least min_overlap of the smaller label's area in that region are
+    merged into the same object. Each pixel is then taken from the tile
+    whose edge is furthest away, so objects cut by the edge of a tile are
+    resolved by its neighbor.
+
+    Tiles are stitched one at a time into a 32-bit integer image, so only
+    a single tile is held in memory if the labels are given as filepaths.
+
+    Args:
+        tiles (list): The (labels, box) of each tile, where labels is a
+            2D array with the same shape as the box, or the filepath of a
+            label image read with read_labels().
+        width (int): The width of the stitched image.
+        height (int): The height of the stitched image.
+        min_overlap (float): Minimum fraction of overlap to merge labels.
+
+    Returns:
+        numpy.array: The stitched labels with shape (height, width).
+    """
+    x_cores = _get_cores([b[0] for _, b in tiles], [b[2] for _, b in tiles],
+                         width)
+    y_cores = _get_cores([b[1] for _, b in tiles], [b[3] for _, b in tiles],
+                         height)
+
+    stitched = np.full((height, width), -1, dtype='int32')  # not yet stitched
+    parents, offset, cores = {}, 0, []
+    for labels, box in tiles:
+        if not isinstance(labels, np.ndarray):
+            labels = read_labels(labels)
+
+        # make the labels of each tile unique
+        labels = np.where(labels > 0, labels + offset, 0).astype('int32')
+        offset = max(offset, int(labels.max()))
+
+        left, upper, right, lower = box
+        region = stitched[upper:lower, left:right]
+
+        # merge labels that cover the labels of previous tiles
+        is_stitched = region >= 0
+        if is_stitched.any():
+            _merge_overlapping(parents, region[is_stitched],
+                               labels[is_stitched], min_overlap)
+
+        # keep the pixels in the core of a previous tile
+        is_kept = np.zeros(region.shape, dtype='bool')
+        for x0, y0, x1, y1 in cores:
+            is_kept[max(y0 - upper, 0):max(y1 - upper, 0),
+                    max(x0 - left, 0):max(x1 - left, 0)] = True
+        region[~is_kept] = labels[~is_kept]
+
+        x0, x1 = x_cores[left]
+        y0, y1 = y_cores[upper]
+        cores.append((x0, y0, x1, y1))
+
+    lookup = np.arange(offset + 1, dtype='int32')
+    for x in parents:
+        lookup[x] = _find(parents, x)
+
+    # relabel sequentially, one core at a time as the cores cover the image
+    present = np.unique(np.concatenate(
+        [[0]] + [np.unique(lookup[stitched[y0:y1, x0:x1]])
+                 for x0, y0, x1, y1 in cores]))
+    sequential = np.zeros(offset + 1, dtype='int32')
+    sequential[present] = np.arange(len(present))
+    for x0, y0, x1, y1 in cores:
+        stitched[y0:y1, x0:x1] = sequential[lookup[stitched[y0:y1, x0:x1]]]
+    return stitched
+
+
+def save_labels(labels, dest):
+    """Save the labels as a 32-bit integer TIFF file."""
+    labels = labels.astype('int32', copy=False)
+    Image.fromarray(labels).save(dest, format='TIFF')
+    return dest
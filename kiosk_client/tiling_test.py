@@ -0,0 +1,142 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for tiling functions"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import zipfile
+
+import numpy as np
+from PIL import Image
+import pytest
+
+from kiosk_client import tiling
+
+
+def _make_labels(width, height):
+    labels = np.zeros((height, width), dtype='int64')
+    label = 1
+    for y in range(5, height - 20, 30):
+        for x in range(3, width - 25, 37):
+            labels[y:y + 20, x:x + 25] = label
+            label += 1
+    return labels
+
+
+class TestTiling(object):
+
+    def test_get_tile_boxes(self):
+        boxes = tiling.get_tile_boxes(250, 100, 100, 20)
+        assert boxes == [(0, 0, 100, 100), (80, 0, 180, 100),
+                         (150, 0, 250, 100)]
+
+        # small images are a single tile
+        assert tiling.get_tile_boxes(50, 60, 100) == [(0, 0, 50, 60)]
+
+        # tiles cover the whole image
+        boxes = tiling.get_tile_boxes(333, 257, 64, 16)
+        covered = np.zeros((257, 333), dtype='bool')
+        for left, upper, right, lower in boxes:
+            assert right - left == 64 and lower - upper == 64
+            covered[upper:lower, left:right] = True
+        assert covered.all()
+
+        with pytest.raises(ValueError):
+            tiling.get_tile_boxes(100, 100, 10, 10)
+
+    def test_write_tiles(self, tmpdir):
+        tmpdir = str(tmpdir)
+        filepath = os.path.join(tmpdir, 'image.png')
+        data = np.random.randint(0, 255, size=(150, 200), dtype='uint8')
+        Image.fromarray(data).save(filepath)
+        assert tiling.get_image_size(filepath) == (200, 150)
+
+        tiles = tiling.write_tiles(filepath, tmpdir, 100, 10)
+        assert len(tiles) == 6
+        for path, (left, upper, right, lower) in tiles:
+            with Image.open(path) as im:
+                np.testing.assert_array_equal(
+                    np.array(im), data[upper:lower, left:right])
+
+    def test_read_and_save_labels(self, tmpdir):
+        tmpdir = str(tmpdir)
+        labels = _make_labels(100, 80)
+        path = tiling.save_labels(labels, os.path.join(tmpdir, 'a.tif'))
+        np.testing.assert_array_equal(tiling.read_labels(path), labels)
+
+        zippath = os.path.join(tmpdir, 'results.zip')
+        with zipfile.ZipFile(zippath, 'w') as zf:
+            zf.write(path, 'results/a_feature_0.tif')
+        np.testing.assert_array_equal(tiling.read_labels(zippath), labels)
+
+        with zipfile.ZipFile(zippath, 'w') as zf:
+            pass
+        with pytest.raises(ValueError):
+            tiling.read_labels(zippath)
+
+    def test_stitch_labels(self):
+        width, height = 250, 180
+        labels = _make_labels(width, height)
+
+        tiles = []
+        for box in tiling.get_tile_boxes(width, height, 100, 30):
+            left, upper, right, lower = box
+            tile = labels[upper:lower, left:right]
+            # each tile is labeled independently
+            tile = np.where(tile > 0, tile * 7 + 3, 0)
+            tiles.append((tile, box))
+
+        stitched = tiling.stitch_labels(tiles, width, height)
+        assert stitched.shape == labels.shape
+        assert stitched.max() == labels.max()
+        np.testing.assert_array_equal(stitched > 0, labels > 0)
+
+        # each object has a single, unique label
+        pairs = np.unique(np.stack([labels.ravel(), stitched.ravel()]),
+                          axis=1)
+        assert pairs.shape[1] == labels.max() + 1
+
+    def test_stitch_labels_from_files(self, tmpdir):
+        tmpdir = str(tmpdir)
+        width, height = 250, 180
+        labels = _make_labels(width, height)
+
+        tiles = []
+        for box in tiling.get_tile_boxes(width, height, 100, 30):
+            left, upper, right, lower = box
+            path = os.path.join(tmpdir, '{}_{}.tif'.format(left, upper))
+            tiling.save_labels(labels[upper:lower, left:right], path)
+            tiles.append((path, box))
+
+        # tiles are read one at a time into a 32-bit image
+        stitched = tiling.stitch_labels(tiles, width, height)
+        assert stitched.dtype == np.int32
+        np.testing.assert_array_equal(stitched > 0, labels > 0)
+        pairs = np.unique(np.stack([labels.ravel(), stitched.ravel()]),
+                          axis=1)
+        assert pairs.shape[1] == labels.max() + 1
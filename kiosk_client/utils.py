@@ -28,11 +28,15 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import hashlib
+import logging
 import os
-
-from PIL import Image
+import shutil
+import zipfile
 
 from twisted.internet import reactor
+from twisted.internet import threads
 from twisted.internet.task import deferLater
 
 
@@ -67,16 +71,58 @@ def sleep(seconds):
     return deferLater(reactor, seconds, lambda: None)
 
 
+def get_file_hash(filepath, block_size=2 ** 20):
+    """Returns the SHA-256 hex digest of the file, read in blocks."""
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def defer_map(func, iterable, num_workers=4):
+    """Lazily map func over iterable using the reactor's thread pool.
+
+    Yields a Deferred for each item, in order, which fires with the tuple
+    (item, func(item)). At most num_workers items are in flight at once,
+    so the iterable is consumed as the results are consumed.
+    """
+    pending = collections.deque()
+    for item in iterable:
+        d = threads.deferToThread(func, item)
+        d.addCallback(lambda result, item=item: (item, result))
+        pending.append(d)
+        if len(pending) >= max(int(num_workers), 1):
+            yield pending.popleft()
+
+    while pending:
+        yield pending.popleft()
+
+
 def is_image_file(filepath):
     """Returns True if the file is an image file, otherwise False"""
+    from PIL import Image  # pylint: disable=import-outside-toplevel
     try:
         with Image.open(filepath) as im:
             im.verify()
         return True
+    except Image.DecompressionBombError as err:
+        logging.getLogger('kiosk_client').warning(
+            'Skipping `%s`, use tiling to process large images: %s',
+            filepath, err)
+        return False
     except:  # pylint: disable=bare-except
+        logging.getLogger('kiosk_client').debug(
+            'Skipping `%s`, it is not an image file.', filepath)
         return False
 
 
+def is_archive_file(filepath):
+    """Returns True if the file is a supported archive, otherwise False"""
+    _, ext = os.path.splitext(filepath.lower())
+    return ext in {'.zip'}
+
+
 def iter_image_files(path, include_archives=True):
     archive_extensions = {'.zip'}
     if os.path.isfile(path):
@@ -97,3 +143,201 @@ def iter_image_files(path, include_archives=True):
             # process all images
             elif is_image_file(filepath):
                 yield filepath
+
+
+def iter_bundles(paths, max_bytes, max_count=0):
+    """Group small files together to be bundled into a single archive.
+
+    Files are grouped in order until the group would be larger than
+    max_bytes or have more than max_count files. Archives and files larger
+    than max_bytes are never bundled and are yielded in their own group.
+
+    Args:
+        paths (iterable): The filepaths to group.
+        max_bytes (int): The maximum total size of each group.
+        max_count (int): The maximum number of files in each group.
+            Unlimited if 0.
+
+    Yields:
+        list: The filepaths of each group.
+    """
+    bundle, bundle_size = [], 0
+    for path in paths:
+        size = os.path.getsize(path)
+        if is_archive_file(path) or size >= max_bytes:
+            yield [path]
+            continue
+
+        is_full = max_count and len(bundle) >= max_count
+        if bundle and (is_full or bundle_size + size > max_bytes):
+            yield bundle
+            bundle, bundle_size = [], 0
+
+        bundle.append(path)
+        bundle_size += size
+
+    if bundle:
+        yield bundle
+
+
+def write_bundle(paths, dest):
+    """Write the files into a new zip archive.
+
+    Each file is given a unique name in the archive, so that files with
+    the same basename in different directories do not collide.
+
+    Args:
+        paths (list): The filepaths to bundle.
+        dest (str): The filepath of the new zip archive.
+
+    Returns:
+        dict: The name of each file in the archive mapped to its filepath.
+    """
+    members = {}
+    # images are already compressed, store them as-is
+    with zipfile.ZipFile(dest, 'w', zipfile.ZIP_STORED) as zf:
+        for i, path in enumerate(paths):
+            arcname = '{:06d}_{}'.format(i, os.path.basename(path))
+            zf.write(path, arcname)
+            members[arcname] = path
+    return members
+
+
+def extract_bundle_results(results_zip, members, dest_dir):
+    """Extract the results of a bundle, renamed after the original files.
+
+    Result files in the archive are matched to the bundled file whose name
+    (without extension) prefixes the result's name. The prefix is replaced
+    with the name of the original file, and the directory structure of the
+    original files is preserved.
+
+    Args:
+        results_zip (str): The zip archive of the bundle's results.
+        members (dict): The name of each file in the bundle mapped to its
+            original filepath, as returned by write_bundle().
+        dest_dir (str): The directory in which to save the results.
+
+    Returns:
+        dict: The original filepaths mapped to a list of their result files.
+    """
+    # match the longest prefix first
+    stems = sorted(((os.path.splitext(a)[0], p) for a, p in members.items()),
+                   key=lambda x: len(x[0]), reverse=True)
+
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(p))
+                               for p in members.values()])
+
+    results = {p: [] for p in members.values()}
+    with zipfile.ZipFile(results_zip, 'r') as zf:
+        for info in zf.infolist():
+            if info.filename.endswith('/'):
+                continue  # directory
+            basename = os.path.basename(info.filename)
+            for stem, path in stems:
+                if basename.startswith(stem):
+                    break
+            else:
+                continue  # not the result of a bundled file
+
+            original = os.path.splitext(os.path.abspath(path))[0]
+            original = os.path.relpath(original, root)
+            dest = os.path.join(dest_dir, original + basename[len(stem):])
+            if not os.path.isdir(os.path.dirname(dest)):
+                os.makedirs(os.path.dirname(dest))
+            with zf.open(info) as src, open(dest, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            results[path].append(dest)
+    return results
+
+
+def shard_zip(filepath, num_shards, dest_dir, by='bytes'):
+    """Split a zip archive into balanced sub-archives.
+
+    Members are streamed from the original archive into the shards without
+    being extracted to disk. Shards are balanced either by the number of
+    members or by the uncompressed size of the members, in which case the
+    largest members are assigned first to the smallest shard.
+
+    Args:
+        filepath (str): The zip archive to split.
+        num_shards (int): The number of sub-archives to create.
+        dest_dir (str): The directory in which to save the sub-archives.
+        by (str): Balance the shards by "bytes" or member "count".
+
+    Returns:
+        list: The filepaths of the non-empty sub-archives.
+    """
+    if by not in {'bytes', 'count'}:
+        raise ValueError('`by` must be either "bytes" or "count", got %s.' %
+                         by)
+
+    stem = os.path.splitext(os.path.basename(filepath))[0]
+    with zipfile.ZipFile(filepath, 'r') as src:
+        infos = [i for i in src.infolist() if not i.filename.endswith('/')]
+        num_shards = max(min(int(num_shards), len(infos)), 1)
+
+        shards = [[] for _ in range(num_shards)]
+        if by == 'count':
+            for i, info in enumerate(infos):
+                shards[i * num_shards // len(infos)].append(info)
+        else:
+            sizes = [0] * num_shards
+            for info in sorted(infos, key=lambda x: x.file_size, reverse=True):
+                smallest = sizes.index(min(sizes))
+                shards[smallest].append(info)
+                sizes[smallest] += info.file_size
+
+        paths = []
+        for i, shard in enumerate(s for s in shards if s):
+            dest = os.path.join(dest_dir, '{}_shard{}.zip'.format(stem, i))
+            with zipfile.ZipFile(dest, 'w') as dst:
+                for info in shard:
+                    # copy the ZipInfo, writing updates its offsets
+                    new_info = zipfile.ZipInfo(info.filename, info.date_time)
+                    new_info.compress_type = info.compress_type
+                    new_info.external_attr = info.external_attr
+                    new_info.file_size = info.file_size  # for zip64 check
+                    with src.open(info) as f, dst.open(new_info, 'w') as g:
+                        shutil.copyfileobj(f, g)
+            paths.append(dest)
+    return paths
+
+
+def merge_results(filepaths, dest):
+    """Merge the result files of several jobs into a single zip archive.
+
+    The members of zip archives are streamed into the new archive, other
+    files are added as-is. Members whose name is already taken are
+    prefixed with the index of their result file.
+
+    Args:
+        filepaths (list): The result files to merge.
+        dest (str): The filepath of the merged zip archive.
+
+    Returns:
+        str: The filepath of the merged zip archive.
+    """
+    names = set()
+
+    def _get_name(name, i):
+        if name in names:
+            name = '{}/{}'.format(i, name)
+        names.add(name)
+        return name
+
+    with zipfile.ZipFile(dest, 'w', zipfile.ZIP_DEFLATED) as dst:
+        for i, filepath in enumerate(filepaths):
+            if not zipfile.is_zipfile(filepath):
+                dst.write(filepath, _get_name(os.path.basename(filepath), i))
+                continue
+
+            with zipfile.ZipFile(filepath, 'r') as src:
+                for info in src.infolist():
+                    if info.filename.endswith('/'):
+                        continue
+                    with src.open(info) as f:
+                        name = _get_name(info.filename, i)
+                        zip64 = info.file_size > zipfile.ZIP64_LIMIT
+                        with dst.open(name, 'w', force_zip64=zip64) as g:
+                            shutil.copyfileobj(f, g)
+    return dest
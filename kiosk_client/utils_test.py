@@ -34,7 +34,9 @@ import zipfile
 
 from PIL import Image
 import pytest
+import pytest_twisted
 
+from kiosk_client import tiling
 from kiosk_client import utils
 
 
@@ -44,7 +46,30 @@ class TestUtils(object):
         download_dir = utils.get_download_path()
         assert os.path.isdir(download_dir)
 
-    def test_is_image_file(self, tmpdir):
+    def test_get_file_hash(self, tmpdir):
+        path1 = os.path.join(str(tmpdir), 'a.txt')
+        path2 = os.path.join(str(tmpdir), 'b.txt')
+        for path in (path1, path2):
+            with open(path, 'w') as f:
+                f.write('content' * 1000)
+
+        digest = utils.get_file_hash(path1, block_size=64)
+        assert digest == utils.get_file_hash(path2)
+
+        with open(path2, 'a') as f:
+            f.write('more')
+        assert digest != utils.get_file_hash(path2)
+
+    @pytest_twisted.inlineCallbacks
+    def test_defer_map(self):
+        items = list(range(10))
+        results = []
+        for d in utils.defer_map(lambda x: x * 2, iter(items), 3):
+            result = yield d
+            results.append(result)
+        assert results == [(x, x * 2) for x in items]
+
+    def test_is_image_file(self, tmpdir, monkeypatch):
         # Test valid image
         tmpdir = str(tmpdir)
         valid_image = os.path.join(tmpdir, 'image.png')
@@ -62,6 +87,12 @@ class TestUtils(object):
         missing_image = os.path.join(tmpdir, 'nofile.png')
         assert not utils.is_image_file(missing_image)
 
+        # Test image too large for Pillow, unless large images are allowed
+        monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 1000)
+        assert not utils.is_image_file(valid_image)
+        tiling.allow_large_images()
+        assert utils.is_image_file(valid_image)
+
     def test_iter_image_files(self, tmpdir):
         # test image files
         tmpdir = str(tmpdir)
@@ -100,6 +131,126 @@ class TestUtils(object):
         results = utils.iter_image_files(valid_images[0])
         assert set(list(results)) == set((valid_images[0],))
 
+    def test_iter_bundles(self, tmpdir):
+        tmpdir = str(tmpdir)
+        sizes = [10, 10, 10, 50, 10, 10]
+        paths = []
+        for i, size in enumerate(sizes):
+            path = os.path.join(tmpdir, 'file%s.png' % i)
+            with open(path, 'wb') as f:
+                f.write(b'0' * size)
+            paths.append(path)
+
+        zippath = os.path.join(tmpdir, 'test.zip')
+        zipfile.ZipFile(zippath, 'w').close()
+        paths.append(zippath)
+
+        # large files and archives are not bundled
+        bundles = list(utils.iter_bundles(paths, max_bytes=25))
+        assert bundles == [paths[0:2], [paths[3]], [paths[2], paths[4]],
+                           [zippath], [paths[5]]]
+
+        bundles = list(utils.iter_bundles(paths, max_bytes=100, max_count=2))
+        assert bundles == [paths[0:2], paths[2:4], [zippath], paths[4:6]]
+
+    def test_write_and_extract_bundle(self, tmpdir):
+        tmpdir = str(tmpdir)
+        paths = []
+        for d in ('a', 'b'):
+            os.makedirs(os.path.join(tmpdir, d))
+            path = os.path.join(tmpdir, d, 'image.png')
+            img = Image.new('RGB', (8, 8), (255, 255, 255))
+            img.save(path, 'PNG')
+            paths.append(path)
+
+        bundle = os.path.join(tmpdir, 'bundle.zip')
+        members = utils.write_bundle(paths, bundle)
+        assert sorted(members.values()) == sorted(paths)
+        with zipfile.ZipFile(bundle, 'r') as zf:
+            assert set(zf.namelist()) == set(members)
+
+        # simulate the results of the bundle
+        results_zip = os.path.join(tmpdir, 'results.zip')
+        with zipfile.ZipFile(results_zip, 'w') as zf:
+            for arcname in members:
+                stem = os.path.splitext(arcname)[0]
+                zf.writestr('results/%s_feature_0.tif' % stem, arcname)
+            zf.writestr('unrelated.txt', 'unrelated')
+
+        dest_dir = os.path.join(tmpdir, 'output')
+        os.makedirs(dest_dir)
+        results = utils.extract_bundle_results(results_zip, members, dest_dir)
+        assert set(results) == set(paths)
+        for arcname, path in members.items():
+            assert len(results[path]) == 1
+            result = results[path][0]
+            assert os.path.basename(result) == 'image_feature_0.tif'
+            # the directory structure is preserved
+            assert os.path.basename(os.path.dirname(result)) in ('a', 'b')
+            with open(result, 'r') as f:
+                assert f.read() == arcname
+
+    def test_shard_zip(self, tmpdir):
+        tmpdir = str(tmpdir)
+        zippath = os.path.join(tmpdir, 'test.zip')
+        sizes = [100, 60, 50, 40, 10]
+        with zipfile.ZipFile(zippath, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr('subdir/', '')
+            for i, size in enumerate(sizes):
+                zf.writestr('subdir/file%s.png' % i, '0' * size)
+
+        shard_dir = os.path.join(tmpdir, 'shards')
+        os.makedirs(shard_dir)
+
+        def _get_members(paths):
+            members = []
+            for path in paths:
+                with zipfile.ZipFile(path, 'r') as zf:
+                    members.append({i.filename: i.file_size
+                                    for i in zf.infolist()})
+            return members
+
+        shards = utils.shard_zip(zippath, 2, shard_dir, by='bytes')
+        members = _get_members(shards)
+        assert len(members) == 2
+        assert sorted(sum(m.values()) for m in members) == [120, 140]
+        with zipfile.ZipFile(shards[0], 'r') as zf:
+            assert zf.read('subdir/file0.png') == b'0' * 100
+
+        shards = utils.shard_zip(zippath, 2, shard_dir, by='count')
+        assert sorted(len(m) for m in _get_members(shards)) == [2, 3]
+
+        # there cannot be more shards than members
+        shards = utils.shard_zip(zippath, 10, shard_dir)
+        assert len(shards) == len(sizes)
+
+        with pytest.raises(ValueError):
+            utils.shard_zip(zippath, 2, shard_dir, by='invalid')
+
+    def test_merge_results(self, tmpdir):
+        tmpdir = str(tmpdir)
+        results = []
+        for i in range(2):
+            path = os.path.join(tmpdir, 'results%s.zip' % i)
+            with zipfile.ZipFile(path, 'w') as zf:
+                zf.writestr('result%s.tif' % i, 'result')
+                zf.writestr('duplicate.tif', str(i))
+            results.append(path)
+
+        path = os.path.join(tmpdir, 'image.tif')
+        with open(path, 'w') as f:
+            f.write('not a zip')
+        results.append(path)
+
+        dest = os.path.join(tmpdir, 'merged.zip')
+        assert utils.merge_results(results, dest) == dest
+        with zipfile.ZipFile(dest, 'r') as zf:
+            names = set(zf.namelist())
+            assert names == {'result0.tif', 'result1.tif', 'duplicate.tif',
+                             '1/duplicate.tif', 'image.tif'}
+            assert zf.read('duplicate.tif') == b'0'
+            assert zf.read('1/duplicate.tif') == b'1'
+
     def test_strip_bucket_prefix(self):
         names = [
             'uploads',
@@ -0,0 +1,75 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Recompute the costs of past runs under alternate pricing.
+
+The JSON or columnar (.npz) output of runs with --calculate-cost includes
+the lifetime and labels of each node, so no Grafana queries are needed.
+Nodes whose machine type or GPU is not in the pricing file are reported
+as unpriced.
+
+    python -m kiosk_client.whatif output.json --pricing pricing.json
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+
+from kiosk_client import analyze
+from kiosk_client import columnar
+from kiosk_client import settings
+from kiosk_client.cost import recompute_costs
+from kiosk_client.pricing import Pricing
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Recompute the costs of past runs under alternate '
+                    'pricing without querying Grafana.')
+    parser.add_argument('summaries', nargs='+',
+                        help='JSON or .npz output files of past runs.')
+    parser.add_argument('--pricing', default=settings.PRICING_FILE,
+                        help='The pricing file to apply.')
+    parser.add_argument('--region', default=settings.PRICING_REGION,
+                        help='The region of the prices to apply.')
+    args = parser.parse_args()
+
+    pricing = Pricing(args.pricing, args.region)
+    results = {}
+    for path in args.summaries:
+        summary, columns = analyze.load(path)
+        num_done = 0
+        if columnar.num_jobs(columns):
+            statuses = columnar.decode(columns, 'status')
+            num_done = int(sum(status == 'done' for status in statuses))
+        results[path] = recompute_costs(summary, pricing, num_done=num_done)
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/kiosk-client/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Tests for recomputing the costs of past runs"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import sys
+
+import pytest
+
+from kiosk_client import columnar
+from kiosk_client import whatif
+
+
+def _write_json(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f)
+    return path
+
+
+class TestWhatIf(object):
+
+    def test_main(self, tmpdir, capsys, monkeypatch):
+        tmpdir = str(tmpdir)
+        node = {'lifetime': 3600, 'instance_type': 'n1-highmem-2',
+                'gpu': 'nvidia-tesla-v100', 'preemptible': True,
+                'node_pool': 'gpu'}
+        run = _write_json(os.path.join(tmpdir, 'run.json'), {
+            'node_data': {'node1': node},
+            'job_data': [{'status': 'done'}, {'status': 'done'}],
+        })
+        pricing = _write_json(os.path.join(tmpdir, 'pricing.json'), {
+            'version': 'test',
+            'default_region': 'a',
+            'regions': {
+                'a': {
+                    'machines': {'n1-highmem-2': {'preemptible': 1}},
+                    'gpus': {'nvidia-tesla-v100': {'preemptible': 3}},
+                    'networking_costs': 1,
+                },
+                'b': {
+                    'machines': {'n1-highmem-2': {'preemptible': 2}},
+                    'gpus': {'nvidia-tesla-v100': {'preemptible': 6}},
+                },
+            },
+        })
+
+        # the default region of the pricing file
+        monkeypatch.setattr(sys, 'argv', ['whatif', run,
+                                          '--pricing', pricing])
+        whatif.main()
+        results = json.loads(capsys.readouterr().out)
+        assert list(results) == [run]
+        costs = results[run]
+        assert costs['pricing']['region'] == 'a'
+        assert costs['pricing']['version'] == 'test'
+        assert costs['gpu_node_cost'] == 4
+        assert costs['total_node_and_networking_costs'] == 5
+        assert costs['node_pools']['gpu']['cost'] == 4
+        assert costs['jobs_per_dollar'] == 2 / 5
+
+        # another region, and several runs
+        monkeypatch.setattr(sys, 'argv', ['whatif', run, run,
+                                          '--pricing', pricing,
+                                          '--region', 'b'])
+        whatif.main()
+        results = json.loads(capsys.readouterr().out)
+        assert results[run]['pricing']['region'] == 'b'
+        assert results[run]['total_node_and_networking_costs'] == 8
+
+        # a columnar run, with a node of an unknown machine type
+        npz = os.path.join(tmpdir, 'run.npz')
+        columnar.save_columns(
+            npz, [{'status': 'done'}, {'status': 'failed'}],
+            {'node_data': {'node1': node, 'node2': dict(
+                node, instance_type='unknown')}})
+        monkeypatch.setattr(sys, 'argv', ['whatif', npz,
+                                          '--pricing', pricing])
+        whatif.main()
+        costs = json.loads(capsys.readouterr().out)[npz]
+        assert costs['gpu_node_cost'] == 4
+        assert list(costs['unpriced_nodes']) == ['node2']
+        assert costs['jobs_per_dollar'] is None
+
+        # an unknown region
+        monkeypatch.setattr(sys, 'argv', ['whatif', run,
+                                          '--pricing', pricing,
+                                          '--region', 'c'])
+        with pytest.raises(ValueError):
+            whatif.main()
+
+        # no summaries
+        monkeypatch.setattr(sys, 'argv', ['whatif'])
+        with pytest.raises(SystemExit):
+            whatif.main()
@@ -54,6 +54,7 @@ setup(name=about['__title__'],
           about['__url__'], about['__version__']),
       python_requires=">=2.7, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3.*, !=3.4.*",
       install_requires=['google-cloud-storage',
+                        'numpy',
                         'Pillow',
                         'python-decouple',
                         'python-dateutil',
@@ -65,6 +66,7 @@ setup(name=about['__title__'],
                     'pytest-cov',
                     'pytest-mock']},
       packages=find_packages(),
+      package_data={'kiosk_client': ['data/*.json']},
       long_description=readme,
       long_description_content_type='text/markdown',
       classifiers=[